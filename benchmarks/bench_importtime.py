@@ -0,0 +1,71 @@
+""" Import time of `thousandwords -h` and of loading the magics, from `python -X importtime`,
+checked against a regression budget. Exits with status 1 when a budget is exceeded.
+
+  python benchmarks/bench_importtime.py [--runs 5] [--verbose]
+"""
+import sys
+import argparse
+import subprocess
+
+MARKER = "--thousandwords-importtime--"
+
+# (label, setup, statement, budget in ms); setup imports aren't counted
+SCENARIOS = [
+  (
+    "thousandwords -h",
+    "",
+    "from thousandwords.cli import main\n"
+    "sys.argv = ['thousandwords', '-h']\n"
+    "try:\n"
+    "  main()\n"
+    "except SystemExit:\n"
+    "  pass",
+    100,
+  ),
+  (
+    "magics",
+    "from IPython.core.interactiveshell import InteractiveShell\n"
+    "InteractiveShell.instance()",
+    "import thousandwords.publish",
+    150,
+  ),
+]
+
+def measure(setup: str, statement: str):
+  """(total ms, [(cumulative ms, module)] of top-level imports) for statement after setup"""
+  code = f"import sys\n{setup}\nsys.stderr.write({MARKER!r} + '\\n')\n{statement}\n"
+  proc = subprocess.run(
+    [sys.executable, "-X", "importtime", "-c", code],
+    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True,
+  )
+  lines = proc.stderr.split(MARKER + "\n", 1)[1].splitlines()
+  imports = []
+  for line in lines:
+    if not line.startswith("import time:"):
+      continue
+    _, cumulative_us, name = line[len("import time:"):].split("|")
+    if not cumulative_us.strip().isdigit() or name.startswith("  "):
+      # header, or nested and already counted in its parent's cumulative time
+      continue
+    imports.append((int(cumulative_us) / 1000, name.strip()))
+  return sum(ms for ms, _ in imports), imports
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument("--runs", type=int, default=5, help="runs per scenario, the fastest is kept")
+  parser.add_argument("--verbose", action="store_true", help="list the slowest top-level imports")
+  args = parser.parse_args()
+
+  over_budget = False
+  print(f"{'scenario':<20}{'ms':>8}{'budget':>8}")
+  for label, setup, statement, budget in SCENARIOS:
+    total, imports = min((measure(setup, statement) for _ in range(args.runs)), key=lambda r: r[0])
+    over_budget |= total > budget
+    print(f"{label:<20}{total:>8.1f}{budget:>8}{'  OVER BUDGET' if total > budget else ''}")
+    if args.verbose:
+      for ms, name in sorted(imports, reverse=True)[:10]:
+        print(f"  {ms:>8.1f}  {name}")
+  sys.exit(1 if over_budget else 0)
+
+if __name__ == "__main__":
+  main()
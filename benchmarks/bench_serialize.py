@@ -0,0 +1,85 @@
+""" Peak memory and wall-clock of publishing a DataFrame dependency the way %%publish
+does: SERIALIZATION_CACHE.add into a Serializer scheduling on an Uploader, then the
+upload run, streamed part by part to a stub bucket. Publishes twice per cache budget,
+the second one replaying the cache when the frame fits.
+
+  python benchmarks/bench_serialize.py [--size-mb 1024] [--cache-mb 0 1 4096]
+"""
+import argparse
+import tempfile
+import time
+import tracemalloc
+import os
+import numpy as np
+import pandas as pd
+from thousandwords.cache import SERIALIZATION_CACHE
+from thousandwords.client import Client
+from thousandwords.dedup import UploadIndex
+from thousandwords.serializer import Serializer
+from thousandwords.transfer import Uploader
+
+class Bucket:
+  """upload_fileobj reading the payload in parts like a multipart upload, discarding it"""
+  def __init__(self):
+    self.nbytes = 0
+
+  def upload_fileobj(self, f, bucket, key, ExtraArgs=None, Config=None):
+    while True:
+      part = f.read(Config.multipart_chunksize)
+      if not part:
+        return
+      self.nbytes += len(part)
+
+class BenchClient(Client):
+  def __init__(self):
+    super().__init__()
+    self.bucket = Bucket()
+
+  @property
+  def s3(self):
+    return self.bucket
+
+  def exists(self, key):
+    return False
+
+def publish(df, index_path):
+  client = BenchClient()
+  uploader = Uploader(client, index=UploadIndex(index_path))
+  srz = Serializer(uploader.schedule)
+  tracemalloc.reset_peak()
+  base, _ = tracemalloc.get_traced_memory()
+  start = time.perf_counter()
+  SERIALIZATION_CACHE.add(srz, 'df', df)
+  serialized = time.perf_counter()
+  uploader.run(quiet=True)
+  done = time.perf_counter()
+  _, peak = tracemalloc.get_traced_memory()
+  return client.bucket.nbytes, serialized - start, done - start, peak - base
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument("--size-mb", type=int, default=1024, help="frame size in MiB")
+  parser.add_argument("--cache-mb", type=int, nargs='+', default=[0, 1, 4096], help="serialization cache budgets in MiB")
+  args = parser.parse_args()
+
+  ncols = 8
+  nrows = args.size_mb * 2 ** 20 // (8 * ncols)
+  df = pd.DataFrame({f'c{i}': np.random.rand(nrows) for i in range(ncols)})
+  print(f"DataFrame {nrows} x {ncols}: {df.memory_usage(index=False).sum() / 2 ** 20:.0f} MiB")
+
+  tracemalloc.start()
+  print(f"{'cache MiB':>10}{'publish':>9}{'uploaded MiB':>14}{'serialize s':>13}{'total s':>9}{'peak MiB':>10}{'cached MiB':>12}")
+  with tempfile.TemporaryDirectory() as tmp:
+    for i, cache_mb in enumerate(args.cache_mb):
+      # the process-wide cache, as used by %%publish, with the budget under test
+      SERIALIZATION_CACHE.clear()
+      SERIALIZATION_CACHE._max_bytes = cache_mb * 2 ** 20
+      for n in (1, 2):
+        nbytes, ser, total, peak = publish(df, os.path.join(tmp, f'index{i}-{n}'))
+        print(
+          f"{cache_mb:>10}{n:>9}{nbytes / 2 ** 20:>14.0f}{ser:>13.2f}{total:>9.2f}"
+          f"{peak / 2 ** 20:>10.0f}{SERIALIZATION_CACHE.size / 2 ** 20:>12.0f}"
+        )
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+from thousandwords import aio
+from thousandwords.aio import AsyncClient, run_sync
+
+class FakeClient:
+  instance = 'localhost:1234'
+
+  def __init__(self):
+    self.release = threading.Event()
+
+  def create_cell(self, input):
+    return threading.current_thread().name
+
+  def wait_for_callback(self, id, timeout=None, cancel=None):
+    self.release.wait(10)
+    return id
+
+async def add(a, b):
+  await asyncio.sleep(0)
+  return a + b
+
+def test_run_sync_without_loop():
+  assert run_sync(add(1, 2)) == 3
+
+def test_run_sync_inside_running_loop():
+  async def main():
+    return run_sync(add(2, 2))
+  assert asyncio.run(main()) == 4
+
+def test_async_client_runs_off_the_loop_thread():
+  client = AsyncClient(client=FakeClient())
+  async def main():
+    return await asyncio.gather(*[client.create_cell({}) for _ in range(3)])
+  names = asyncio.run(main())
+  assert all(name.startswith('thousandwords') for name in names)
+
+def test_short_calls_not_queued_behind_long_waits(monkeypatch):
+  monkeypatch.setenv('THOUSANDWORDS_HTTP_POOL_SIZE', '2')
+  monkeypatch.setattr(aio, '_executor', None)
+  fake = FakeClient()
+  client = AsyncClient(client=fake)
+  async def main():
+    waits = [asyncio.ensure_future(client.wait_for_callback(i)) for i in range(4)]
+    await asyncio.sleep(0.05)
+    name = await asyncio.wait_for(client.create_cell({}), 2)
+    fake.release.set()
+    return name, await asyncio.gather(*waits)
+  name, ids = asyncio.run(main())
+  assert name.startswith('thousandwords')
+  assert ids == [0, 1, 2, 3]
@@ -0,0 +1,60 @@
+import time
+import threading
+import pytest
+from thousandwords import auth
+from thousandwords.auth import CognitoAuth, TokenStore, TokenExpiredException, TOKEN_SKEW
+
+@pytest.fixture
+def tokens(tmp_path, monkeypatch):
+  monkeypatch.setenv('THOUSANDWORDS_JWT_TOKENS_PATH', str(tmp_path / 'tokens'))
+  monkeypatch.setattr(auth, 'TOKENS', TokenStore())
+  reads = []
+  read = auth._read_tokens
+  monkeypatch.setattr(auth, '_read_tokens', lambda *args: reads.append(args) or read(*args))
+  return reads
+
+def save(expires_in, id='id1'):
+  auth.TOKENS.save({'id': id, 'access': 'a', 'refresh': 'r', 'expiration': int(time.time()) + expires_in})
+
+def test_tokens_parsed_once(tokens):
+  save(3600)
+  assert [CognitoAuth().get_or_refresh_token() for _ in range(5)] == ['id1'] * 5
+  assert len(tokens) == 0
+  assert CognitoAuth().is_authd()
+
+def test_tokens_read_again_when_changed_on_disk(tokens):
+  save(3600)
+  auth.TOKENS = TokenStore()
+  assert CognitoAuth().get_or_refresh_token() == 'id1'
+  TokenStore().save({'id': 'id2', 'access': 'a', 'refresh': 'r', 'expiration': int(time.time()) + 3600})
+  assert CognitoAuth().get_or_refresh_token() == 'id2'
+  assert len(tokens) == 2
+
+def test_single_refresh_for_concurrent_callers(tokens, monkeypatch):
+  save(TOKEN_SKEW - 10)
+  refreshes = []
+  def refresh(self, refresh_token):
+    refreshes.append(refresh_token)
+    time.sleep(0.1)
+    new = {'id': 'id2', 'access': 'a', 'refresh': refresh_token, 'expiration': int(time.time()) + 3600}
+    self._save_tokens(new)
+    return new
+  monkeypatch.setattr(CognitoAuth, '_refresh_tokens', refresh)
+  results = []
+  threads = [threading.Thread(target=lambda: results.append(CognitoAuth().get_or_refresh_token())) for _ in range(8)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  assert refreshes == ['r']
+  assert results == ['id2'] * 8
+
+def test_failed_refresh_within_skew_keeps_current_token(tokens, monkeypatch):
+  def fail(self, refresh_token):
+    raise Exception("unreachable")
+  monkeypatch.setattr(CognitoAuth, '_refresh_tokens', fail)
+  save(TOKEN_SKEW - 10)
+  assert CognitoAuth().get_or_refresh_token() == 'id1'
+  save(-10)
+  with pytest.raises(TokenExpiredException):
+    CognitoAuth().get_or_refresh_token()
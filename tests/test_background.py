@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import pytest
+from IPython.core.interactiveshell import InteractiveShell
+
+SHELL = InteractiveShell.instance()
+
+from thousandwords import publish
+from thousandwords.publish import PublishMagic, Publication
+
+class FakeClient:
+  def __init__(self):
+    self.objects = {}
+
+  @property
+  def s3(self):
+    raise RuntimeError("Unable to locate credentials")
+
+  def exists(self, key):
+    return key in self.objects
+
+class FakeAsyncClient:
+  def __init__(self):
+    self.client = FakeClient()
+
+  async def run_cell(self, req):
+    return {"stdout": "", "stderr": "", "outputs": [], "userNS": []}
+
+  async def create_cell(self, input):
+    return "cell1"
+
+  async def create_invite(self, input):
+    return "invite1"
+
+@pytest.fixture(autouse=True)
+def fakes(monkeypatch, tmp_path):
+  monkeypatch.setenv('THOUSANDWORDS_UPLOAD_INDEX_PATH', str(tmp_path / 'index'))
+  monkeypatch.setattr(publish, 'AsyncClient', FakeAsyncClient)
+  monkeypatch.setattr(publish, 'JOBS', [])
+
+def test_background_publish(capsys):
+  magic = PublishMagic(SHELL)
+  pub = magic.publish('x = 1\nprint(x)', public=True, background=True)
+  assert pub.wait(5).endswith('c/cell1')
+  assert pub.state == 'done' and pub.error is None
+  assert capsys.readouterr().out == ''
+  magic.publish_status()
+  assert capsys.readouterr().out == f"[{pub.id}] 'x = 1' done {pub.url}\n"
+
+def test_background_failure_recorded():
+  SHELL.user_ns['data'] = list(range(10000))
+  pub = PublishMagic(SHELL).publish('print(len(data))', public=True, with_variables=True, background=True)
+  with pytest.raises(Exception, match="RuntimeError: Unable to locate credentials"):
+    pub.wait(5)
+  assert pub.state == 'failed' and pub.done
+
+def test_wait_times_out_while_in_progress():
+  release = threading.Event()
+  async def slow():
+    await asyncio.get_running_loop().run_in_executor(None, release.wait, 5)
+  pub = Publication(FakeAsyncClient(), ['x = 1'], public=True, background=True)
+  pub.state = 'executing'
+  pub.start(slow())
+  with pytest.raises(TimeoutError, match="still executing"):
+    pub.wait(0.05)
+  release.set()
+  assert pub.wait(5) is None
@@ -0,0 +1,52 @@
+import time
+import threading
+from thousandwords.batch import read_requests, run_batches
+from thousandwords.client import Client
+
+def test_read_requests(tmp_path):
+  (tmp_path / 'a.jsonl').write_text('{"n": 1}\n\nnot json\n{"n": 2}\n')
+  (tmp_path / 'b.json').write_text('{"n": 3}')
+  (tmp_path / 'notes.txt').write_text('ignored')
+  reqs = list(read_requests([str(tmp_path)]))
+  assert [ref.rsplit('/', 1)[1] for ref, _ in reqs] == ['a.jsonl:1', 'a.jsonl:3', 'a.jsonl:4', 'b.json']
+  assert isinstance(reqs[1][1], ValueError)
+  assert [p for _, p in reqs if not isinstance(p, Exception)] == [{"n": 1}, {"n": 2}, {"n": 3}]
+
+def test_run_batches_bounds_in_flight():
+  lock = threading.Lock()
+  state = {'active': 0, 'peak': 0, 'sizes': []}
+  def fn(payloads):
+    with lock:
+      state['active'] += 1
+      state['peak'] = max(state['peak'], state['active'])
+      state['sizes'].append(len(payloads))
+    time.sleep(0.02)
+    with lock:
+      state['active'] -= 1
+    return [Exception('odd') if p % 2 else p * 10 for p in payloads]
+  records = []
+  reqs = [(f'r{i}', i) for i in range(23)] + [('bad', ValueError('parse'))]
+  ok, failed = run_batches(fn, iter(reqs), records.append, batch_size=5, max_in_flight=2)
+  assert (ok, failed) == (12, 12)
+  assert state['peak'] <= 2
+  assert sorted(state['sizes']) == [3, 5, 5, 5, 5]
+  by_ref = {r['ref']: r for r in records}
+  assert by_ref['r4'] == {'ref': 'r4', 'result': 40}
+  assert by_ref['r3'] == {'ref': 'r3', 'error': 'odd'}
+  assert by_ref['bad']['error'] == 'parse'
+
+def test_aliased_mutations(monkeypatch):
+  sent = {}
+  def execute(self, auth_type, query, variables, operation):
+    sent.update(query=query, variables=variables)
+    return {
+      'data': {'m0': {'id': 'c0'}, 'm1': None, 'm2': {'id': 'c2'}},
+      'errors': [{'path': ['m1'], 'message': 'invalid title'}],
+    }
+  monkeypatch.setattr(Client, '_execute', execute)
+  results = Client()._execute_aliased('AWS_IAM', 'createCell', 'input', 'CreateCellInput!', '{ id }', [{}, {}, {}], 'graphql.mutation')
+  assert 'm2: createCell(input: $v2) { id }' in sent['query']
+  assert 'mutation Batch($v0: CreateCellInput!, $v1: CreateCellInput!, $v2: CreateCellInput!)' in sent['query']
+  assert sorted(sent['variables']) == ['v0', 'v1', 'v2']
+  assert results[0] == {'id': 'c0'} and results[2] == {'id': 'c2'}
+  assert str(results[1]) == 'invalid title'
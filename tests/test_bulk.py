@@ -0,0 +1,103 @@
+import os
+import json
+import argparse
+import boto3
+import pytest
+from moto import mock_aws
+from thousandwords.client import Client
+from thousandwords.cli import storage_get_many
+from thousandwords.bulk import expand_sources, put_many, get_many, sync_up, sync_down, s3_etag, unchanged
+from thousandwords.transfer import MIN_PART_SIZE
+
+@pytest.fixture
+def client(monkeypatch):
+  monkeypatch.setenv('THOUSANDWORDS_STORAGE_BUCKET', 'bucket')
+  with mock_aws():
+    s3 = boto3.client('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket='bucket')
+    client = Client()
+    client._s3 = s3
+    yield client
+
+def make_tree(root):
+  (root / 'sub').mkdir(parents=True)
+  (root / 'a.txt').write_bytes(b'a' * 10)
+  (root / 'sub' / 'b.bin').write_bytes(os.urandom(MIN_PART_SIZE + 100))
+  return root
+
+def test_expand_sources(tmp_path):
+  root = make_tree(tmp_path / 'data')
+  items = expand_sources([str(root)], 'ds')
+  assert [k for _, k in items] == ['ds/a.txt', 'ds/sub/b.bin']
+  items = expand_sources([str(root / '*.txt')])
+  assert items == [(str(root / 'a.txt'), 'a.txt')]
+
+def test_multipart_etag(client, tmp_path):
+  path = str(make_tree(tmp_path) / 'sub' / 'b.bin')
+  put_many(client, [(path, 'b.bin')], part_size=MIN_PART_SIZE, quiet=True)
+  head = client.head('uploads/b.bin')
+  assert head['ETag'].strip('"') == s3_etag(path, MIN_PART_SIZE)
+  assert unchanged(path, head, MIN_PART_SIZE)
+  # recognized whatever the local part size setting
+  assert unchanged(path, head, 16 * 2 ** 20)
+
+def test_put_many_skips_unchanged(client, tmp_path):
+  root = make_tree(tmp_path / 'data')
+  items = expand_sources([str(root)], 'ds')
+  entries = put_many(client, items, part_size=MIN_PART_SIZE, quiet=True)
+  assert [e['status'] for e in entries] == ['uploaded', 'uploaded']
+  (root / 'a.txt').write_bytes(b'b' * 10)
+  entries = put_many(client, items, part_size=MIN_PART_SIZE, quiet=True)
+  assert [e['status'] for e in entries] == ['uploaded', 'unchanged']
+
+def test_get_many_resumes_partial_download(client, tmp_path):
+  root = make_tree(tmp_path / 'data')
+  put_many(client, expand_sources([str(root)], 'ds'), part_size=MIN_PART_SIZE, quiet=True)
+  out = tmp_path / 'out'
+  out.mkdir()
+  data = (root / 'sub' / 'b.bin').read_bytes()
+  partial = out / 'b.bin.part'
+  partial.write_bytes(data[:1000])
+  (out / 'b.bin.part.etag').write_text(client.head('uploads/ds/sub/b.bin')['ETag'])
+  items = [('ds/sub/b.bin', str(out / 'b.bin')), ('ds/a.txt', str(out / 'a.txt'))]
+  entries = get_many(client, items, quiet=True)
+  assert [e['status'] for e in entries] == ['downloaded', 'downloaded']
+  assert (out / 'b.bin').read_bytes() == data
+  assert not partial.exists()
+  assert [e['status'] for e in get_many(client, items, quiet=True)] == ['unchanged', 'unchanged']
+
+def test_sync_round_trip(client, tmp_path):
+  root = make_tree(tmp_path / 'data')
+  sync_up(client, str(root), 'ds', part_size=MIN_PART_SIZE, quiet=True)
+  out = tmp_path / 'copy'
+  entries = sync_down(client, str(out), 'ds', quiet=True)
+  assert len(entries) == 2
+  assert (out / 'sub' / 'b.bin').read_bytes() == (root / 'sub' / 'b.bin').read_bytes()
+  assert (out / 'a.txt').read_bytes() == b'a' * 10
+
+def test_get_many_refuses_paths_outside_out(tmp_path):
+  out = tmp_path / 'out'
+  out.mkdir()
+  (out / 'link').symlink_to(tmp_path)
+  manifest = tmp_path / 'manifest.jsonl'
+  for keys, entry in [
+    (['../../.bashrc'], None),
+    (['/etc/passwd'], None),
+    (['link/x'], None),
+    ([], {'key': 'ds/a.txt', 'path': '../a.txt'}),
+  ]:
+    manifest.write_text(json.dumps(entry) + '\n' if entry else '')
+    args = argparse.Namespace(
+      keys=keys, out=str(out), from_manifest=str(manifest) if entry else None, jobs=None, manifest=None,
+    )
+    with pytest.raises(Exception, match="outside of"):
+      storage_get_many(args)
+
+def test_get_many_streams_compressed_objects(client, tmp_path, monkeypatch):
+  data = b'compressible ' * 200000
+  client.upload_stream('uploads/z', data, compression='gzip')
+  monkeypatch.setattr(Client, 'get', lambda self, key: pytest.fail("read whole"))
+  path = tmp_path / 'z'
+  [entry] = get_many(client, [('z', str(path))], quiet=True)
+  assert entry['status'] == 'downloaded'
+  assert path.read_bytes() == data
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import gc
+import weakref
+from thousandwords_core.serializer import Serializer
+from thousandwords import serializer
+from thousandwords.cache import SerializationCache, fingerprint
+
+class Puts:
+  def __init__(self):
+    self.count = 0
+
+  def __call__(self, name, data):
+    self.count += 1
+    return f'uploads/{self.count}'
+
+def serialize(cache, name, obj, srz_class=Serializer):
+  puts = Puts()
+  srz = srz_class(puts)
+  cache.add(srz, name, obj)
+  return srz.ns, puts.count
+
+def test_unchanged_object_is_not_serialized_again(monkeypatch):
+  cache = SerializationCache(max_bytes=2 ** 30)
+  df = pd.DataFrame({'a': np.arange(10000), 'b': ['x'] * 10000})
+  ns1, _ = serialize(cache, 'df', df)
+  monkeypatch.setattr(Serializer, 'add', lambda *args: (_ for _ in ()).throw(AssertionError))
+  ns2, puts = serialize(cache, 'frame', df)
+  assert puts == 1
+  assert ns2[0]['name'] == 'frame'
+  assert ns2[0]['serializationType'] == ns1[0]['serializationType']
+
+def test_mutation_changes_fingerprint():
+  arr = np.zeros(100)
+  fp = fingerprint(arr)
+  arr[-1] = 1
+  assert fingerprint(arr) != fp
+  df = pd.DataFrame({'a': [1, 2, 3]})
+  fp = fingerprint(df)
+  df['b'] = 1
+  assert fingerprint(df) != fp
+  assert fingerprint([1, 2, 3]) is None
+
+def test_budget_and_collection():
+  cache = SerializationCache(max_bytes=3 * 8 * 10000)
+  arrays = [np.arange(10000) for _ in range(4)]
+  for i, arr in enumerate(arrays):
+    serialize(cache, f'a{i}', arr)
+  assert cache.size <= 3 * 8 * 10000
+  assert len(cache._entries) < 4
+  del arrays, arr
+  assert cache.size == 0
+
+def test_zero_copy_payloads_dont_keep_objects_alive():
+  cache = SerializationCache(max_bytes=2 ** 30)
+  arr = np.arange(10 ** 6, dtype=np.float64)
+  ref = weakref.ref(arr)
+  serialize(cache, 'arr', arr, serializer.Serializer)
+  assert cache.size >= arr.nbytes
+  del arr
+  gc.collect()
+  assert ref() is None
+  assert cache.size == 0
+
+def test_objects_over_budget_are_not_copied(monkeypatch):
+  from thousandwords import cache as cache_module
+  copies = []
+  detached = cache_module._detached
+  monkeypatch.setattr(cache_module, '_detached', lambda data: copies.append(data) or detached(data))
+  cache = SerializationCache(max_bytes=2 ** 20)
+  arr = np.arange(10 ** 6, dtype=np.float64)
+  ns, puts = serialize(cache, 'arr', arr, serializer.Serializer)
+  assert puts == 1 and ns[0]['name'] == 'arr'
+  assert copies == [] and cache.size == 0
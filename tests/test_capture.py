@@ -0,0 +1,56 @@
+import os
+import gc
+import sys
+from IPython.utils.capture import RichOutput
+from thousandwords.capture import CapturedIO, StreamingCapturedIO, TextBuffer
+
+def test_outputs_built_once():
+  io = CapturedIO('out', '', '', [{'data': {'text/plain': 'a'}}, {'data': {'text/plain': 'b'}}])
+  first = io.outputs
+  assert [o.data['text/plain'] for o in first] == ['a', 'b']
+  assert all(a is b for a, b in zip(first, io.outputs))
+  assert str(io) == 'out'
+
+def test_large_text_spilled(capsys):
+  text = ''.join(f'line {i}\n' for i in range(100))
+  buf = TextBuffer(spill_size=50)
+  for line in text.splitlines(keepends=True):
+    buf.write(line)
+  path = buf.spilled
+  assert path and os.path.exists(path)
+  assert len(buf.head) == 50
+  assert buf.getvalue() == text
+  buf.show(sys.stdout)
+  out = capsys.readouterr().out
+  assert out.startswith(text[:50]) and f'{len(text) - 50} more characters in {path}' in out
+  del buf
+  gc.collect()
+  assert not os.path.exists(path)
+
+def test_show_and_expand_spilled(monkeypatch, capsys):
+  monkeypatch.setenv('THOUSANDWORDS_CAPTURE_SPILL_SIZE', '10')
+  io = CapturedIO('x' * 100, 'err', ['Traceback'])
+  io.show()
+  captured = capsys.readouterr()
+  assert captured.out.startswith('x' * 10 + '\n[90 more characters')
+  assert captured.err == 'errTraceback'
+  io.expand()
+  assert capsys.readouterr().out == 'x' * 100
+  assert io.stdout == 'x' * 100
+
+def test_streaming_renders_as_fed(monkeypatch, capsys):
+  monkeypatch.setenv('THOUSANDWORDS_CAPTURE_SPILL_SIZE', '20')
+  displayed = []
+  monkeypatch.setattr(RichOutput, 'display', lambda self: displayed.append(self.data))
+  io = StreamingCapturedIO()
+  io.feed({'stdout': 'hello\n'})
+  assert capsys.readouterr().out == 'hello\n'
+  io.feed({'outputs': [{'data': {'text/plain': '1'}}], 'stderr': 'warn\n'})
+  assert displayed == [{'text/plain': '1'}]
+  assert capsys.readouterr().err == 'warn\n'
+  io.feed({'stdout': 'y' * 30})
+  io.feed({'stdout': 'z' * 30})
+  out = capsys.readouterr().out
+  assert 'stdout continues in' in out and 'z' * 30 not in out
+  assert io.stdout == 'hello\n' + 'y' * 30 + 'z' * 30
+  assert io.outputs[0].data == {'text/plain': '1'}
@@ -0,0 +1,107 @@
+import time
+from datetime import datetime, timezone
+import pytest
+import responses
+from thousandwords import auth
+from thousandwords.auth import TokenStore
+from thousandwords.client import Client, AuthContext
+from thousandwords.credentials import CognitoCredentials
+
+ENDPOINT = 'https://api.example.com/graphql'
+
+@pytest.fixture(autouse=True)
+def config(tmp_path, monkeypatch):
+  monkeypatch.setenv('THOUSANDWORDS_API_ENDPOINT', ENDPOINT)
+  monkeypatch.setenv('THOUSANDWORDS_API_REGION', 'eu-west-1')
+  monkeypatch.setenv('THOUSANDWORDS_JWT_TOKENS_PATH', str(tmp_path / 'tokens'))
+  monkeypatch.setattr(auth, 'TOKENS', TokenStore())
+  monkeypatch.setattr('thousandwords.client.TOKENS', auth.TOKENS)
+
+def header_auth(value):
+  def sign(r):
+    r.headers['Authorization'] = value
+    return r
+  return sign
+
+@pytest.fixture
+def resolves(monkeypatch):
+  calls = []
+  def resolve(self, auth_type):
+    calls.append(auth_type)
+    return AuthContext('AMAZON_COGNITO_USER_POOLS', header_auth(f'token{len(calls)}'), time.time() + 3600)
+  monkeypatch.setattr(Client, '_resolve_auth', resolve)
+  return calls
+
+def reply():
+  return {'data': {'createCell': {'id': 'x'}, 'createInvite': {'id': 'x'}}}
+
+@responses.activate
+def test_auth_resolved_once_per_client(resolves):
+  responses.post(ENDPOINT, json=reply())
+  client = Client()
+  client.create_cell({})
+  client.create_invite({})
+  client.create_cell({})
+  assert resolves == [None]
+  assert client.auth_mode == 'AMAZON_COGNITO_USER_POOLS'
+
+@responses.activate
+def test_expired_auth_resolved_again(resolves):
+  responses.post(ENDPOINT, json=reply())
+  client = Client()
+  client.create_cell({})
+  client.auth_context().expires_at = time.time() - 1
+  client.create_cell({})
+  assert resolves == [None, None]
+  assert [c.request.headers['Authorization'] for c in responses.calls] == ['token1', 'token2']
+
+@responses.activate
+def test_unauthorized_retried_with_fresh_auth(resolves):
+  responses.post(ENDPOINT, status=401, json={'errors': [{'message': 'Unauthorized'}]})
+  responses.post(ENDPOINT, json=reply())
+  assert Client().create_cell({}) == 'x'
+  assert [c.request.headers['Authorization'] for c in responses.calls] == ['token1', 'token2']
+
+@responses.activate
+def test_rejected_iam_credentials_fetched_again(tmp_path, monkeypatch):
+  for key in ('credentials_path', 'guest_id_path'):
+    monkeypatch.setenv(f'THOUSANDWORDS_{key.upper()}', str(tmp_path / key))
+  monkeypatch.setenv('THOUSANDWORDS_IDENTITY_POOL_ID', 'pool')
+  fetched = []
+  def fetch(self, jwt_token):
+    fetched.append(f'AK{len(fetched) + 1}')
+    return {'IdentityId': 'guest-id', 'Credentials': {
+      'AccessKeyId': fetched[-1], 'SecretKey': 'secret', 'SessionToken': 'token',
+      'Expiration': datetime.fromtimestamp(time.time() + 3600, timezone.utc),
+    }}
+  monkeypatch.setattr(CognitoCredentials, '_fetch_credentials', fetch)
+  responses.post(ENDPOINT, status=401, json={'errors': [{'message': 'Unauthorized'}]})
+  responses.post(ENDPOINT, json=reply())
+  client = Client()
+  assert client.auth_mode == 'AWS_IAM'
+  assert client.create_cell({}) == 'x'
+  # the cache file still held the rejected keys
+  assert fetched == ['AK1', 'AK2']
+  signed_with = [c.request.headers['Authorization'].split('Credential=')[1].split('/')[0] for c in responses.calls]
+  assert signed_with == ['AK1', 'AK2']
+
+@responses.activate
+def test_per_operation_override(resolves):
+  responses.post(ENDPOINT, json=reply())
+  client = Client()
+  client.create_cell({})
+  client.create_cell({}, auth_type='AWS_IAM')
+  client.create_cell({}, auth_type='AWS_IAM')
+  assert resolves == [None, 'AWS_IAM']
+
+def test_default_mode_falls_back_to_guest():
+  class Credentials:
+    credentials = {'Credentials': {
+      'AccessKeyId': 'AK', 'SecretKey': 'secret', 'SessionToken': 'token',
+      'Expiration': datetime.fromtimestamp(time.time() + 3600),
+    }}
+  client = Client()
+  client._cognito_creds = Credentials()
+  assert client.auth_mode == 'AWS_IAM'
+  auth.TOKENS.save({'id': 'jwt', 'access': 'a', 'refresh': 'r', 'expiration': int(time.time()) + 3600})
+  assert Client().auth_mode == 'AMAZON_COGNITO_USER_POOLS'
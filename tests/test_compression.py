@@ -0,0 +1,30 @@
+import os
+import pytest
+from thousandwords.compression import (
+  CODECS, Codec, compress_payload, decompress_payload, choose_level, get_codec,
+)
+
+ENCODINGS = [cls.encoding for cls in CODECS if cls.available()]
+
+@pytest.mark.parametrize('encoding', ENCODINGS)
+def test_roundtrip_chunks(encoding):
+  chunks = [b'header', memoryview(b'abc' * 100000), b'trailer']
+  payload, used = compress_payload(chunks, encoding)
+  assert used == encoding
+  data = b''.join(payload)
+  assert len(data) < 300000
+  assert decompress_payload(data, used) == b''.join(chunks)
+
+@pytest.mark.parametrize('encoding', ENCODINGS)
+def test_incompressible_is_sent_as_is(encoding):
+  data = os.urandom(10 ** 6)
+  assert choose_level(get_codec(encoding), data) is None
+  assert compress_payload(data, encoding) == (data, None)
+
+def test_no_compression_by_default():
+  assert compress_payload(b'abc' * 1000, 'none') == (b'abc' * 1000, None)
+  assert decompress_payload(b'abc', None) == b'abc'
+
+def test_codec_is_abstract():
+  with pytest.raises(TypeError):
+    Codec()
@@ -0,0 +1,79 @@
+import time
+import threading
+import thousandwords.sessions
+from thousandwords.config import Config
+
+STACK = {
+  "aws_user_files_s3_bucket": "bucket",
+  "aws_user_pools_client_id": "client",
+  "aws_user_pools_id": "pool",
+  "aws_cognito_region": "eu-west-1",
+  "aws_cognito_identity_pool_id": "identity-pool",
+  "aws_user_pool_domain": "auth.example.com",
+  "aws_appsync_graphqlEndpoint": "https://api.example.com/graphql",
+  "aws_appsync_region": "eu-west-1",
+}
+
+class FakeResponse:
+  def __init__(self, status_code, headers=None):
+    self.status_code = status_code
+    self.headers = headers or {}
+
+  def raise_for_status(self):
+    pass
+
+  def json(self):
+    return STACK
+
+class FakeSession:
+  def __init__(self):
+    self.requests = []
+
+  def get(self, url, headers=None, timeout=None):
+    self.requests.append(headers)
+    time.sleep(0.05)
+    if headers.get("If-None-Match") == '"v1"':
+      return FakeResponse(304)
+    return FakeResponse(200, {"ETag": '"v1"', "Last-Modified": "Sat, 17 Oct 2026 10:00:00 GMT"})
+
+def make_config(tmp_path, monkeypatch):
+  session = FakeSession()
+  monkeypatch.setattr(thousandwords.sessions, "get_session", lambda: session)
+  config = Config(str(tmp_path / "config"))
+  config.instance = "example.com"
+  return config, session
+
+def test_parallel_reads_fetch_once(tmp_path, monkeypatch):
+  config, session = make_config(tmp_path, monkeypatch)
+  values = []
+  props = ["api_endpoint", "storage_bucket", "cognito_region", "user_pool_id"] * 4
+  threads = [threading.Thread(target=lambda p=p: values.append(getattr(config, p))) for p in props]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  assert len(session.requests) == 1
+  assert len(values) == len(props)
+  assert config._get("stack_etag") == '"v1"'
+
+def test_stale_values_revalidated_in_background(tmp_path, monkeypatch):
+  config, session = make_config(tmp_path, monkeypatch)
+  assert config.api_endpoint == STACK["aws_appsync_graphqlEndpoint"]
+  config._set("stack_fetched_at", "0")
+  assert config.api_endpoint == STACK["aws_appsync_graphqlEndpoint"]
+  assert config.storage_bucket == "bucket"
+  deadline = time.monotonic() + 5
+  while config._stack_is_stale() and time.monotonic() < deadline:
+    time.sleep(0.01)
+  assert not config._stack_is_stale()
+  assert len(session.requests) == 2
+  assert session.requests[1]["If-None-Match"] == '"v1"'
+  assert "If-Modified-Since" in session.requests[1]
+
+def test_overridden_values_not_revalidated(tmp_path, monkeypatch):
+  config, session = make_config(tmp_path, monkeypatch)
+  monkeypatch.setenv("THOUSANDWORDS_API_ENDPOINT", "https://override.example.com/graphql")
+  assert config._stack_is_stale()
+  assert config.api_endpoint == "https://override.example.com/graphql"
+  assert not config._stack_refreshing.locked()
+  assert session.requests == []
@@ -0,0 +1,64 @@
+import time
+import pytest
+from datetime import datetime, timezone
+from thousandwords.credentials import CognitoCredentials, REFRESH_SKEW
+
+class FakeCognito:
+  def __init__(self, ttl):
+    self.ttl = ttl
+    self.calls = 0
+
+  def get_id(self, **kwargs):
+    return {'IdentityId': 'guest-id'}
+
+  def get_credentials_for_identity(self, IdentityId, Logins=None):
+    self.calls += 1
+    return {
+      'IdentityId': IdentityId,
+      'Credentials': {
+        'AccessKeyId': f'AK{self.calls}',
+        'SecretKey': 'secret',
+        'SessionToken': 'token',
+        'Expiration': datetime.fromtimestamp(int(time.time()) + self.ttl, timezone.utc),
+      },
+    }
+
+@pytest.fixture(autouse=True)
+def config(tmp_path, monkeypatch):
+  for key in ('credentials_path', 'guest_id_path', 'jwt_tokens_path'):
+    monkeypatch.setenv(f'THOUSANDWORDS_{key.upper()}', str(tmp_path / key))
+  monkeypatch.setenv('THOUSANDWORDS_IDENTITY_POOL_ID', 'pool')
+
+def credentials(cognito):
+  creds = CognitoCredentials()
+  creds._cognito = cognito
+  return creds
+
+def test_credentials_are_reused_across_instances(tmp_path):
+  cognito = FakeCognito(ttl=3600)
+  first = credentials(cognito).credentials
+  second = credentials(cognito).credentials
+  assert cognito.calls == 1
+  assert second['Credentials']['AccessKeyId'] == first['Credentials']['AccessKeyId']
+  assert (tmp_path / 'credentials_path').stat().st_mode & 0o777 == 0o600
+
+def test_expiring_credentials_are_renewed():
+  cognito = FakeCognito(ttl=REFRESH_SKEW - 10)
+  credentials(cognito).credentials
+  creds = credentials(cognito).credentials
+  assert cognito.calls == 2
+  assert creds['Credentials']['AccessKeyId'] == 'AK2'
+
+def test_renew_skips_rejected_cached_credentials():
+  cognito = FakeCognito(ttl=3600)
+  creds = credentials(cognito)
+  creds.credentials
+  creds.renew()
+  assert cognito.calls == 2
+  assert creds.credentials['Credentials']['AccessKeyId'] == 'AK2'
+  # already renewed by another process: the newer cached keys are reused
+  other = credentials(cognito)
+  other._credentials = {'Credentials': {'AccessKeyId': 'AK1'}}
+  other.renew()
+  assert cognito.calls == 2
+  assert other.credentials['Credentials']['AccessKeyId'] == 'AK2'
@@ -0,0 +1,29 @@
+import sys
+import json
+import subprocess
+
+HEAVY = ["boto3", "botocore", "requests", "requests_aws4auth", "click", "nanoid", "cloudpickle", "http.server"]
+
+def loaded_after(setup, statement):
+  code = (
+    f"import sys, json\n{setup}\nbefore = set(sys.modules)\n{statement}\n"
+    f"print(json.dumps(sorted(set(sys.modules) - before)))"
+  )
+  out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+  return set(json.loads(out.splitlines()[-1]))
+
+def test_cli_help_skips_heavy_imports():
+  loaded = loaded_after(
+    "", "from thousandwords.cli import main\nsys.argv = ['thousandwords', '-h']\n"
+    "try:\n  main()\nexcept SystemExit:\n  pass"
+  )
+  assert "thousandwords.cli" in loaded
+  assert not loaded & set(HEAVY)
+
+def test_magics_skip_heavy_imports():
+  loaded = loaded_after(
+    "from IPython.core.interactiveshell import InteractiveShell\nInteractiveShell.instance()",
+    "import thousandwords.publish",
+  )
+  assert "thousandwords.publish" in loaded
+  assert not loaded & set(HEAVY)
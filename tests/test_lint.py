@@ -0,0 +1,45 @@
+import ast
+import pytest
+from thousandwords import lint
+from thousandwords.lint import LintCache, resolveUndefined, parse
+
+@pytest.fixture
+def parses(monkeypatch):
+  monkeypatch.setattr(lint, 'LINT_CACHE', LintCache(max_entries=2))
+  calls = []
+  real = ast.parse
+  def counting(code, *args, **kwargs):
+    calls.append(code)
+    return real(code, *args, **kwargs)
+  monkeypatch.setattr(lint.ast, 'parse', counting)
+  return calls
+
+def names(undefs):
+  return [u.message_args[0] for u in undefs]
+
+def test_cached_by_source(parses):
+  code = 'y = x + 1\n' * 2000 + 'print(z)'
+  assert names(resolveUndefined(code)) == ['x'] * 2000 + ['z']
+  assert names(resolveUndefined(code)) == ['x'] * 2000 + ['z']
+  assert len(parses) == 1
+  assert parse(code) is parse(code)
+  assert len(parses) == 1
+
+def test_pre_parsed_tree(parses):
+  code = 'import os\nos.path.join(a, b)'
+  tree = ast.parse(code)
+  parses.clear()
+  assert names(resolveUndefined(code, tree)) == ['a', 'b']
+  assert parses == []
+
+def test_least_recently_used_dropped(parses):
+  for code in ['a', 'b', 'a', 'c', 'a', 'b']:
+    resolveUndefined(code)
+  assert parses == ['a', 'b', 'c', 'b']
+
+def test_syntax_error_not_cached(parses):
+  for _ in range(2):
+    with pytest.raises(Exception) as exc:
+      resolveUndefined('gibberish aksldf ;lkj asd')
+    assert 'aksldf' in str(exc.value)
+  assert len(parses) == 2
@@ -0,0 +1,88 @@
+import io
+import boto3
+import requests
+import pytest
+from datetime import datetime
+from moto import mock_aws
+from thousandwords import lite as lite_module
+from thousandwords.lite import LiteS3, LiteCognitoIdentity, ClientError
+from thousandwords.transfer import upload_stream, MIN_PART_SIZE
+
+CREDS = {"AccessKeyId": "AKIDEXAMPLE", "SecretKey": "secret", "SessionToken": "token"}
+
+@pytest.fixture
+def s3():
+  with mock_aws():
+    s3 = boto3.client('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket='bucket')
+    yield s3
+
+@pytest.fixture
+def lite():
+  return LiteS3(lambda: CREDS, 'us-east-1')
+
+def test_put_get_head(s3, lite):
+  lite.put_object(Bucket='bucket', Key='uploads/a b', Body=b'hello', ContentEncoding='gzip')
+  resp = lite.get_object(Bucket='bucket', Key='uploads/a b')
+  assert resp['Body'].read() == b'hello'
+  assert resp['ContentEncoding'] == 'gzip'
+  assert lite.head_object(Bucket='bucket', Key='uploads/a b')['ContentLength'] == 5
+  assert s3.get_object(Bucket='bucket', Key='uploads/a b')['Body'].read() == b'hello'
+
+def test_missing_object(s3, lite):
+  with pytest.raises(ClientError) as exc:
+    lite.head_object(Bucket='bucket', Key='missing')
+  assert exc.value.response['ResponseMetadata']['HTTPStatusCode'] == 404
+  with pytest.raises(ClientError) as exc:
+    lite.get_object(Bucket='bucket', Key='missing')
+  assert exc.value.response['Error']['Code'] == 'NoSuchKey'
+
+@pytest.mark.parametrize('wrap', [
+  lambda data: data,
+  lambda data: io.BytesIO(data),
+  lambda data: (data[i:i + 1000003] for i in range(0, len(data), 1000003)),
+])
+def test_multipart_upload_stream(s3, lite, wrap):
+  data = bytes(range(256)) * (MIN_PART_SIZE * 2 // 256 + 7)
+  upload_stream(
+    lite, 'bucket', 'obj', wrap(data), part_size=MIN_PART_SIZE, max_concurrency=3,
+    extra_args={'ContentEncoding': 'zstd'},
+  )
+  assert s3.head_object(Bucket='bucket', Key='obj', PartNumber=1)['PartsCount'] == 3
+  resp = s3.get_object(Bucket='bucket', Key='obj')
+  assert resp['ContentEncoding'] == 'zstd'
+  assert resp['Body'].read() == data
+
+def test_cognito_identity():
+  with mock_aws():
+    pool = boto3.client('cognito-identity', region_name='us-east-1').create_identity_pool(
+      IdentityPoolName='pool', AllowUnauthenticatedIdentities=True,
+    )['IdentityPoolId']
+    cognito = LiteCognitoIdentity('us-east-1')
+    identity = cognito.get_id(IdentityPoolId=pool)['IdentityId']
+    resp = cognito.get_credentials_for_identity(IdentityId=identity)
+    assert resp['IdentityId'] == identity
+    assert isinstance(resp['Credentials']['Expiration'], datetime)
+    assert resp['Credentials']['AccessKeyId']
+
+class RecordingSession:
+  def __init__(self):
+    self.bodies = []
+
+  def request(self, method, url, data=None, auth=None, **kwargs):
+    self.bodies.append(data)
+    auth(requests.Request(method, url, data=data).prepare())
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.headers['ETag'] = '"etag"'
+    return resp
+
+def test_buffers_sent_without_copy(lite, monkeypatch):
+  session = RecordingSession()
+  monkeypatch.setattr(lite_module, 'get_session', lambda: session)
+  data = bytearray(b'part of a larger payload')
+  lite.put_object(Bucket='bucket', Key='a', Body=memoryview(data)[8:])
+  lite.upload_part(Bucket='bucket', Key='a', UploadId='u', PartNumber=1, Body=data)
+  view, whole = session.bodies
+  assert view.obj is data and bytes(view) == b'a larger payload'
+  assert whole.obj is data
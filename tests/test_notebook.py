@@ -0,0 +1,109 @@
+import json
+import asyncio
+import pytest
+from IPython.core.interactiveshell import InteractiveShell
+from thousandwords.notebook import read_notebook, parse_cells
+
+SHELL = InteractiveShell.instance()
+
+from thousandwords import publish
+from thousandwords.publish import PublishMagic
+
+def test_parse_cells():
+  assert parse_cells(None) is None
+  assert parse_cells('1, 3-5,8') == {1, 3, 4, 5, 8}
+  with pytest.raises(Exception):
+    parse_cells('1,a')
+
+def test_read_notebook(tmp_path):
+  nb = tmp_path / 'report.ipynb'
+  nb.write_text(json.dumps({'nbformat': 4, 'cells': [
+    {'cell_type': 'markdown', 'source': ['# Report']},
+    {'cell_type': 'code', 'source': ['x = 1\n', 'print(x)'], 'outputs': [
+      {'output_type': 'stream', 'name': 'stdout', 'text': ['1\n']},
+      {'output_type': 'display_data', 'data': {'text/plain': ['a\n', 'b'], 'application/json': {'a': 1}}, 'metadata': {}},
+      {'output_type': 'error', 'traceback': ['Traceback', 'ValueError']},
+    ]},
+  ]}))
+  [(source, (stdout, stderr, rich))] = read_notebook(str(nb))
+  assert source == 'x = 1\nprint(x)'
+  assert stdout == '1\n'
+  assert stderr == 'Traceback\nValueError\n'
+  assert rich == [({'text/plain': 'a\nb', 'application/json': {'a': 1}}, {})]
+
+class FakeClient:
+  s3 = None
+
+  def __init__(self):
+    self.objects = {}
+
+  def exists(self, key):
+    return key in self.objects
+
+  def upload_stream(self, key, value):
+    self.objects[key] = value
+
+class FakeAsyncClient:
+  instances = []
+
+  def __init__(self):
+    self.client = FakeClient()
+    self.run_requests = []
+    self.created = []
+    self.in_flight = self.peak = 0
+    FakeAsyncClient.instances.append(self)
+
+  async def run_cell(self, req):
+    self.run_requests.append(req)
+    self.in_flight += 1
+    self.peak = max(self.peak, self.in_flight)
+    await asyncio.sleep(0.05)
+    self.in_flight -= 1
+    return {"stdout": "", "stderr": "", "outputs": [], "userNS": []}
+
+  async def upload(self, key, data):
+    self.client.objects[key] = data
+
+  async def create_cell(self, input):
+    self.created.append(input)
+    return f"cell{len(self.created)}"
+
+  async def create_invite(self, input):
+    return f"invite-{input['cellId']}"
+
+def test_publish_all_uploads_shared_dependencies_once(monkeypatch, tmp_path, capsys):
+  monkeypatch.setenv('THOUSANDWORDS_UPLOAD_INDEX_PATH', str(tmp_path / 'index'))
+  monkeypatch.setattr(publish, 'AsyncClient', FakeAsyncClient)
+  SHELL.user_ns.update(shared=list(range(1000)), small=3)
+  cells = [
+    ('a', 'print(len(shared))'),
+    ('b', 'total = sum(shared) + small'),
+    ('c', '%time 1'),
+  ]
+  PublishMagic(SHELL).publish_all(
+    cells, public=True, with_variables=True, outputs=[('', '', [])] * 3,
+  )
+  client = FakeAsyncClient.instances[-1]
+  assert len(client.client.objects) == 1
+  [key] = client.client.objects
+  assert [[v['name'] for v in r['userNS']] for r in client.run_requests] == [['shared'], ['shared', 'small']]
+  assert {r['userNS'][0]['key'] for r in client.run_requests} == {key}
+  assert client.peak == 2
+  versions = {c['title']: c['executeRequest']['version'] for c in client.created}
+  assert versions['%time 1'] == 'local'
+  out = capsys.readouterr().out
+  assert 'join/invite-cell1' in out
+  assert all(f'c/cell{i}' in out for i in (1, 2, 3))
+
+def test_publish_all_does_not_run_cells_again_unasked(monkeypatch, tmp_path, capsys):
+  monkeypatch.setenv('THOUSANDWORDS_UPLOAD_INDEX_PATH', str(tmp_path / 'index'))
+  monkeypatch.setattr(publish, 'AsyncClient', FakeAsyncClient)
+  monkeypatch.setattr(SHELL, 'ask_yes_no', lambda *args, **kwargs: False)
+  monkeypatch.setattr(PublishMagic, '_run_locally', lambda self, cell: pytest.fail(f"ran {cell!r}"))
+  SHELL.user_ns.update(shared=list(range(1000)))
+  cells = [('In [1]', 'print(len(shared))'), ('In [2]', 'print(2)')]
+  for kwargs in ({}, {'no_variables': True}):
+    PublishMagic(SHELL).publish_all(cells, public=True, **kwargs)
+    client = FakeAsyncClient.instances[-1]
+    assert [c['title'] for c in client.created] == ['print(2)']
+    assert 'Skipping In [1]: not runnable' in capsys.readouterr().err
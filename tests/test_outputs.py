@@ -0,0 +1,69 @@
+import json
+import struct
+import itertools
+import threading
+import pytest
+from base64 import b64encode
+from thousandwords.outputs import image_size, prepare_outputs
+
+PNG = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>ii', 640, 480) + b'\x08\x06\x00\x00\x00'
+GIF = b'GIF89a' + struct.pack('<HH', 32, 16) + b'\x00' * 8
+JPEG = (
+  b'\xff\xd8'
+  + b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+  + b'\xff\xc2' + struct.pack('>HBHH', 17, 8, 200, 300) + b'\x03' + b'\x00' * 9
+)
+
+def test_image_sizes():
+  assert image_size('image/png', PNG) == (640, 480)
+  assert image_size('image/gif', GIF) == (32, 16)
+  assert image_size('image/jpeg', JPEG) == (300, 200)
+  assert image_size('image/svg+xml', '<?xml?><svg width="120px" height="80">') == (120, 80)
+  assert image_size('image/svg+xml', '<svg viewBox="0 0 50.5 20"></svg>') == (50, 20)
+  assert image_size('image/jpeg', PNG) == (None, None)
+  assert image_size('image/png', b'short') == (None, None)
+
+@pytest.fixture
+def make_key():
+  keys = itertools.count()
+  return lambda ext: f'public/{next(keys)}{ext}'
+
+def test_outputs_kept_in_order_and_images_uploaded(monkeypatch, make_key):
+  threads = set()
+  import thousandwords.outputs as outputs
+  measure = outputs.image_size
+  monkeypatch.setattr(outputs, 'image_size', lambda *args: threads.add(threading.get_ident()) or measure(*args))
+  outs = [
+    ({'text/plain': 'a'}, {}),
+    ({'image/png': b64encode(PNG).decode(), 'text/plain': '<Figure>'}, {'dpi': 72}),
+    ({'image/jpeg': b64encode(JPEG).decode()}, {}),
+    ({'image/gif': b64encode(GIF).decode()}, {}),
+  ]
+  rich, uploads = prepare_outputs(outs, make_key)
+  assert [json.loads(o['metadata']) for o in rich] == [{}, {'dpi': 72}, {}, {}]
+  assert [[r['mime'] for r in o['representations']] for o in rich] == [
+    ['text/plain'], ['image/png', 'text/plain'], ['image/jpeg'], ['image/gif'],
+  ]
+  png, jpeg, gif = (o['representations'][0] for o in rich[1:])
+  assert (png['width'], png['height'], jpeg['width'], gif['height']) == (640, 480, 300, 16)
+  assert png['key'].endswith('.png') and jpeg['key'].endswith('.jpg') and gif['key'].endswith('.gif')
+  assert [(mime, data) for mime, _, data in uploads] == [('image/png', PNG), ('image/jpeg', JPEG), ('image/gif', GIF)]
+  assert threading.get_ident() not in threads
+
+def test_large_text_offloaded(monkeypatch, make_key):
+  monkeypatch.setenv('THOUSANDWORDS_INLINE_OUTPUT_SIZE', '100')
+  html = '<table>' + '<tr><td>1</td></tr>' * 20 + '</table>'
+  table = {'rows': list(range(100))}
+  rich, uploads = prepare_outputs([
+    ({'text/html': html, 'text/plain': 'x' * 200}, {}),
+    ({'application/json': table}, {}),
+    ({'text/html': '<b>small</b>'}, {}),
+  ], make_key)
+  big_html, plain = rich[0]['representations']
+  assert 'data' not in big_html and big_html['key'].endswith('.html')
+  assert plain == {'mime': 'text/plain', 'data': 'x' * 200}
+  assert rich[1]['representations'][0]['key'].endswith('.json')
+  assert rich[2]['representations'] == [{'mime': 'text/html', 'data': '<b>small</b>'}]
+  assert [(mime, data) for mime, _, data in uploads] == [
+    ('text/html', html.encode()), ('application/json', json.dumps(table).encode()),
+  ]
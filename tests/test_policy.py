@@ -0,0 +1,47 @@
+import pytest
+import requests
+from thousandwords.policy import Policy
+
+def http_error(status):
+  response = requests.Response()
+  response.status_code = status
+  return requests.HTTPError(f"{status} error", response=response)
+
+def flaky(*errors):
+  errors = list(errors)
+  calls = []
+  def fn():
+    calls.append(1)
+    if errors:
+      raise errors.pop(0)
+    return 'ok'
+  return fn, calls
+
+def test_retries_transient_errors():
+  fn, calls = flaky(http_error(503), requests.ReadTimeout(), http_error(429))
+  assert Policy(retries=3, backoff=0.01).call(fn) == 'ok'
+  assert len(calls) == 4
+
+def test_gives_up_after_retries():
+  fn, calls = flaky(*[http_error(500)] * 5)
+  with pytest.raises(requests.HTTPError):
+    Policy(retries=2, backoff=0.01).call(fn)
+  assert len(calls) == 3
+
+def test_client_errors_are_not_retried():
+  fn, calls = flaky(http_error(400))
+  with pytest.raises(requests.HTTPError):
+    Policy(retries=3, backoff=0.01).call(fn)
+  assert len(calls) == 1
+
+def test_non_idempotent_only_retried_when_throttled():
+  fn, calls = flaky(http_error(429), http_error(502))
+  with pytest.raises(requests.HTTPError):
+    Policy(retries=3, backoff=0.01, idempotent=False).call(fn)
+  assert len(calls) == 2
+
+def test_deadline_stops_retries():
+  fn, calls = flaky(*[http_error(503)] * 5)
+  with pytest.raises(requests.HTTPError):
+    Policy(retries=5, backoff=1, deadline=0.5).call(fn)
+  assert len(calls) == 1
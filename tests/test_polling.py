@@ -0,0 +1,78 @@
+import time
+import threading
+import pytest
+from thousandwords.polling import backoff, poll_until, PollTimeout, PollCancelled
+from thousandwords.client import Client
+from thousandwords.realtime import realtime_url, Subscription, SubscriptionUnavailable
+
+def test_backoff_grows_to_maximum():
+  delays = backoff(initial=1, maximum=4, factor=2, jitter=0)
+  assert [next(delays) for _ in range(4)] == [1, 2, 4, 4]
+
+def test_poll_until_deadline():
+  start = time.monotonic()
+  with pytest.raises(PollTimeout):
+    poll_until(lambda: False, deadline=start + 0.2, delays=backoff(initial=0.05))
+  assert time.monotonic() - start < 1
+
+def test_poll_until_cancel():
+  cancel = threading.Event()
+  threading.Timer(0.1, cancel.set).start()
+  with pytest.raises(PollCancelled):
+    poll_until(lambda: False, cancel=cancel, delays=backoff(initial=10))
+
+def test_realtime_url():
+  assert realtime_url('https://abc.appsync-api.eu-west-1.amazonaws.com/graphql') == \
+    'wss://abc.appsync-realtime-api.eu-west-1.amazonaws.com/graphql'
+  with pytest.raises(SubscriptionUnavailable):
+    realtime_url('https://api.example.com/graphql')
+
+def test_wait_for_callback_falls_back_to_polling(monkeypatch):
+  monkeypatch.setenv('THOUSANDWORDS_API_ENDPOINT', 'https://api.example.com/graphql')
+  probes = []
+  def get_callback(self, id):
+    probes.append(id)
+    return id if len(probes) == 3 else None
+  monkeypatch.setattr(Client, 'get_callback', get_callback)
+  monkeypatch.setattr('thousandwords.polling.backoff', lambda: backoff(initial=0.01))
+  assert Client().wait_for_callback('cb', timeout=5) == 'cb'
+  assert probes == ['cb'] * 3
+
+class DroppedSocket:
+  def __init__(self, error):
+    self.error = error
+
+  def settimeout(self, timeout):
+    pass
+
+  def recv(self):
+    raise self.error
+
+  def send(self, data):
+    raise self.error
+
+  def close(self):
+    pass
+
+@pytest.mark.parametrize('closed', [True, False])
+def test_dropped_subscription_falls_back_to_polling(monkeypatch, closed):
+  websocket = pytest.importorskip('websocket')
+  if closed:
+    error = websocket.WebSocketConnectionClosedException("Connection to remote host was lost.")
+  else:
+    error = ConnectionResetError(104, "Connection reset by peer")
+  monkeypatch.setenv('THOUSANDWORDS_API_ENDPOINT', 'https://abc.appsync-api.eu-west-1.amazonaws.com/graphql')
+  monkeypatch.delenv('THOUSANDWORDS_CALLBACK_TRANSPORT', raising=False)
+  def enter(self):
+    self._ws = DroppedSocket(error)
+    return self
+  monkeypatch.setattr(Subscription, '__enter__', enter)
+  monkeypatch.setattr(Client, '_get_auth', lambda self, auth_type: None)
+  probes = []
+  def get_callback(self, id):
+    probes.append(id)
+    return id if len(probes) == 2 else None
+  monkeypatch.setattr(Client, 'get_callback', get_callback)
+  monkeypatch.setattr('thousandwords.polling.backoff', lambda: backoff(initial=0.01))
+  assert Client().wait_for_callback('cb', timeout=5) == 'cb'
+  assert probes == ['cb'] * 2
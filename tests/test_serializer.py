@@ -0,0 +1,31 @@
+import pickle
+import numpy as np
+import pandas as pd
+from thousandwords.serializer import Serializer
+
+def serialize(name, obj):
+  puts = {}
+  def put(name, data):
+    puts[name] = data
+    return f'uploads/{name}'
+  srz = Serializer(put)
+  srz.add(name, obj)
+  return srz.ns, puts
+
+def test_array_buffers_are_not_copied():
+  arr = np.arange(10 ** 6)
+  ns, puts = serialize('arr', arr)
+  assert ns == [{'name': 'arr', 'serializationType': 'cloudpickle', 'key': 'uploads/arr', 'value': None}]
+  chunks = puts['arr']
+  assert any(np.shares_memory(np.frombuffer(c, dtype='u1'), arr) for c in chunks if not isinstance(c, bytes))
+  assert (pickle.loads(b''.join(chunks)) == arr).all()
+
+def test_frame_roundtrip():
+  df = pd.DataFrame({'a': np.arange(10 ** 5), 'b': ['x'] * 10 ** 5, 'c': np.ones(10 ** 5)})
+  _, puts = serialize('df', df)
+  assert pickle.loads(b''.join(puts['df'])).equals(df)
+
+def test_small_values_stay_inline():
+  ns, puts = serialize('t', (1, 2))
+  assert ns[0]['serializationType'] == 'b64.cloudpickle'
+  assert puts == {}
@@ -0,0 +1,14 @@
+from thousandwords.sessions import get_session
+from thousandwords.client import _get_signer
+
+def test_session_is_shared():
+  assert get_session() is get_session()
+  adapter = get_session().get_adapter('https://example.com')
+  assert adapter.max_retries.connect >= 0
+
+def test_signer_reused_until_credentials_change(monkeypatch):
+  monkeypatch.setenv('THOUSANDWORDS_API_ENDPOINT', 'https://api.example.com/graphql')
+  monkeypatch.setenv('THOUSANDWORDS_API_REGION', 'eu-west-1')
+  signer = _get_signer('AK1', 'secret', 'token1')
+  assert _get_signer('AK1', 'secret', 'token1') is signer
+  assert _get_signer('AK2', 'secret', 'token2') is not signer
@@ -0,0 +1,99 @@
+import json
+import time
+import pytest
+import responses
+from IPython.utils.capture import RichOutput
+from thousandwords.client import Client, AuthContext
+from thousandwords.capture import StreamingCapturedIO
+
+ENDPOINT = 'https://api.example.com/graphql'
+USER_NS = [{'name': 'x', 'key': None, 'value': '1', 'serializationType': 'json'}]
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+  monkeypatch.setenv('THOUSANDWORDS_API_ENDPOINT', ENDPOINT)
+  monkeypatch.setattr(
+    Client, '_resolve_auth', lambda self, auth_type: AuthContext('AWS_IAM', None, time.time() + 3600),
+  )
+
+class MockRunServer:
+  """The GraphQL API of a remote run, streamed in pages of chunks or in one runCell reply"""
+
+  def __init__(self, pages, streaming=True):
+    self.pages = pages
+    self.streaming = streaming
+    self.log = []
+
+  def __call__(self, request):
+    body = json.loads(request.body)
+    query, variables = body['query'], body['variables']
+    if 'startRunCell' in query:
+      self.log.append('start')
+      if not self.streaming:
+        return self.reply(errors=[{
+          'message': "Validation error of type FieldUndefined: Field 'startRunCell' in type 'Mutation' is undefined",
+        }])
+      return self.reply(data={'startRunCell': {'id': 'run1'}})
+    if 'runCellOutput' in query:
+      n = int(variables['cursor'] or 0)
+      self.log.append(f'page {n}')
+      done = n + 1 == len(self.pages)
+      return self.reply(data={'runCellOutput': {
+        'cursor': str(n + 1), 'done': done, 'chunks': self.pages[n], 'userNS': USER_NS if done else None,
+      }})
+    self.log.append('runCell')
+    chunks = [c for page in self.pages for c in page]
+    return self.reply(data={'runCell': {
+      'stdout': ''.join(c.get('stdout') or '' for c in chunks),
+      'stderr': '',
+      'outputs': [o for c in chunks for o in c.get('outputs') or []],
+      'traceback': None,
+      'userNS': USER_NS,
+    }})
+
+  def reply(self, **body):
+    return 200, {}, json.dumps(body)
+
+PAGES = [
+  [{'stdout': 'step 1\n'}],
+  [],
+  [{'stdout': 'step 2\n'}, {'outputs': [{'metadata': '{}', 'representations': [{'mime': 'text/plain', 'data': '42'}]}]}],
+]
+
+@responses.activate
+def test_chunks_delivered_as_produced():
+  server = MockRunServer(PAGES)
+  responses.add_callback(responses.POST, ENDPOINT, callback=server)
+  def on_chunk(chunk):
+    server.log.append(chunk)
+  reply = Client().run_cell_streaming({'lines': []}, on_chunk)
+  assert server.log == [
+    'start', 'page 0', {'stdout': 'step 1\n'}, 'page 1', 'page 2', *PAGES[2],
+  ]
+  assert reply['stdout'] == 'step 1\nstep 2\n'
+  assert reply['outputs'] == PAGES[2][1]['outputs']
+  assert reply['userNS'] == USER_NS
+
+@responses.activate
+def test_falls_back_to_run_cell():
+  server = MockRunServer(PAGES, streaming=False)
+  responses.add_callback(responses.POST, ENDPOINT, callback=server)
+  client = Client()
+  chunks = []
+  for _ in range(2):
+    reply = client.run_cell_streaming({'lines': []}, chunks.append)
+  assert server.log == ['start', 'runCell', 'runCell']
+  assert [c['stdout'] for c in chunks] == ['step 1\nstep 2\n'] * 2
+  assert reply['userNS'] == USER_NS
+
+@responses.activate
+def test_streamed_run_rendered_live(monkeypatch, capsys):
+  displayed = []
+  monkeypatch.setattr(RichOutput, 'display', lambda self: displayed.append(self.data))
+  server = MockRunServer(PAGES)
+  responses.add_callback(responses.POST, ENDPOINT, callback=server)
+  io = StreamingCapturedIO()
+  Client().run_cell_streaming({'lines': []}, io.feed_reply)
+  assert capsys.readouterr().out == 'step 1\nstep 2\n'
+  assert displayed == [{'text/plain': '42'}]
+  assert io.stdout == 'step 1\nstep 2\n'
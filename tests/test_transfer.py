@@ -0,0 +1,195 @@
+import io
+import argparse
+import threading
+import boto3
+import pytest
+from moto import mock_aws
+from thousandwords.transfer import Uploader, UploadError, upload_stream, download_chunks, parse_range, MIN_PART_SIZE
+from thousandwords.client import Client
+from thousandwords.dedup import UploadIndex
+from thousandwords.cli import storage_get
+
+class FakeClient:
+  def __init__(self, fail=()):
+    self.s3 = None
+    self.fail = fail
+    self.objects = {}
+    self.lock = threading.Lock()
+
+  def exists(self, key):
+    return key in self.objects
+
+  def upload_stream(self, key, value):
+    if value in self.fail:
+      raise Exception("access denied")
+    with self.lock:
+      self.objects[key] = value
+
+def test_uploader_runs_all_tasks():
+  client = FakeClient()
+  uploader = Uploader(client, max_workers=4)
+  keys = [uploader.schedule(f'v{i}', b'x' * i) for i in range(10)]
+  assert len(set(keys)) == 10
+  uploader.run()
+  assert sorted(client.objects) == sorted(keys)
+  assert len(uploader) == 0
+
+def test_uploader_reports_failures_per_key():
+  client = FakeClient(fail=(b'bad',))
+  uploader = Uploader(client, max_workers=2)
+  uploader.schedule('good', b'good')
+  badkey = uploader.schedule('bad', b'bad')
+  with pytest.raises(UploadError) as exc:
+    uploader.run()
+  assert [(n, k) for n, k, _ in exc.value.failures] == [('bad', badkey)]
+  assert "'bad'" in str(exc.value) and 'access denied' in str(exc.value)
+
+class CountingClient(FakeClient):
+  def __init__(self):
+    super().__init__()
+    self.uploads = 0
+
+  def upload_stream(self, key, value):
+    self.uploads += 1
+    super().upload_stream(key, value)
+
+def test_uploader_skips_unchanged_payloads(tmp_path):
+  client = CountingClient()
+  fname = str(tmp_path / 'index')
+  uploader = Uploader(client, max_workers=2, index=UploadIndex(fname, ttl=3600, max_entries=10))
+  key1 = uploader.schedule('a', b'payload')
+  assert uploader.schedule('b', [b'pay', b'load']) == key1
+  uploader.run()
+  assert client.uploads == 1
+
+  uploader = Uploader(client, max_workers=2, index=UploadIndex(fname, ttl=3600, max_entries=10))
+  assert uploader.schedule('a', b'payload') == key1
+  uploader.run()
+  assert client.uploads == 1
+
+  # deleted remotely: uploaded again
+  del client.objects[key1]
+  uploader = Uploader(client, max_workers=2, index=UploadIndex(fname, ttl=3600, max_entries=10))
+  uploader.schedule('a', b'payload')
+  uploader.run()
+  assert client.uploads == 2
+
+def test_upload_index_eviction(tmp_path):
+  fname = str(tmp_path / 'index')
+  index = UploadIndex(fname, ttl=3600, max_entries=2)
+  digests = [index.digest(bytes([i])) for i in range(3)]
+  for i, d in enumerate(digests):
+    index.record(d, f'uploads/{i}')
+  index.lookup(digests[0])
+  index._entries[digests[1]] = ('uploads/1', 0, 0)
+  index.save()
+  index = UploadIndex(fname, ttl=3600, max_entries=2)
+  assert index.lookup(digests[0]) == 'uploads/0'
+  assert index.lookup(digests[1]) is None
+  assert index.lookup(digests[2]) == 'uploads/2'
+
+def test_upload_index_digest_is_salted(tmp_path):
+  a = UploadIndex(str(tmp_path / 'a'))
+  b = UploadIndex(str(tmp_path / 'b'))
+  assert a.digest(b'x') != b.digest(b'x')
+  assert a.digest(iter([b'x'])) is None
+
+@pytest.fixture
+def s3():
+  with mock_aws():
+    s3 = boto3.client('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket='bucket')
+    yield s3
+
+def parts(s3, key):
+  return s3.head_object(Bucket='bucket', Key=key, PartNumber=1).get('PartsCount', 1)
+
+@pytest.mark.parametrize('wrap', [
+  lambda data: data,
+  lambda data: memoryview(data),
+  lambda data: io.BytesIO(data),
+  lambda data: (data[i:i + 1000003] for i in range(0, len(data), 1000003)),
+])
+def test_upload_stream_sources(s3, wrap):
+  data = bytes(range(256)) * (MIN_PART_SIZE * 2 // 256 + 7)
+  upload_stream(s3, 'bucket', 'obj', wrap(data), part_size=MIN_PART_SIZE, max_concurrency=3)
+  assert s3.get_object(Bucket='bucket', Key='obj')['Body'].read() == data
+  assert parts(s3, 'obj') == 3
+
+def test_upload_stream_small_is_single_put(s3):
+  upload_stream(s3, 'bucket', 'small', b'hello', part_size=MIN_PART_SIZE, max_concurrency=1)
+  assert s3.get_object(Bucket='bucket', Key='small')['Body'].read() == b'hello'
+
+def test_parse_range():
+  assert parse_range('0-9', 100) == (0, 9)
+  assert parse_range('90-', 100) == (90, 99)
+  assert parse_range('-10', 100) == (90, 99)
+  assert parse_range('50-500', 100) == (50, 99)
+  with pytest.raises(ValueError):
+    parse_range('200-', 100)
+  with pytest.raises(ValueError):
+    parse_range('a-b', 100)
+
+class CountingS3:
+  """Tracks how many GETs are in flight at once"""
+  def __init__(self, s3):
+    self.s3 = s3
+    self.lock = threading.Lock()
+    self.active = 0
+    self.peak = 0
+
+  def get_object(self, **kwargs):
+    with self.lock:
+      self.active += 1
+      self.peak = max(self.peak, self.active)
+    try:
+      resp = self.s3.get_object(**kwargs)
+      resp['Body'] = io.BytesIO(resp['Body'].read())
+      return resp
+    finally:
+      with self.lock:
+        self.active -= 1
+
+def test_download_chunks_parallel_ranges(s3):
+  data = bytes(range(256)) * (MIN_PART_SIZE * 5 // 256 + 3)
+  s3.put_object(Bucket='bucket', Key='big', Body=data)
+  counting = CountingS3(s3)
+  chunks = download_chunks(counting, 'bucket', 'big', 0, len(data) - 1, part_size=MIN_PART_SIZE, max_concurrency=2)
+  assert b''.join(chunks) == data
+  assert counting.peak <= 2
+  part = b''.join(download_chunks(s3, 'bucket', 'big', 10, MIN_PART_SIZE * 3, part_size=MIN_PART_SIZE, max_concurrency=3))
+  assert part == data[10:MIN_PART_SIZE * 3 + 1]
+
+def test_iter_chunks_decompresses(s3, monkeypatch):
+  monkeypatch.setenv('THOUSANDWORDS_STORAGE_BUCKET', 'bucket')
+  client = Client()
+  client._s3 = s3
+  data = b'compressible ' * 100000
+  client.upload_stream('uploads/z', data, compression='gzip')
+  assert s3.head_object(Bucket='bucket', Key='uploads/z')['ContentEncoding'] == 'gzip'
+  assert b''.join(client.iter_chunks('uploads/z')) == data
+  with pytest.raises(Exception):
+    list(client.iter_chunks('uploads/z', byte_range='0-9'))
+  client.upload_stream('uploads/plain', data, compression='none')
+  assert b''.join(client.iter_chunks('uploads/plain', byte_range='-13')) == b'compressible '
+
+def test_uploads_not_compressed_unless_asked(s3, monkeypatch):
+  monkeypatch.setenv('THOUSANDWORDS_STORAGE_BUCKET', 'bucket')
+  monkeypatch.setenv('THOUSANDWORDS_COMPRESSION', 'gzip')
+  client = Client()
+  client._s3 = s3
+  data = b'compressible ' * 100000
+  # e.g. publish dependencies, read by the remote kernel
+  client.upload_stream('uploads/dep', data)
+  resp = s3.get_object(Bucket='bucket', Key='uploads/dep')
+  assert 'ContentEncoding' not in resp
+  assert resp['Body'].read() == data
+
+def test_storage_get_streams_to_stdout(s3, monkeypatch, capfdbinary):
+  monkeypatch.setenv('THOUSANDWORDS_STORAGE_BUCKET', 'bucket')
+  monkeypatch.setattr(Client, 's3', property(lambda self: s3))
+  data = bytes(range(256)) * (MIN_PART_SIZE // 256 + 5)
+  s3.put_object(Bucket='bucket', Key='uploads/bin', Body=data)
+  monkeypatch.setattr(Client, 'get', lambda self, key: pytest.fail("read whole"))
+  storage_get(argparse.Namespace(key='uploads/bin', out=None, range=None, part_size=MIN_PART_SIZE, concurrency=2))
+  assert capfdbinary.readouterr().out == data
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import functools
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from .client import Client
+from .config import CONFIG
+
+_executor_lock = threading.Lock()
+_executor = None
+
+def _get_executor() -> ThreadPoolExecutor:
+  global _executor
+  with _executor_lock:
+    if _executor is None:
+      _executor = ThreadPoolExecutor(
+        max_workers=CONFIG.http_pool_size, thread_name_prefix="thousandwords",
+      )
+    return _executor
+
+async def to_thread(fn, *args, **kwargs):
+  """Await a short blocking call (one HTTP request) run on the shared worker pool"""
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(_get_executor(), functools.partial(fn, *args, **kwargs))
+
+def _settle(future, result, error):
+  if future.cancelled():
+    return
+  if error is not None:
+    future.set_exception(error)
+  else:
+    future.set_result(result)
+
+async def to_own_thread(fn, *args, **kwargs):
+  """Await a long blocking call (a remote run, a callback wait, a whole upload) run on
+  a thread of its own, so it never holds a worker of the shared pool"""
+  loop = asyncio.get_running_loop()
+  future = loop.create_future()
+  def target():
+    result, error = None, None
+    try:
+      result = fn(*args, **kwargs)
+    except BaseException as e:
+      error = e
+    try:
+      loop.call_soon_threadsafe(_settle, future, result, error)
+    except RuntimeError:
+      # the loop is closed, nobody is waiting anymore
+      pass
+  threading.Thread(target=target, name="thousandwords-wait", daemon=True).start()
+  return await future
+
+def run_sync(coro):
+  """Run coro to completion from blocking code.
+
+  When this thread already runs an event loop (e.g. the IPython kernel's), the
+  coroutine gets its own loop in a helper thread instead, and this thread still
+  blocks until it completes.
+  """
+  try:
+    asyncio.get_running_loop()
+  except RuntimeError:
+    return asyncio.run(coro)
+  result = {}
+  def target():
+    try:
+      result['value'] = asyncio.run(coro)
+    except BaseException as e:
+      result['error'] = e
+  thread = threading.Thread(target=target)
+  thread.start()
+  thread.join()
+  if 'error' in result:
+    raise result['error']
+  return result['value']
+
+class AsyncClient:
+  """asyncio counterpart of Client.
+
+  Wraps the blocking Client rather than doing asynchronous I/O: calls run on a shared
+  worker pool, runs and callback waits, which can take minutes, on a thread of their
+  own. Other tasks of the awaiting loop run meanwhile, but callers that drive it with
+  run_sync, like %%publish without --background, still wait for the whole pipeline.
+  """
+
+  def __init__(
+    self,
+    instance: Optional[str] = None,
+    client: Optional[Client] = None,
+  ):
+    self._client = client or Client(instance)
+
+  @property
+  def client(self) -> Client:
+    return self._client
+
+  @property
+  def instance(self) -> str:
+    return self._client.instance
+
+  async def create_cell(self, input):
+    return await to_thread(self._client.create_cell, input)
+
+  async def create_invite(self, input):
+    return await to_thread(self._client.create_invite, input)
+
+  async def get_callback(self, id):
+    return await to_thread(self._client.get_callback, id)
+
+  async def wait_for_callback(self, id, timeout=None, cancel=None):
+    """See Client.wait_for_callback, cancelling the awaiting task stops the wait too"""
+    cancel = cancel or threading.Event()
+    try:
+      return await to_own_thread(self._client.wait_for_callback, id, timeout, cancel)
+    except asyncio.CancelledError:
+      cancel.set()
+      raise
+
+  async def run_cell(self, req):
+    return await to_own_thread(self._client.run_cell, req)
+
+  async def run_cell_streaming(self, req, on_chunk, cancel=None):
+    """See Client.run_cell_streaming, on_chunk is called from a worker thread"""
+    cancel = cancel or threading.Event()
+    try:
+      return await to_own_thread(self._client.run_cell_streaming, req, on_chunk, cancel=cancel)
+    except asyncio.CancelledError:
+      cancel.set()
+      raise
+
+  async def upload(self, key, value):
+    return await to_thread(self._client.upload, key, value)
+
+  async def upload_stream(self, key, source, **kwargs):
+    return await to_thread(self._client.upload_stream, key, source, **kwargs)
+
+  async def exists(self, key) -> bool:
+    return await to_thread(self._client.exists, key)
+
+  async def get(self, key):
+    return await to_thread(self._client.get, key)
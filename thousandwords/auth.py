@@ -1,25 +1,27 @@
 from operator import truediv
 import os
-import click
-import requests
 import secrets
 import base64
 import hashlib
 import time
-import webbrowser
+import threading
 from posixpath import join as urljoin
 from logging import getLogger
 from getpass import getpass
 from configparser import ConfigParser
-from requests.auth import AuthBase
-from urllib.parse import urlencode, urlparse, parse_qs
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Optional
+from urllib.parse import urlencode
 
 from .config import CONFIG
+from .sessions import get_session
+from .policy import get_policy, RETRYABLE_STATUSES
+from .locking import file_lock
 
 logger = getLogger("thousandwords.auth")
 
 AUTH_REDIRECT_PORTS = [20005, 20015, 20025]
+# tokens closer than this to expiry are refreshed before use
+TOKEN_SKEW = 5 * 60
 
 class TokenNotFoundException(Exception):
   def __str__(self) -> str:
@@ -29,11 +31,97 @@ class TokenExpiredException(Exception):
   def __str__(self) -> str:
     return "Your auth token has expired. Run `thousandwords login` to refresh."
 
-class CognitoJwtAuth(AuthBase):
-  """Authorization: JWT_TOKEN"""
+def _read_tokens(fname: str, instance: str) -> dict:
+  logger.info(f"Loading tokens from {fname}")
+  tokfile = ConfigParser()
+  tokfile.read(fname)
+  try:
+    tokens = dict(tokfile[instance])
+    tokens["expiration"] = int(tokens["expiration"])
+    assert "id" in tokens
+    return tokens
+  except Exception:
+    raise TokenNotFoundException
+
+def _stamp(fname: str):
+  try:
+    st = os.stat(fname)
+  except FileNotFoundError:
+    raise TokenNotFoundException
+  return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+class TokenStore:
+  """The tokens file, parsed once per process and read again only when it changes on disk.
+
+  Threads needing a refresh wait for a single one, and a lock file next to the tokens
+  makes concurrent processes refresh once too: the others pick up the saved tokens.
+  """
 
   def __init__(self):
-    self._jwt_token = CONFIG.jwt_token
+    self._cache = {}
+    self._refreshing = threading.Lock()
+
+  def load(self) -> dict:
+    fname, instance = CONFIG.jwt_tokens_path, CONFIG.instance
+    stamp = _stamp(fname)
+    cached = self._cache.get((fname, instance))
+    if cached is not None and cached[0] == stamp:
+      return dict(cached[1])
+    tokens = _read_tokens(fname, instance)
+    self._cache[(fname, instance)] = (stamp, tokens)
+    return dict(tokens)
+
+  def save(self, tokens: dict) -> None:
+    fname, instance = CONFIG.jwt_tokens_path, CONFIG.instance
+    logger.info(f"Saving tokens to {fname}")
+    saved = dict(tokens)
+    saved["expiration"] = str(saved["expiration"])
+    tokfile = ConfigParser()
+    tokfile.read(fname)
+    tokfile[instance] = saved
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    # replaced at once, readers in other processes never see a partial file
+    tmp = f"{fname}.{os.getpid()}.tmp"
+    with (
+      open(os.open(tmp, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600), "w")
+    ) as f:
+      tokfile.write(f)
+    os.replace(tmp, fname)
+    self._cache[(fname, instance)] = (_stamp(fname), dict(tokens, expiration=int(tokens["expiration"])))
+
+  def get(self, refresh) -> str:
+    """A valid id token, refreshed with refresh(refresh_token) within TOKEN_SKEW of expiry"""
+    tokens = self.load()
+    if time.time() < tokens["expiration"] - TOKEN_SKEW:
+      return tokens["id"]
+    with self._refreshing:
+      # refreshed by another thread, then by another process, while waiting
+      tokens = self.load()
+      if time.time() < tokens["expiration"] - TOKEN_SKEW:
+        return tokens["id"]
+      with file_lock(CONFIG.jwt_tokens_path + ".lock"):
+        tokens = self.load()
+        if time.time() < tokens["expiration"] - TOKEN_SKEW:
+          return tokens["id"]
+        try:
+          tokens = refresh(tokens["refresh"])
+        except Exception as e:
+          if time.time() < tokens["expiration"]:
+            logger.info(f"Token refresh failed, using the current token until it expires: {e}")
+            return tokens["id"]
+          raise TokenExpiredException
+    return tokens["id"]
+
+TOKENS = TokenStore()
+
+class CognitoJwtAuth:
+  """Authorization: JWT_TOKEN
+
+  A requests auth callable; not derived from requests.auth.AuthBase so importing it stays cheap.
+  """
+
+  def __init__(self, token: Optional[str] = None):
+    self._jwt_token = CONFIG.jwt_token or token
 
   def __eq__(self, other):
     return self._jwt_token == other._jwt_token
@@ -48,28 +136,6 @@ class CognitoJwtAuth(AuthBase):
     r.headers["Authorization"] = self._jwt_token
     return r
 
-class CallbackServerHandler(BaseHTTPRequestHandler):
-  def log_message(self, format, *args):
-    logger.debug(format % args)
-
-  def do_GET(self):
-    ret = parse_qs(urlparse(self.path).query)
-    logger.debug(f"Received local auth callback: {ret}")
-
-    self.server.code = ret["code"][0]
-    self.server.state = ret["state"][0]
-
-    self.send_response(301)
-    self.send_header("Location", "https://1000words-hq.com/login-success")
-    self.end_headers()
-
-class CallbackServer(HTTPServer):
-  def __init__(self, *args, **kwargs):
-    # Because HTTPServer is an old-style class, super() can't be used.
-    HTTPServer.__init__(self, *args, **kwargs)
-    self.code = None
-    self.state = None
-
 class CognitoAuth:
   def __init__(self):
     self._code = None
@@ -83,6 +149,7 @@ class CognitoAuth:
       return False
 
   def fetch_new_tokens(self) -> None:
+    import webbrowser
     try:
       webbrowser.get()
       has_browser = True
@@ -101,47 +168,23 @@ class CognitoAuth:
       "redirect_uri": redirect_uri,
       "client_id": CONFIG.user_pool_client_id,
     }
-    response = requests.post(CONFIG.cognito_token_url, data=params)
-    response.raise_for_status()
+    policy = get_policy("auth.code")
+    def post():
+      response = get_session().post(CONFIG.cognito_token_url, data=params, timeout=policy.timeout)
+      response.raise_for_status()
+      return response
+    response = policy.call(post)
     tokens = self._parse_token_response(response)
     self._save_tokens(tokens)
 
   def get_or_refresh_token(self) -> str:
-    tokens = self._load_tokens()
-    if time.time() > tokens["expiration"]:
-      try:
-        tokens = self._refresh_tokens(tokens["refresh"])
-      except:
-        raise TokenExpiredException
-    return tokens["id"]
+    return TOKENS.get(self._refresh_tokens)
 
   def _load_tokens(self) -> dict:
-    fname = CONFIG.jwt_tokens_path
-    logger.info(f"Loading tokens from {fname}")
-    tokfile = ConfigParser()
-    tokfile.read(fname)
-    try:
-      tokens = dict(tokfile[CONFIG.instance])
-      tokens["expiration"] = int(tokens["expiration"])
-      assert "id" in tokens
-      return tokens
-    except Exception as e:
-      logger
-      raise TokenNotFoundException
+    return TOKENS.load()
 
   def _save_tokens(self, tokens: dict) -> None:
-    fname = CONFIG.jwt_tokens_path
-    logger.info(f"Saving tokens to {fname}")
-    tokens = dict(tokens)
-    tokens["expiration"] = str(tokens["expiration"])
-    tokfile = ConfigParser()
-    tokfile.read(fname)
-    tokfile[CONFIG.instance] = tokens
-    os.makedirs(os.path.dirname(fname), exist_ok=True)
-    with (
-      open(os.open(fname, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600), "w")
-    ) as f:
-      tokfile.write(f)
+    TOKENS.save(tokens)
 
   # refresh id/access tokens using previously fetched refresh token
   def _refresh_tokens(self, refresh_token) -> dict:
@@ -153,7 +196,13 @@ class CognitoAuth:
       "scope": "email profile openid aws.cognito.signin.user.admin",
     }
     logger.debug(f"POSTing to {CONFIG.cognito_token_url}: {params}")
-    response = requests.post(CONFIG.cognito_token_url, data=params)
+    policy = get_policy("auth.refresh")
+    def post():
+      response = get_session().post(CONFIG.cognito_token_url, data=params, timeout=policy.timeout)
+      if response.status_code in RETRYABLE_STATUSES:
+        response.raise_for_status()
+      return response
+    response = policy.call(post)
     logger.debug(f"Received: {response}")
     new_tokens = self._parse_token_response(response)
     new_tokens["refresh"] = refresh_token
@@ -166,6 +215,7 @@ class CognitoAuth:
     logger.info("Launching browser-based authentication.")
     redirect_uri = self._start_callback_listener()
     auth_url, init_state = self._build_auth_url(redirect_uri)
+    import click
     try:
       click.launch(auth_url)
       self._httpd.handle_request()
@@ -204,6 +254,7 @@ class CognitoAuth:
     return f"{CONFIG.cognito_auth_url}?{urlencode(params)}", state
 
   def _start_callback_listener(self):
+    from .callback_server import CallbackServer, CallbackServerHandler
     for port in AUTH_REDIRECT_PORTS:
       try:
         self._httpd = CallbackServer(("", int(port)), CallbackServerHandler)
@@ -0,0 +1,113 @@
+""" Batches of cell requests from JSON lines streams and directories of JSON files.
+
+Requests are sent from a thread pool with a bounded number in flight, and a result
+or an error is emitted for each one as soon as it completes, tagged with the file
+and line it came from.
+"""
+import os
+import sys
+import json
+import threading
+from logging import getLogger
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Tuple
+from .config import CONFIG
+
+logger = getLogger("thousandwords.batch")
+
+def _read_jsonl(f, name: str):
+  for n, line in enumerate(f, 1):
+    if not line.strip():
+      continue
+    try:
+      yield f"{name}:{n}", json.loads(line)
+    except ValueError as err:
+      yield f"{name}:{n}", err
+
+def _read_json(path: str):
+  try:
+    with open(path) as f:
+      return path, json.load(f)
+  except ValueError as err:
+    return path, err
+
+def read_requests(sources: Iterable[str]) -> Iterator[Tuple[str, object]]:
+  """(ref, payload) for each request, lazily. ref is the file (and line) it came from;
+  payload is an Exception when it couldn't be parsed.
+
+  Sources are JSON lines files, JSON files holding one request, directories of those,
+  or - for JSON lines on stdin.
+  """
+  for source in sources:
+    if source == '-':
+      yield from _read_jsonl(sys.stdin, '<stdin>')
+      continue
+    paths = [source]
+    if os.path.isdir(source):
+      paths = [
+        os.path.join(source, name) for name in sorted(os.listdir(source))
+        if name.endswith(('.json', '.jsonl'))
+      ]
+    for path in paths:
+      if path.endswith('.jsonl'):
+        with open(path) as f:
+          yield from _read_jsonl(f, path)
+      else:
+        yield _read_json(path)
+
+def _batches(requests, size: int):
+  batch = []
+  for request in requests:
+    batch.append(request)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+def run_batches(fn, requests, emit, batch_size: int = 1, max_in_flight: int = None) -> Tuple[int, int]:
+  """Call fn on lists of up to batch_size payloads, max_in_flight calls at a time.
+
+  fn returns one result or Exception per payload. emit is called, from one thread at a
+  time, with {"ref", "result"} or {"ref", "error"} for each request. Returns the number
+  of successes and failures.
+  """
+  max_in_flight = int(max_in_flight or CONFIG.http_pool_size)
+  slots = threading.Semaphore(max_in_flight)
+  lock = threading.Lock()
+  counts = [0, 0]
+
+  def report(ref, result):
+    with lock:
+      if isinstance(result, Exception):
+        counts[1] += 1
+        emit({"ref": ref, "error": str(result)})
+      else:
+        counts[0] += 1
+        emit({"ref": ref, "result": result})
+
+  def call(batch):
+    try:
+      try:
+        results = fn([payload for _, payload in batch])
+      except Exception as err:
+        logger.debug(f"Batch of {len(batch)} failed: {err}")
+        results = [err] * len(batch)
+      for (ref, _), result in zip(batch, results):
+        report(ref, result)
+    finally:
+      slots.release()
+
+  def parsed():
+    for ref, payload in requests:
+      if isinstance(payload, Exception):
+        report(ref, payload)
+      else:
+        yield ref, payload
+
+  with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+    for batch in _batches(parsed(), batch_size):
+      # requests are read as they are sent, the reader waits once max_in_flight are pending
+      slots.acquire()
+      pool.submit(call, batch)
+  return counts[0], counts[1]
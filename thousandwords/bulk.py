@@ -0,0 +1,236 @@
+""" Transfers of many files between local paths and storage keys.
+
+Keys are relative to uploads/, like `storage upload`. Objects are compared by size
+and ETag, so unchanged files are skipped and interrupted runs resume where they
+stopped; downloads also resume partially written files.
+"""
+import os
+import glob
+import json
+import hashlib
+from logging import getLogger
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from posixpath import join as urljoin
+from typing import Iterable, List, Optional, Tuple
+from .config import CONFIG
+from .status import Progress
+from .transfer import MIN_PART_SIZE
+
+logger = getLogger("thousandwords.bulk")
+
+KEY_PREFIX = 'uploads/'
+# written next to the objects by sync, so the other side needs no bucket listing
+MANIFEST_NAME = '.manifest.jsonl'
+PARTIAL_SUFFIX = '.part'
+READ_SIZE = 2 ** 20
+
+class TransferError(Exception):
+  def __init__(self, action: str, failures, entries=None):
+    self.action = action
+    self.failures = failures
+    self.entries = entries or []
+
+  def __str__(self) -> str:
+    lines = [f"Failed to {self.action} {len(self.failures)} file{'s' if len(self.failures) > 1 else ''}:"]
+    for path, key, err in self.failures:
+      lines.append(f"  {path} ({key}): {err}")
+    return '\n'.join(lines)
+
+def _part_size(part_size=None) -> int:
+  return max(int(part_size or CONFIG.multipart_part_size), MIN_PART_SIZE)
+
+def s3_etag(path: str, part_size: Optional[int] = None) -> str:
+  """ETag S3 gives path's content: its MD5 when sent in one PUT, or with part_size,
+  the MD5 of its parts' MD5s followed by the number of parts"""
+  with open(path, 'rb') as f:
+    if part_size is None:
+      md5 = hashlib.md5()
+      for chunk in iter(lambda: f.read(READ_SIZE), b''):
+        md5.update(chunk)
+      return md5.hexdigest()
+    digests = [hashlib.md5(part).digest() for part in iter(lambda: f.read(part_size), b'')]
+  return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+def unchanged(path: str, head: Optional[dict], part_size=None) -> bool:
+  """Whether path has the content of the object described by head"""
+  if head is None or not os.path.isfile(path):
+    return False
+  size = os.path.getsize(path)
+  if head.get('ContentLength') != size or head.get('ContentEncoding'):
+    return False
+  etag = head.get('ETag', '').strip('"')
+  if '-' not in etag:
+    return s3_etag(path) == etag
+  parts = int(etag.rsplit('-', 1)[1])
+  # the part size isn't recorded: try ours, boto3's default and the smallest whole MiBs
+  # splitting the file in that many parts
+  mib = 2 ** 20
+  candidates = [_part_size(part_size), 8 * mib, max(-(-size // parts // mib) * mib, MIN_PART_SIZE)]
+  for candidate in dict.fromkeys(candidates):
+    if -(-size // candidate) == parts and s3_etag(path, candidate) == etag:
+      return True
+  return False
+
+def local_path(directory: str, relpath: str) -> str:
+  """Path of relpath (a key or a manifest path) under directory, refusing any that would
+  land outside of it, e.g. through '..' or a symlink"""
+  path = os.path.normpath(os.path.join(directory, relpath))
+  root = os.path.realpath(directory)
+  if os.path.commonpath([root, os.path.realpath(path)]) != root:
+    raise Exception(f"Path outside of {directory}: {relpath}")
+  return path
+
+def expand_sources(sources: Iterable[str], prefix: str = '') -> List[Tuple[str, str]]:
+  """(path, key) for files, directories (recursively) and glob patterns.
+
+  Files under a directory keep their path relative to it, others their name.
+  """
+  items = []
+  for source in sources:
+    matches = sorted(glob.glob(source, recursive=True)) if any(c in source for c in '*?[') else [source]
+    if not matches or not os.path.exists(matches[0]):
+      raise Exception(f"No such file or directory: {source}")
+    for match in matches:
+      if not os.path.isdir(match):
+        items.append((match, urljoin(prefix, os.path.basename(match))))
+        continue
+      for root, dirs, files in os.walk(match):
+        dirs.sort()
+        for name in sorted(files):
+          path = os.path.join(root, name)
+          rel = os.path.relpath(path, match).replace(os.sep, '/')
+          items.append((path, urljoin(prefix, rel)))
+  return items
+
+def read_manifest(fname: str) -> List[dict]:
+  """Entries of a JSON lines manifest, each with a key and, optionally, a path"""
+  with open(fname) as f:
+    return [json.loads(line) for line in f if line.strip()]
+
+def write_manifest(fname: str, entries: List[dict]) -> None:
+  with open(fname, 'w') as f:
+    for entry in entries:
+      f.write(json.dumps(entry) + '\n')
+
+def _run(action: str, fn, items, jobs=None, quiet=False) -> List[dict]:
+  """fn(path, key) for each (path, key) item on a pool of jobs threads; entries in item order"""
+  if not items:
+    return []
+  jobs = min(int(jobs or CONFIG.upload_concurrency), len(items))
+  entries = [None] * len(items)
+  failures = []
+  with Progress(f"{action.capitalize()}ing {len(items)} file{'s' if len(items) > 1 else ''}", len(items), quiet=quiet) as progress:
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+      futures = {pool.submit(fn, *item): i for i, item in enumerate(items)}
+      for future in as_completed(futures):
+        i = futures[future]
+        try:
+          entries[i] = future.result()
+        except Exception as err:
+          path, key = items[i]
+          logger.debug(f"{action} of {path} ({key}) failed: {err}")
+          failures.append((path, key, err))
+        progress.advance()
+    entries = [e for e in entries if e is not None]
+    if failures:
+      raise TransferError(action, failures, entries)
+  return entries
+
+def put_many(client, items: List[Tuple[str, str]], part_size=None, jobs=None, quiet=False) -> List[dict]:
+  """Upload (path, key) items, skipping objects already up to date.
+
+  Returns manifest entries: key, path, size, etag and status (uploaded or unchanged).
+  """
+  part_size = _part_size(part_size)
+  # create the shared s3 client before fanning out, boto3 session setup isn't thread-safe
+  client.s3
+  def put(path, key):
+    head = client.head(KEY_PREFIX + key)
+    status = 'unchanged'
+    if not unchanged(path, head, part_size):
+      with open(path, 'rb') as f:
+        # uncompressed, so later runs can compare ETags
+        client.upload_stream(KEY_PREFIX + key, f, part_size=part_size, compression='none')
+      head = client.head(KEY_PREFIX + key)
+      status = 'uploaded'
+    return {'key': key, 'path': path, 'size': head['ContentLength'], 'etag': head['ETag'].strip('"'), 'status': status}
+  return _run('upload', put, items, jobs=jobs, quiet=quiet)
+
+def _download(client, key: str, path: str, head: dict) -> None:
+  """Stream key to path through a partial file, resumed if its object didn't change"""
+  partial = path + PARTIAL_SUFFIX
+  os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+  if head.get('ContentEncoding'):
+    # stored compressed: decoded as it streams, the partial file can't be resumed
+    # since it doesn't match the object's bytes
+    with open(partial, 'wb') as f:
+      for chunk in client.iter_chunks(KEY_PREFIX + key, chunk_size=READ_SIZE):
+        f.write(chunk)
+    os.replace(partial, path)
+    return
+  # the ETag the partial file was started from, it is only resumed for the same object
+  started_from = partial + '.etag'
+  start = 0
+  if os.path.exists(partial) and os.path.exists(started_from):
+    with open(started_from) as f:
+      if f.read() == head['ETag']:
+        start = min(os.path.getsize(partial), head['ContentLength'])
+  if not start:
+    with open(started_from, 'w') as f:
+      f.write(head['ETag'])
+  with open(partial, 'r+b' if start else 'wb') as f:
+    f.seek(start)
+    f.truncate()
+    if start < head['ContentLength']:
+      # If-Match: fails rather than mixing versions if the object is replaced meanwhile
+      body = client.get_stream(KEY_PREFIX + key, start=start, if_match=head['ETag'])['Body']
+      for chunk in iter(lambda: body.read(READ_SIZE), b''):
+        f.write(chunk)
+  os.replace(partial, path)
+  os.remove(started_from)
+
+def get_many(client, items: List[Tuple[str, str]], part_size=None, jobs=None, quiet=False) -> List[dict]:
+  """Download (key, path) items, skipping files already up to date.
+
+  Returns manifest entries: key, path, size, etag and status (downloaded or unchanged).
+  """
+  client.s3
+  def get(path, key):
+    head = client.head(KEY_PREFIX + key)
+    if head is None:
+      raise Exception("No such object")
+    status = 'unchanged'
+    if not unchanged(path, head, part_size):
+      _download(client, key, path, head)
+      status = 'downloaded'
+    return {'key': key, 'path': path, 'size': head['ContentLength'], 'etag': head['ETag'].strip('"'), 'status': status}
+  return _run('download', get, [(path, key) for key, path in items], jobs=jobs, quiet=quiet)
+
+def sync_up(client, directory: str, prefix: str, part_size=None, jobs=None, quiet=False) -> List[dict]:
+  """Upload the files of directory under prefix, then the manifest listing them"""
+  items = [
+    (path, key) for path, key in expand_sources([directory], prefix)
+    if not path.endswith(PARTIAL_SUFFIX) and key != urljoin(prefix, MANIFEST_NAME)
+  ]
+  entries = put_many(client, items, part_size=part_size, jobs=jobs, quiet=quiet)
+  manifest = ''.join(
+    json.dumps({
+      'key': e['key'],
+      'path': os.path.relpath(e['path'], directory).replace(os.sep, '/'),
+      'size': e['size'],
+      'etag': e['etag'],
+    }) + '\n'
+    for e in entries
+  )
+  client.upload(KEY_PREFIX + urljoin(prefix, MANIFEST_NAME), manifest.encode())
+  return entries
+
+def sync_down(client, directory: str, prefix: str, part_size=None, jobs=None, quiet=False) -> List[dict]:
+  """Download the files listed in prefix's manifest into directory"""
+  manifest = client.get(KEY_PREFIX + urljoin(prefix, MANIFEST_NAME)).decode()
+  items = []
+  for line in manifest.splitlines():
+    if line.strip():
+      entry = json.loads(line)
+      items.append((entry['key'], local_path(directory, entry['path'])))
+  return get_many(client, items, part_size=part_size, jobs=jobs, quiet=quiet)
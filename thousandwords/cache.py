@@ -0,0 +1,194 @@
+import sys
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from logging import getLogger
+from typing import Optional
+from .config import CONFIG
+
+logger = getLogger("thousandwords.cache")
+
+# number of elements (or rows) hashed to fingerprint an array or a frame
+SAMPLES = 1024
+
+def _sample_positions(n):
+  if n <= SAMPLES:
+    return list(range(n))
+  return sorted(set([i * (n - 1) // (SAMPLES - 1) for i in range(SAMPLES)]))
+
+def _ndarray_fingerprint(arr):
+  h = hashlib.blake2b(digest_size=16)
+  if arr.size:
+    h.update(arr.flat[_sample_positions(arr.size)].tobytes())
+  return (
+    'ndarray', arr.__array_interface__['data'][0], arr.shape, arr.strides,
+    arr.dtype.str, h.hexdigest(),
+  )
+
+def _pandas_fingerprint(obj):
+  import pandas as pd
+  h = hashlib.blake2b(digest_size=16)
+  sample = obj.iloc[_sample_positions(len(obj))]
+  h.update(pd.util.hash_pandas_object(sample, index=True).values.tobytes())
+  if isinstance(obj, pd.DataFrame):
+    columns = tuple(map(str, obj.columns))
+    dtypes = tuple(map(str, obj.dtypes))
+  else:
+    columns = (str(obj.name),)
+    dtypes = (str(obj.dtype),)
+  return (type(obj).__name__, obj.shape, columns, dtypes, h.hexdigest())
+
+def fingerprint(obj) -> Optional[tuple]:
+  """Cheap change fingerprint for ndarrays, DataFrames and Series, None for anything else.
+
+  Samples a fixed number of elements, so an in-place edit that misses all of them goes unnoticed.
+  """
+  np = sys.modules.get('numpy')
+  if np is not None and type(obj) is np.ndarray:
+    return _ndarray_fingerprint(obj)
+  pd = sys.modules.get('pandas')
+  if pd is not None and isinstance(obj, (pd.DataFrame, pd.Series)):
+    try:
+      return _pandas_fingerprint(obj)
+    except Exception as err:
+      # e.g. unhashable cell values
+      logger.debug(f"Could not fingerprint {type(obj).__name__}: {err}")
+  return None
+
+def _nbytes(data) -> int:
+  if isinstance(data, (list, tuple)):
+    return sum(_nbytes(d) for d in data)
+  if isinstance(data, str):
+    return len(data)
+  return memoryview(data).nbytes
+
+def _detached(data):
+  # zero-copy payloads are views on the object's memory, holding them would keep it alive
+  if isinstance(data, (list, tuple)):
+    return [_detached(d) for d in data]
+  if isinstance(data, (bytes, str)):
+    return data
+  return bytes(data)
+
+class _Entry:
+  def __init__(self, ref, fp, ns, payloads):
+    self.ref = ref
+    self.fingerprint = fp
+    self.ns = ns
+    self.payloads = payloads
+    self.size = (
+      sum(_nbytes(p) for p in payloads.values())
+      + sum(_nbytes(e['value']) for e in ns if e['value'] is not None)
+    )
+
+class SerializationCache:
+  """Serialized payloads of large objects, reused across publishes while the object
+  is alive and its fingerprint is unchanged.
+
+  Keyed on id(obj), checked against a weak reference so a recycled id never hits.
+  Least recently used entries are dropped to stay under max_bytes.
+
+  Entries hold an in-memory copy of the payloads, on top of the objects themselves:
+  up to max_bytes of extra memory to skip serializing again. Objects whose payloads
+  exceed max_bytes are never copied nor cached, and max_bytes 0 disables the cache.
+  """
+
+  def __init__(self, max_bytes: Optional[int] = None):
+    self._max_bytes = max_bytes
+    self._entries = OrderedDict()
+    self._size = 0
+    # reentrant: freeing a payload can collect its object and fire _drop while the lock is held
+    self._lock = threading.RLock()
+
+  @property
+  def max_bytes(self) -> int:
+    return CONFIG.serialization_cache_size if self._max_bytes is None else self._max_bytes
+
+  @property
+  def size(self) -> int:
+    return self._size
+
+  def add(self, srz, name, obj) -> None:
+    """Same as srz.add(name, obj), replaying the cached serialization when possible"""
+    fp = fingerprint(obj) if self.max_bytes > 0 else None
+    if fp is None:
+      return srz.add(name, obj)
+    with self._lock:
+      entry = self._entries.get(id(obj))
+      if entry is not None and entry.ref() is obj and entry.fingerprint == fp:
+        self._entries.move_to_end(id(obj))
+      else:
+        entry = None
+    if entry is not None:
+      logger.info(f"Reusing serialization of '{name}'")
+      for e in entry.ns:
+        key = e['key']
+        if key is not None:
+          key = srz.put(name, entry.payloads[key])
+        srz.appendNs(name, e['serializationType'], key=key, value=e['value'])
+      return
+    self._store(obj, fp, *self._record(srz, name, obj))
+
+  def clear(self) -> None:
+    with self._lock:
+      self._entries.clear()
+      self._size = 0
+
+  def _record(self, srz, name, obj):
+    """(ns entries, payloads) added by srz.add, payloads None once over max_bytes.
+
+    Payloads are only copied while they fit, an object too large for the cache
+    is serialized without any copy.
+    """
+    payloads = {}
+    size = 0
+    budget = self.max_bytes
+    put = srz.put
+    def recording_put(n, data):
+      nonlocal payloads, size
+      key = put(n, data)
+      if payloads is not None:
+        size += _nbytes(data)
+        if size > budget:
+          payloads = None
+        else:
+          payloads[key] = _detached(data)
+      return key
+    start = len(srz.ns)
+    srz.put = recording_put
+    try:
+      srz.add(name, obj)
+    finally:
+      srz.put = put
+    return [dict(e) for e in srz.ns[start:]], payloads
+
+  def _store(self, obj, fp, ns, payloads) -> None:
+    if payloads is None:
+      return
+    try:
+      ref = weakref.ref(obj, self._drop)
+    except TypeError:
+      return
+    entry = _Entry(ref, fp, ns, payloads)
+    if entry.size > self.max_bytes:
+      return
+    with self._lock:
+      self._pop(id(obj))
+      self._entries[id(obj)] = entry
+      self._size += entry.size
+      while self._size > self.max_bytes:
+        self._pop(next(iter(self._entries)))
+
+  def _pop(self, oid) -> None:
+    entry = self._entries.pop(oid, None)
+    if entry is not None:
+      self._size -= entry.size
+
+  def _drop(self, ref) -> None:
+    with self._lock:
+      for oid, entry in list(self._entries.items()):
+        if entry.ref is ref:
+          self._pop(oid)
+
+SERIALIZATION_CACHE = SerializationCache()
@@ -0,0 +1,27 @@
+from logging import getLogger
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+logger = getLogger("thousandwords.auth")
+
+class CallbackServerHandler(BaseHTTPRequestHandler):
+  def log_message(self, format, *args):
+    logger.debug(format % args)
+
+  def do_GET(self):
+    ret = parse_qs(urlparse(self.path).query)
+    logger.debug(f"Received local auth callback: {ret}")
+
+    self.server.code = ret["code"][0]
+    self.server.state = ret["state"][0]
+
+    self.send_response(301)
+    self.send_header("Location", "https://1000words-hq.com/login-success")
+    self.end_headers()
+
+class CallbackServer(HTTPServer):
+  def __init__(self, *args, **kwargs):
+    # Because HTTPServer is an old-style class, super() can't be used.
+    HTTPServer.__init__(self, *args, **kwargs)
+    self.code = None
+    self.state = None
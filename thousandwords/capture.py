@@ -1,29 +1,219 @@
+import os
 import sys
+import json
+import tempfile
+import weakref
+from base64 import b64encode
+from logging import getLogger
+from typing import Optional
 from IPython.utils.capture import RichOutput
+from .config import CONFIG
+
+logger = getLogger("thousandwords.capture")
+
+# characters of a spilled text kept in memory and shown
+HEAD_SIZE = 64 * 2 ** 10
+CHUNK_SIZE = 2 ** 16
+
+def _discard(f):
+  f.close()
+  try:
+    os.remove(f.name)
+  except OSError:
+    pass
+
+def _is_text(mime: str) -> bool:
+  return mime.startswith('text/') or mime.endswith(('+xml', 'json', 'javascript'))
+
+def rich_output_args(output: dict, fetch=None) -> dict:
+  """RichOutput arguments for an output of a runCell reply.
+
+  Representations stored in the bucket are read with fetch(key), or left out without it.
+  """
+  data = {}
+  for rep in output.get('representations') or []:
+    mime = rep['mime']
+    if not rep.get('key'):
+      data[mime] = rep.get('data')
+      continue
+    if fetch is None:
+      continue
+    try:
+      value = fetch(rep['key'])
+    except Exception as err:
+      logger.debug(f"Could not fetch {mime} output {rep['key']}: {err}")
+      continue
+    data[mime] = value.decode() if _is_text(mime) else b64encode(value).decode()
+  metadata = output.get('metadata') or {}
+  if isinstance(metadata, str):
+    metadata = json.loads(metadata)
+  return {'data': data, 'metadata': metadata}
+
+class TextBuffer:
+  """Text held in memory up to spill_size characters (capture_spill_size setting),
+  then written to a temporary file, removed with the buffer.
+
+  Once spilled, only its head stays in memory.
+  """
+  __slots__ = ('_parts', '_size', '_spill_size', '_file', 'head', '__weakref__')
+
+  def __init__(self, text: str = '', spill_size: Optional[int] = None):
+    self._parts = []
+    self._size = 0
+    self._spill_size = CONFIG.capture_spill_size if spill_size is None else spill_size
+    self._file = None
+    self.head = ''
+    self.write(text)
+
+  def write(self, text: str) -> None:
+    if not text:
+      return
+    self._size += len(text)
+    if self._file is None:
+      self._parts.append(text)
+      if self._size <= self._spill_size:
+        return
+      text = ''.join(self._parts)
+      self._parts = []
+      self.head = text[:min(HEAD_SIZE, self._spill_size)]
+      self._file = tempfile.NamedTemporaryFile(
+        'w+', encoding='utf-8', prefix='thousandwords-', suffix='.txt', delete=False,
+      )
+      weakref.finalize(self, _discard, self._file)
+    self._file.write(text)
+
+  def __len__(self) -> int:
+    return self._size
+
+  @property
+  def spilled(self) -> Optional[str]:
+    """Path of the file holding the text, None while it is in memory"""
+    return self._file.name if self._file is not None else None
+
+  def iter_chunks(self, size: int = CHUNK_SIZE):
+    if self._file is None:
+      yield ''.join(self._parts)
+      return
+    self._file.flush()
+    with open(self._file.name, encoding='utf-8') as f:
+      yield from iter(lambda: f.read(size), '')
+
+  def getvalue(self) -> str:
+    if self._file is None and len(self._parts) > 1:
+      self._parts = [''.join(self._parts)]
+    return ''.join(self.iter_chunks())
+
+  def show(self, stream) -> None:
+    """Write the text, or its head and where the rest is once spilled"""
+    if self._file is None:
+      stream.write(''.join(self._parts))
+      return
+    stream.write(self.head)
+    stream.write(
+      f"\n[{len(self) - len(self.head)} more characters in {self.spilled}, "
+      "call .expand() to show them]\n"
+    )
 
 class CapturedIO(object):
+  """Streams and rich outputs of a run, written out by show() or by calling it.
+
+  Rich outputs are built once, on first access. Text above the capture_spill_size
+  setting is kept in a temporary file and only its head is shown; expand() writes
+  all of it.
+  """
+  __slots__ = ('_stdout', '_stderr', '_traceback', '_outputs', '_rich')
 
   def __init__(self, stdout, stderr, traceback, outputs=None):
-    self._stdout = stdout or ''
-    self._stderr = stderr or ''
+    self._stdout = TextBuffer(stdout or '')
+    self._stderr = TextBuffer(stderr or '')
     self._traceback = traceback or ''
     self._outputs = outputs or []
+    self._rich = []
 
   def __str__(self):
-    return self._stdout
+    return self.stdout
+
+  @property
+  def stdout(self) -> str:
+    return self._stdout.getvalue()
+
+  @property
+  def stderr(self) -> str:
+    return self._stderr.getvalue()
 
   @property
   def outputs(self):
-    return [ RichOutput(**kargs) for kargs in self._outputs ]
+    # outputs can be appended while streaming, build the new ones only
+    for kargs in self._outputs[len(self._rich):]:
+      self._rich.append(RichOutput(**kargs))
+    return list(self._rich)
 
   def show(self):
     """write my output to sys.stdout/err as appropriate"""
-    sys.stdout.write(self._stdout)
-    sys.stderr.write(self._stderr)
+    self._stdout.show(sys.stdout)
+    self._stderr.show(sys.stderr)
     sys.stderr.write('\n'.join(self._traceback))
     sys.stdout.flush()
     sys.stderr.flush()
-    for kargs in self._outputs:
-      RichOutput(**kargs).display()
+    for output in self.outputs:
+      output.display()
 
   __call__ = show
+
+  def expand(self):
+    """write all of stdout/err, including what show() left out"""
+    for buf, stream in ((self._stdout, sys.stdout), (self._stderr, sys.stderr)):
+      if buf.spilled:
+        for chunk in buf.iter_chunks():
+          stream.write(chunk)
+        stream.flush()
+
+class StreamingCapturedIO(CapturedIO):
+  """A CapturedIO filled while the run is in progress, rendering pieces as they arrive.
+
+  feed() takes chunks with any of stdout, stderr, outputs (RichOutput arguments) and
+  traceback. Live echo of a stream stops once it spills; with live False nothing is
+  rendered until show().
+  """
+  __slots__ = ('live', '_muted')
+
+  def __init__(self, live: bool = True):
+    super().__init__('', '', [], [])
+    self.live = live
+    self._muted = set()
+
+  def feed(self, chunk: dict) -> None:
+    self.write('stdout', chunk.get('stdout'))
+    self.write('stderr', chunk.get('stderr'))
+    for kargs in chunk.get('outputs') or []:
+      self.add_output(kargs)
+    if chunk.get('traceback'):
+      self._traceback = list(self._traceback) + list(chunk['traceback'])
+      if self.live:
+        sys.stderr.write('\n'.join(chunk['traceback']))
+        sys.stderr.flush()
+
+  def write(self, name: str, text: Optional[str]) -> None:
+    if not text:
+      return
+    buf = self._stdout if name == 'stdout' else self._stderr
+    buf.write(text)
+    if not self.live or name in self._muted:
+      return
+    stream = sys.stdout if name == 'stdout' else sys.stderr
+    if buf.spilled:
+      self._muted.add(name)
+      stream.write(f"\n[{name} continues in {buf.spilled}, call .expand() to show it]\n")
+    else:
+      stream.write(text)
+    stream.flush()
+
+  def feed_reply(self, chunk: dict, fetch=None) -> None:
+    """feed() a chunk of a runCell reply, outputs as the API returns them"""
+    outputs = [rich_output_args(o, fetch) for o in chunk.get('outputs') or []]
+    self.feed(dict(chunk, outputs=outputs))
+
+  def add_output(self, kargs: dict) -> None:
+    self._outputs.append(kargs)
+    if self.live:
+      self.outputs[-1].display()
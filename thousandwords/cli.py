@@ -1,10 +1,11 @@
+import os
 import sys
 import argparse
 import logging
 import json
 from .config import CONFIG
-from .auth import CognitoAuth
-from .client import Client
+# commands import the auth and client modules (boto3, requests) when they run, so
+# `thousandwords -h` and argument errors don't pay for them
 
 logger = logging.getLogger("thousandwords.cli")
 
@@ -25,31 +26,143 @@ def login(args) -> None:
   CONFIG.instance = instance
   CONFIG.save(update_default_instance=True)
 
+  from .auth import CognitoAuth
   auth = CognitoAuth()
   auth.fetch_new_tokens()
   print("Authentication successful.")
 
 def cells_create(args):
+  from .client import Client
   with open(args.file) as f:
     input = json.load(f)
   id = Client().create_cell(input)
   print(f"Successfully created cell {id}")
 
 def cells_run(args):
+  from .client import Client
   with open(args.file) as f:
     req = json.load(f)
   resp = Client().run_cell(req)
   print(f"Successfully ran cell: {resp}")
 
+def _run_cells_batch(args, fn, batch_size):
+  from .batch import read_requests, run_batches
+  out = open(args.output, 'w') if args.output else sys.stdout
+  def emit(record):
+    out.write(json.dumps(record) + "\n")
+    out.flush()
+  try:
+    ok, failed = run_batches(
+      fn, read_requests(args.sources), emit, batch_size=batch_size, max_in_flight=args.max_in_flight,
+    )
+  finally:
+    if out is not sys.stdout:
+      out.close()
+  if failed:
+    # results go to stdout, keep it JSON lines
+    print(f"{failed} of {ok + failed} requests failed", file=sys.stderr)
+    sys.exit(1)
+
+def cells_create_many(args):
+  from .client import Client
+  client = Client()
+  _run_cells_batch(args, client.create_cells, args.batch_size)
+
+def cells_run_many(args):
+  from .client import Client
+  client = Client()
+  def run(requests):
+    # mutations in one document run one after the other, runCell requests go separately
+    results = []
+    for req in requests:
+      try:
+        results.append(client.run_cell(req))
+      except Exception as err:
+        results.append(err)
+    return results
+  _run_cells_batch(args, run, 1)
+
+def publish_notebook(args):
+  if args.not_runnable and args.with_variables:
+    raise Exception("--not-runnable and --with-variables are mutually exclusive. Pick at most one.")
+  from .notebook import publish_notebook
+  publish_notebook(
+    args.notebook, cells=args.cells, public=args.public, not_runnable=args.not_runnable,
+    no_variables=args.no_variables, with_variables=args.with_variables,
+  )
+
 def storage_upload(args):
-  with open(args.file) as f:
+  from .client import Client
+  with open(args.file, 'rb') as f:
     key = f'uploads/{args.key}'
-    Client().upload(key, f.read())
+    Client().upload_stream(
+      key, f, part_size=args.part_size, max_concurrency=args.concurrency,
+      compression=args.compression or CONFIG.compression,
+    )
   print(f"Successfully created object with key: {key}")
 
+def _bulk_summary(entries, action):
+  done = sum(1 for e in entries if e['status'] != 'unchanged')
+  print(f"Successfully {action} {done} file{'s' if done != 1 else ''}, {len(entries) - done} unchanged")
+
+def _run_bulk(fn, args, *fn_args):
+  from .client import Client
+  from .bulk import TransferError, write_manifest
+  try:
+    entries = fn(Client(), *fn_args, part_size=getattr(args, 'part_size', None), jobs=args.jobs)
+  except TransferError as e:
+    if getattr(args, 'manifest', None):
+      write_manifest(args.manifest, e.entries)
+    raise
+  if getattr(args, 'manifest', None):
+    write_manifest(args.manifest, entries)
+  return entries
+
+def storage_put_many(args):
+  from .bulk import expand_sources, read_manifest, put_many
+  items = expand_sources(args.sources, args.prefix or '')
+  if args.from_manifest:
+    items += [(e['path'], e['key']) for e in read_manifest(args.from_manifest)]
+  if not items:
+    raise Exception("Nothing to upload")
+  _bulk_summary(_run_bulk(put_many, args, items), 'uploaded')
+
+def storage_get_many(args):
+  from .bulk import read_manifest, get_many, local_path
+  items = [(key, local_path(args.out, key)) for key in args.keys]
+  if args.from_manifest:
+    items += [
+      (e['key'], local_path(args.out, e.get('path') or e['key']))
+      for e in read_manifest(args.from_manifest)
+    ]
+  if not items:
+    raise Exception("Nothing to download")
+  _bulk_summary(_run_bulk(get_many, args, items), 'downloaded')
+
+def storage_sync(args):
+  from .bulk import sync_up, sync_down
+  if args.download:
+    _bulk_summary(_run_bulk(sync_down, args, args.directory, args.prefix), 'downloaded')
+  else:
+    _bulk_summary(_run_bulk(sync_up, args, args.directory, args.prefix), 'uploaded')
+
 def storage_get(args):
-  object = Client().get(args.key)
-  print(f"Value: {object.decode('utf-8')}")
+  from .client import Client
+  chunks = Client().iter_chunks(
+    args.key, byte_range=args.range, part_size=args.part_size, max_concurrency=args.concurrency,
+  )
+  if args.out in (None, '-'):
+    out = sys.stdout.buffer
+    for chunk in chunks:
+      out.write(chunk)
+    out.flush()
+    return
+  partial = args.out + '.part'
+  with open(partial, 'wb') as f:
+    for chunk in chunks:
+      f.write(chunk)
+  os.replace(partial, args.out)
+  print(f"Successfully wrote {args.key} to {args.out}", file=sys.stderr)
 
 STORAGE_COMMANDS = [
   {
@@ -61,6 +174,21 @@ STORAGE_COMMANDS = [
     "name": "get",
     "help": "retrieve value from store",
     "handler": storage_get
+  },
+  {
+    "name": "put-many",
+    "help": "upload files, directories and globs, skipping unchanged objects",
+    "handler": storage_put_many
+  },
+  {
+    "name": "get-many",
+    "help": "download objects to a directory, skipping unchanged files",
+    "handler": storage_get_many
+  },
+  {
+    "name": "sync",
+    "help": "mirror a directory to a key prefix, or back with --download",
+    "handler": storage_sync
   }
 ]
 
@@ -74,6 +202,16 @@ CELLS_COMMANDS = [
     "name": "run",
     "help": "run cell",
     "handler": cells_run,
+  },
+  {
+    "name": "create-many",
+    "help": "create cells from JSON lines or a directory, print results as JSON lines",
+    "handler": cells_create_many,
+  },
+  {
+    "name": "run-many",
+    "help": "run cells from JSON lines or a directory, print results as JSON lines",
+    "handler": cells_run_many,
   }
 ]
 
@@ -88,6 +226,11 @@ COMMANDS = [
     "help": "run `thousandwords cells -h` for subcommands",
     "subcommands": CELLS_COMMANDS,
   },
+  {
+    "name": "publish-notebook",
+    "help": "publish the code cells of a notebook at once",
+    "handler": publish_notebook,
+  },
   {
     "name": "storage",
     "help": "run `thousandwords storage -h` for subcommands",
@@ -120,6 +263,29 @@ def main():
     if "handler" in cmd:
       p.set_defaults(handler=cmd["handler"])
 
+    if cmd["name"] == "publish-notebook":
+      p.add_argument("notebook", help=".ipynb file")
+      p.add_argument(
+        "--cells", metavar="SPEC",
+        help="code cells to publish, counted from 1, e.g. 1,3-5 (default: all)",
+      )
+      p.add_argument(
+        "--public", action="store_true",
+        help="publish publicly to unlisted URLs, anyone with the links can view",
+      )
+      p.add_argument(
+        "--not-runnable", action="store_true",
+        help="publish the outputs saved in the notebook instead of running it",
+      )
+      p.add_argument(
+        "--no-variables", action="store_true",
+        help="don't include the variables required for execution, cells needing some get their outputs published",
+      )
+      p.add_argument(
+        "--with-variables", action="store_true",
+        help="include the variables required for execution without asking",
+      )
+
     if "subcommands" in cmd:
       subcmd_parsers = p.add_subparsers(
         title="commands",
@@ -143,10 +309,87 @@ def main():
               "file",
               help="file with request data in JSON format",
             )
+          if subcmd["name"] in ("create-many", "run-many"):
+            p.add_argument(
+              "sources", nargs="+", metavar="SOURCE",
+              help="JSON lines file, JSON file, directory of those, or - for stdin",
+            )
+            p.add_argument(
+              "--max-in-flight", type=int, metavar="N",
+              help="number of requests sent concurrently (default: http_pool_size setting)",
+            )
+            p.add_argument("--output", metavar="FILE", help="write results to FILE instead of stdout")
+          if subcmd["name"] == "create-many":
+            p.add_argument(
+              "--batch-size", type=int, default=10, metavar="N",
+              help="cells created per GraphQL request (default: 10)",
+            )
         if cmd["name"] == "storage":
-          p.add_argument("key", help='object key')
+          if subcmd["name"] in ("upload", "get"):
+            p.add_argument("key", help='object key')
+          if subcmd["name"] == "get":
+            p.add_argument(
+              "--out", metavar="FILE",
+              help="write the object to FILE as it downloads, instead of stdout",
+            )
+            p.add_argument(
+              "--range", metavar="START-END",
+              help="only read these bytes (inclusive, START- and -SUFFIX also work)",
+            )
+            p.add_argument(
+              "--part-size", type=int, metavar="BYTES",
+              help="size of the ranges large objects are fetched in (min 5MiB)",
+            )
+            p.add_argument(
+              "--concurrency", type=int, metavar="N",
+              help="number of ranges fetched in parallel",
+            )
+          if subcmd["name"] in ("put-many", "get-many", "sync"):
+            p.add_argument(
+              "--jobs", type=int, metavar="N",
+              help="number of files transferred in parallel",
+            )
+          if subcmd["name"] in ("put-many", "sync"):
+            p.add_argument(
+              "--part-size", type=int, metavar="BYTES",
+              help="multipart upload part size (min 5MiB)",
+            )
+          if subcmd["name"] in ("put-many", "get-many"):
+            p.add_argument(
+              "--from-manifest", metavar="FILE",
+              help="JSON lines file of entries with a key and a path, as written by --manifest",
+            )
+            p.add_argument(
+              "--manifest", metavar="FILE",
+              help="write the key, path, size and ETag of each transferred file to FILE",
+            )
+          if subcmd["name"] == "put-many":
+            p.add_argument("sources", nargs="*", metavar="SOURCE", help="file, directory or glob")
+            p.add_argument("--prefix", help="key prefix")
+          if subcmd["name"] == "get-many":
+            p.add_argument("keys", nargs="*", metavar="KEY", help="object key")
+            p.add_argument("--out", default=".", metavar="DIR", help="destination directory")
+          if subcmd["name"] == "sync":
+            p.add_argument("directory", help="local directory")
+            p.add_argument("prefix", help="key prefix")
+            p.add_argument(
+              "--download", action="store_true",
+              help="download the files listed in the prefix's manifest instead",
+            )
           if subcmd["name"] == "upload":
             p.add_argument("file", help="file with data for object")
+            p.add_argument(
+              "--part-size", type=int, metavar="BYTES",
+              help="multipart upload part size (min 5MiB)",
+            )
+            p.add_argument(
+              "--concurrency", type=int, metavar="N",
+              help="number of parts uploaded in parallel",
+            )
+            p.add_argument(
+              "--compression", choices=["none", "auto", "zstd", "lz4", "gzip"],
+              help="compress the object, decoded by storage get (default: compression setting, none)",
+            )
 
   args = parser.parse_args()
 
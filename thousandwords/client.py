@@ -1,15 +1,91 @@
 from __future__ import annotations
 import logging
-from python_graphql_client import GraphqlClient
-from typing import Optional
-import boto3
-from requests_aws4auth import AWS4Auth
-from thousandwords.auth import CognitoJwtAuth, CognitoAuth
+import time
+import threading
+from typing import Optional, TYPE_CHECKING
+from thousandwords.auth import CognitoJwtAuth, CognitoAuth, TOKENS, TOKEN_SKEW
 from thousandwords.config import CONFIG
-from thousandwords.credentials import CognitoCredentials
+from thousandwords.credentials import CognitoCredentials, REFRESH_SKEW
+from thousandwords.sessions import get_session
+from thousandwords.policy import get_policy
+from thousandwords.polling import poll_until, backoff, PollTimeout, PollCancelled
+from thousandwords import realtime
+from thousandwords.transfer import upload_stream, download_chunks, parse_range
+from thousandwords.compression import compress_payload, decompress_payload, decompress_chunks
+
+if TYPE_CHECKING:
+  from requests_aws4auth import AWS4Auth
 
 logger = logging.getLogger("thousandwords.client")
 
+# selection set of a runCell reply's outputs and captured namespace
+OUTPUTS_SELECTION = """
+  outputs {
+    representations {
+      mime
+      key
+      width
+      height
+      data
+    }
+    metadata
+  }
+"""
+USER_NS_SELECTION = """
+  userNS {
+    name
+    key
+    value
+    serializationType
+  }
+"""
+
+def _field_undefined(ret, field) -> bool:
+  """Whether a GraphQL response rejects field as absent from the schema"""
+  for err in ret.get("errors") or []:
+    message = err.get("message", "")
+    if field in message and ("FieldUndefined" in message or "Cannot query field" in message):
+      return True
+  return False
+
+_signer_lock = threading.Lock()
+_signer = None
+
+def _get_signer(access_key_id, secret_key, session_token) -> AWS4Auth:
+  """AppSync SigV4 signer, shared until the credentials it was built from change"""
+  global _signer
+  endpoint = CONFIG.api_endpoint
+  is_mock = (endpoint == 'http://192.168.1.30:20002/graphql')
+  signer_key = (access_key_id, session_token, CONFIG.api_region, is_mock)
+  with _signer_lock:
+    if _signer is None or _signer[0] != signer_key:
+      from requests_aws4auth import AWS4Auth
+      _signer = (signer_key, AWS4Auth(
+        # see https://docs.amplify.aws/cli/usage/mock/
+        'ASIAVJKIAM-UnAuthRole' if is_mock else access_key_id,
+        secret_key,
+        CONFIG.api_region,
+        'appsync',
+        session_token=session_token,
+      ))
+    return _signer[1]
+
+class AuthContext:
+  """How requests are authenticated: the mode, its requests auth and when to resolve it again"""
+
+  def __init__(self, mode: str, auth, expires_at: float):
+    self.mode = mode
+    self.auth = auth
+    self.expires_at = expires_at
+
+  @property
+  def expired(self) -> bool:
+    return time.time() >= self.expires_at
+
+def _renew_at(expiration: float, skew: float) -> float:
+  # within the skew window already (a refresh failed): keep it until it actually expires
+  return expiration - skew if expiration - skew > time.time() else expiration
+
 class Client:
 
   def __init__(
@@ -21,29 +97,82 @@ class Client:
 
     self._s3 = None
     self._cognito_creds = CognitoCredentials()
-  
-  def _get_gql_client(self, auth_type):
-    endpoint = CONFIG.api_endpoint
-    if auth_type == 'AMAZON_COGNITO_USER_POOLS':
-      auth = CognitoJwtAuth()
-    elif auth_type == 'AWS_IAM':
-      creds = self._cognito_creds.credentials['Credentials']
-      is_mock = (endpoint == 'http://192.168.1.30:20002/graphql')
-      auth = AWS4Auth(
-        # see https://docs.amplify.aws/cli/usage/mock/
-        'ASIAVJKIAM-UnAuthRole' if is_mock else creds['AccessKeyId'],
-        creds['SecretKey'],
-        CONFIG.api_region,
-        'appsync',
-        session_token=creds['SessionToken'],
-      )
-    return GraphqlClient(auth=auth, endpoint=endpoint)
+    self._auth_contexts = {}
+    self._auth_lock = threading.Lock()
+    # whether the API streams run outputs, known after the first streamed run
+    self._run_streaming = None
+
+  def auth_context(self, auth_type: Optional[str] = None) -> AuthContext:
+    """Resolved on first use, then again once expired or rejected.
+
+    auth_type None is the default mode: AMAZON_COGNITO_USER_POOLS when logged in,
+    AWS_IAM (guest) otherwise.
+    """
+    with self._auth_lock:
+      ctx = self._auth_contexts.get(auth_type)
+      if ctx is None or ctx.expired:
+        ctx = self._auth_contexts[auth_type] = self._resolve_auth(auth_type)
+      return ctx
+
+  def invalidate_auth(self, ctx: AuthContext) -> None:
+    """Resolve ctx again on next use, e.g. after a 401.
+
+    Rejected AWS_IAM credentials are renewed too, once per context however many
+    requests saw them rejected.
+    """
+    with self._auth_lock:
+      stale = [auth_type for auth_type, cached in self._auth_contexts.items() if cached is ctx]
+      for auth_type in stale:
+        del self._auth_contexts[auth_type]
+      if stale and ctx.mode == 'AWS_IAM':
+        self._cognito_creds.renew()
+
+  @property
+  def auth_mode(self) -> str:
+    return self.auth_context().mode
+
+  def _resolve_auth(self, auth_type):
+    if auth_type in (None, 'AMAZON_COGNITO_USER_POOLS'):
+      try:
+        token = CognitoAuth().get_or_refresh_token()
+        expiration = TOKENS.load()["expiration"]
+        return AuthContext('AMAZON_COGNITO_USER_POOLS', CognitoJwtAuth(token), _renew_at(expiration, TOKEN_SKEW))
+      except Exception:
+        if auth_type is not None:
+          raise
+        # fallback to guest (public iam)
+    creds = self._cognito_creds.credentials['Credentials']
+    signer = _get_signer(creds['AccessKeyId'], creds['SecretKey'], creds['SessionToken'])
+    return AuthContext('AWS_IAM', signer, _renew_at(creds['Expiration'].timestamp(), REFRESH_SKEW))
+
+  def _get_auth(self, auth_type=None):
+    return self.auth_context(auth_type).auth
+
+  def _execute(self, auth_type, query, variables, operation='graphql.query'):
+    policy = get_policy(operation)
+    def post():
+      for attempt in range(2):
+        ctx = self.auth_context(auth_type)
+        resp = get_session().post(
+          CONFIG.api_endpoint,
+          json={"query": query, "variables": variables},
+          auth=ctx.auth,
+          timeout=policy.timeout,
+        )
+        if resp.status_code != 401 or attempt:
+          break
+        # revoked or rotated credentials, try once more with freshly resolved ones
+        logger.info(f"{ctx.mode} request rejected, resolving auth again")
+        self.invalidate_auth(ctx)
+      resp.raise_for_status()
+      return resp.json()
+    return policy.call(post)
 
   @property
   def instance(self) -> str:
     return CONFIG.instance
   
-  def create_cell(self, input):    
+  def create_cell(self, input, auth_type=None):
     query = """
       mutation CreateCell($input: CreateCellInput!) {
         createCell(input: $input) {
@@ -51,20 +180,43 @@ class Client:
         }
       }
     """
-    if CognitoAuth().is_authd():
-      auth_type = 'AMAZON_COGNITO_USER_POOLS'
-    else:
-      # fallback to guest (public iam)
-      auth_type = 'AWS_IAM'
-    ret = self._get_gql_client(auth_type).execute(
-      query=query, variables={"input": input}
-    )
+    ret = self._execute(auth_type, query, {"input": input}, 'graphql.mutation')
     if "errors" in ret:
       raise Exception(ret["errors"][0]["message"])
 
     return ret["data"]["createCell"]["id"]
+
+  def create_cells(self, inputs, auth_type=None):
+    """Create several cells with one request, an id or an Exception for each input"""
+    results = self._execute_aliased(
+      auth_type, 'createCell', 'input', 'CreateCellInput!', '{ id }', inputs, 'graphql.mutation',
+    )
+    return [r if isinstance(r, Exception) else r["id"] for r in results]
+
+  def _execute_aliased(self, auth_type, field, arg, arg_type, selection, values, operation):
+    """One document with an aliased mutation per value; a result or an Exception for each.
+
+    AppSync reports per-field errors with the alias as path, the other fields still resolve.
+    """
+    params = ", ".join(f"$v{i}: {arg_type}" for i in range(len(values)))
+    fields = "\n".join(f"m{i}: {field}({arg}: $v{i}) {selection}" for i in range(len(values)))
+    query = f"mutation Batch({params}) {{\n{fields}\n}}"
+    ret = self._execute(auth_type, query, {f"v{i}": v for i, v in enumerate(values)}, operation)
+    errors = {}
+    for err in ret.get("errors") or []:
+      path = err.get("path") or [None]
+      errors.setdefault(path[0], err.get("message", str(err)))
+    data = ret.get("data") or {}
+    results = []
+    for i in range(len(values)):
+      alias = f"m{i}"
+      if data.get(alias) is not None:
+        results.append(data[alias])
+      else:
+        results.append(Exception(errors.get(alias) or errors.get(None) or f"No {field} result"))
+    return results
   
-  def create_invite(self, input):
+  def create_invite(self, input, auth_type=None):
     query = """
       mutation CreateInvite(
         $input: CreateInviteInput!
@@ -74,20 +226,13 @@ class Client:
         }
       }
     """
-    if CognitoAuth().is_authd():
-      auth_type = 'AMAZON_COGNITO_USER_POOLS'
-    else:
-      # fallback to guest (public iam)
-      auth_type = 'AWS_IAM'
-    ret = self._get_gql_client(auth_type).execute(
-      query=query, variables={"input": input}
-    )
+    ret = self._execute(auth_type, query, {"input": input}, 'graphql.mutation')
     if "errors" in ret:
       raise Exception(ret["errors"][0]["message"])
 
     return ret["data"]["createInvite"]["id"]
   
-  def get_callback(self, id):
+  def get_callback(self, id, auth_type='AWS_IAM'):
     query = """
       query GetCallback($id: ID!) {
         getCallback(id: $id) {
@@ -95,50 +240,172 @@ class Client:
         }
       }
     """
-    ret = self._get_gql_client('AWS_IAM').execute(
-      query=query, variables={"id": id}
-    )
+    ret = self._execute(auth_type, query, {"id": id})
     if "errors" in ret:
       raise Exception(ret["errors"][0]["message"])
     return (ret["data"]["getCallback"] or {}).get("id")
-  
-  def run_cell(self, req):
+
+  def wait_for_callback(self, id, timeout=None, cancel=None):
+    """Block until callback `id` is registered, i.e. the user confirmed in the browser.
+
+    Listens to the callback subscription when the real-time endpoint is reachable,
+    otherwise polls getCallback with exponential backoff. Raises PollTimeout after
+    timeout seconds (callback_timeout setting), PollCancelled once cancel, a
+    threading.Event, is set.
+    """
+    timeout = CONFIG.callback_timeout if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    if CONFIG.callback_transport != 'poll' and realtime.available():
+      try:
+        return self._wait_for_callback_subscription(id, deadline, cancel)
+      except realtime.SubscriptionUnavailable as e:
+        logger.info(f"Polling for callback: {e}")
+    return poll_until(
+      lambda: self.get_callback(id) == id and id, deadline=deadline, cancel=cancel,
+    )
+
+  def _wait_for_callback_subscription(self, id, deadline, cancel):
     query = """
-      mutation RunCell($request: ExecuteRequestInput) {
-        runCell(request: $request) {
+      subscription OnCreateCallback($id: ID!) {
+        onCreateCallback(id: $id) {
+          id
+        }
+      }
+    """
+    realtime.realtime_url(CONFIG.api_endpoint)
+    auth = self._get_auth('AWS_IAM')
+    with realtime.Subscription(CONFIG.api_endpoint, auth, query, {"id": id}) as sub:
+      # confirmed before the subscription started
+      if self.get_callback(id) == id:
+        return id
+      while True:
+        if cancel is not None and cancel.is_set():
+          raise PollCancelled
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          raise PollTimeout
+        data = sub.next(timeout=min(remaining, 1))
+        if data and (data.get("onCreateCallback") or {}).get("id") == id:
+          return id
+  
+  def run_cell(self, req, auth_type='AWS_IAM'):
+    query = f"""
+      mutation RunCell($request: ExecuteRequestInput) {{
+        runCell(request: $request) {{
           stdout
           stderr
-          outputs {
-            representations {
-              mime
-              key
-              width
-              height
-              data
-            }
-            metadata
-          }
+          {OUTPUTS_SELECTION}
           traceback
-          userNS {
-            name
-            key
-            value
-            serializationType
-          }
-        }
-      } 
+          {USER_NS_SELECTION}
+        }}
+      }}
     """
-    ret = self._get_gql_client('AWS_IAM').execute(
-      query=query, variables={"request": req}
-    )
+    ret = self._execute(auth_type, query, {"request": req}, 'run_cell')
     if "errors" in ret:
       raise Exception(ret["errors"][0]["message"])
     return ret["data"]["runCell"]
+
+  def run_cell_streaming(self, req, on_chunk, auth_type='AWS_IAM', timeout=None, cancel=None):
+    """run_cell, calling on_chunk with each piece of output as the remote run produces it.
+
+    Chunks have any of stdout, stderr, outputs and traceback, the reply returned is
+    run_cell's. The run is started with startRunCell and its output read page by page
+    with runCellOutput from a cursor, so a lost response is just read again. When the
+    API has no streamed runs (or with the run_transport setting "blocking"), the cell
+    runs with runCell and its whole output is passed as one chunk.
+    """
+    if CONFIG.run_transport != 'blocking' and self._run_streaming is not False:
+      query = """
+        mutation StartRunCell($request: ExecuteRequestInput) {
+          startRunCell(request: $request) {
+            id
+          }
+        }
+      """
+      ret = self._execute(auth_type, query, {"request": req}, 'graphql.mutation')
+      if _field_undefined(ret, 'startRunCell'):
+        logger.info("Streamed runs aren't available, running the cell in one request")
+        self._run_streaming = False
+      elif "errors" in ret:
+        raise Exception(ret["errors"][0]["message"])
+      else:
+        self._run_streaming = True
+        timeout = get_policy('run_cell').timeout[1] if timeout is None else timeout
+        return self._read_run_output(
+          ret["data"]["startRunCell"]["id"], on_chunk, auth_type, time.monotonic() + timeout, cancel,
+        )
+    reply = self.run_cell(req, auth_type)
+    on_chunk({k: reply.get(k) for k in ("stdout", "stderr", "outputs", "traceback")})
+    return reply
+
+  def _read_run_output(self, run_id, on_chunk, auth_type, deadline, cancel):
+    query = f"""
+      query RunCellOutput($id: ID!, $cursor: String) {{
+        runCellOutput(id: $id, cursor: $cursor) {{
+          cursor
+          done
+          chunks {{
+            stdout
+            stderr
+            {OUTPUTS_SELECTION}
+            traceback
+          }}
+          {USER_NS_SELECTION}
+        }}
+      }}
+    """
+    cursor = None
+    stdout, stderr, outputs, traceback = [], [], [], []
+    delays = backoff(initial=0.2, maximum=2)
+    while True:
+      ret = self._execute(auth_type, query, {"id": run_id, "cursor": cursor})
+      if "errors" in ret:
+        raise Exception(ret["errors"][0]["message"])
+      page = ret["data"]["runCellOutput"]
+      chunks = page.get("chunks") or []
+      for chunk in chunks:
+        stdout.append(chunk.get("stdout") or "")
+        stderr.append(chunk.get("stderr") or "")
+        outputs.extend(chunk.get("outputs") or [])
+        traceback.extend(chunk.get("traceback") or [])
+        on_chunk(chunk)
+      cursor = page.get("cursor") or cursor
+      if page.get("done"):
+        return {
+          "stdout": "".join(stdout),
+          "stderr": "".join(stderr),
+          "outputs": outputs,
+          "traceback": traceback or None,
+          "userNS": page.get("userNS") or [],
+        }
+      if chunks:
+        # output is flowing, ask again soon
+        delays = backoff(initial=0.2, maximum=2)
+      delay = next(delays)
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        raise PollTimeout
+      delay = min(delay, remaining)
+      if cancel is not None:
+        if cancel.wait(delay):
+          raise PollCancelled
+      else:
+        time.sleep(delay)
   
   @property
   def s3(self):
     if not self._s3:
-      self._s3 = self._get_session().client('s3')
+      if CONFIG.aws_backend == 'lite':
+        from .lite import LiteS3
+        self._s3 = LiteS3(
+          lambda: self._cognito_creds.credentials['Credentials'],
+          CONFIG.storage_region,
+          CONFIG.s3_endpoint_url,
+        )
+      else:
+        self._s3 = self._get_session().client(
+          's3', endpoint_url=CONFIG.s3_endpoint_url, config=get_policy('s3').botocore_config(),
+        )
     return self._s3
   
   def upload(self, key, value):
@@ -148,16 +415,86 @@ class Client:
       Body=value,
     )
     logger.debug(f"s3 put_object response: {resp}")
+
+  def upload_stream(self, key, source, part_size=None, max_concurrency=None, compression='none'):
+    """Multipart upload from a file object, bytes-like value or iterable of chunks.
+
+    compression (none, auto or a codec name) is only for objects read back through
+    Client.get or iter_chunks: the remote kernel and the web app don't decode it.
+    The compression applied, if any, is recorded as the object's ContentEncoding.
+    """
+    payload, encoding = compress_payload(source, compression)
+    upload_stream(
+      self.s3, CONFIG.storage_bucket, key, payload,
+      part_size=part_size, max_concurrency=max_concurrency,
+      extra_args={'ContentEncoding': encoding} if encoding else None,
+    )
   
+  def exists(self, key) -> bool:
+    try:
+      self.s3.head_object(
+        Key=key,
+        Bucket=CONFIG.storage_bucket,
+      )
+      return True
+    except Exception as err:
+      # a denied HEAD is as good as a missing object, the caller uploads it again
+      logger.debug(f"s3 head_object {key} failed: {err}")
+      return False
+
+  def head(self, key) -> Optional[dict]:
+    """Object metadata (ContentLength, ETag, ContentEncoding...), None if it doesn't exist"""
+    try:
+      return self.s3.head_object(Key=key, Bucket=CONFIG.storage_bucket)
+    except Exception as err:
+      status = getattr(err, 'response', {}).get('ResponseMetadata', {}).get('HTTPStatusCode')
+      if status == 404:
+        return None
+      raise
+
+  def get_stream(self, key, start=0, if_match=None) -> dict:
+    """get_object response from byte start on, its Body read as it is consumed.
+
+    With if_match, an ETag, the request fails with a 412 if the object changed.
+    """
+    args = {}
+    if start:
+      args['Range'] = f'bytes={start}-'
+    if if_match:
+      args['IfMatch'] = if_match
+    return self.s3.get_object(Key=key, Bucket=CONFIG.storage_bucket, **args)
+
+  def iter_chunks(self, key, byte_range=None, part_size=None, max_concurrency=None, chunk_size=2 ** 20):
+    """The object's content as a generator of chunks, decompressed per its ContentEncoding.
+
+    byte_range is an HTTP-style range (START-END, START- or -SUFFIX) of an uncompressed
+    object. Large objects are fetched as parallel ranged GETs with bounded memory, see
+    transfer.download_chunks.
+    """
+    head = self.head(key)
+    if head is None:
+      raise Exception(f"No such object: {key}")
+    size = head['ContentLength']
+    encoding = head.get('ContentEncoding')
+    if byte_range and encoding and encoding != 'identity':
+      raise Exception(f"Byte ranges can't be read from {encoding} compressed objects")
+    first, last = parse_range(byte_range, size) if byte_range else (0, size - 1)
+    chunks = download_chunks(
+      self.s3, CONFIG.storage_bucket, key, first, last, etag=head.get('ETag'),
+      part_size=part_size, max_concurrency=max_concurrency, chunk_size=chunk_size,
+    )
+    return decompress_chunks(chunks, encoding)
+
   def get(self, key):
     resp = self.s3.get_object(
       Key=key,
       Bucket=CONFIG.storage_bucket,
     )
     logger.debug(f"s3 get_object response: {resp}")
-    return resp['Body'].read()
+    return decompress_payload(resp['Body'].read(), resp.get('ContentEncoding'))
 
   def _get_session(self):
+    import boto3
     creds = self._cognito_creds.credentials['Credentials']
     return boto3.Session(
       aws_access_key_id=creds['AccessKeyId'],
@@ -0,0 +1,230 @@
+import zlib
+from abc import ABC, abstractmethod
+from logging import getLogger
+from typing import Optional
+from .config import CONFIG
+
+logger = getLogger("thousandwords.compression")
+
+# bytes compressed from each sampled window to estimate compressibility
+SAMPLE_WINDOW = 64 * 2 ** 10
+SAMPLE_WINDOWS = 4
+# above this compressed/raw ratio the payload is sent as is
+INCOMPRESSIBLE_RATIO = 0.9
+# below this ratio the fast level already gets most of the gain
+COMPRESSIBLE_RATIO = 0.5
+
+class Codec(ABC):
+  """A compression format, named after its HTTP Content-Encoding"""
+  encoding = None
+  fast_level = None
+  strong_level = None
+
+  @classmethod
+  def available(cls) -> bool:
+    return True
+
+  @abstractmethod
+  def compressobj(self, level):
+    """Object with compress(data) and flush() producing the format at level"""
+
+  @abstractmethod
+  def decompressobj(self):
+    """Object with decompress(data) and flush() decoding the format"""
+
+  def compress(self, data, level=None) -> bytes:
+    c = self.compressobj(self.fast_level if level is None else level)
+    return c.compress(data) + c.flush()
+
+  def decompress(self, data) -> bytes:
+    d = self.decompressobj()
+    return d.decompress(data) + d.flush()
+
+class ZstdCodec(Codec):
+  encoding = 'zstd'
+  fast_level = 3
+  strong_level = 9
+
+  @classmethod
+  def available(cls) -> bool:
+    try:
+      import zstandard
+      return True
+    except ImportError:
+      return False
+
+  def compressobj(self, level):
+    import zstandard
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+  def decompressobj(self):
+    import zstandard
+    d = zstandard.ZstdDecompressor().decompressobj()
+    # zstandard's decompressobj has no flush before 0.15
+    return _Flushable(d)
+
+class Lz4Codec(Codec):
+  encoding = 'lz4'
+  fast_level = 0
+  strong_level = 9
+
+  @classmethod
+  def available(cls) -> bool:
+    try:
+      import lz4.frame
+      return True
+    except ImportError:
+      return False
+
+  def compressobj(self, level):
+    import lz4.frame
+    return _Lz4Compressor(lz4.frame.LZ4FrameCompressor(compression_level=level))
+
+  def decompressobj(self):
+    import lz4.frame
+    return _Flushable(lz4.frame.LZ4FrameDecompressor())
+
+class GzipCodec(Codec):
+  """zlib with gzip framing, decoded transparently by browsers and requests"""
+  encoding = 'gzip'
+  fast_level = 1
+  strong_level = 6
+
+  def compressobj(self, level):
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+  def decompressobj(self):
+    return zlib.decompressobj(31)
+
+class _Flushable:
+  def __init__(self, d):
+    self._d = d
+
+  def decompress(self, data) -> bytes:
+    return self._d.decompress(data)
+
+  def flush(self) -> bytes:
+    return b''
+
+class _Lz4Compressor:
+  def __init__(self, c):
+    self._c = c
+    self._header = c.begin()
+
+  def compress(self, data) -> bytes:
+    out = self._header + self._c.compress(data)
+    self._header = b''
+    return out
+
+  def flush(self) -> bytes:
+    return self._header + self._c.flush()
+
+# in order of preference
+CODECS = [ZstdCodec, Lz4Codec, GzipCodec]
+
+def get_codec(encoding: str) -> Codec:
+  for cls in CODECS:
+    if cls.encoding == encoding:
+      if not cls.available():
+        raise Exception(f"Compression '{encoding}' requires a package that is not installed")
+      return cls()
+  raise Exception(f"Unknown compression '{encoding}'")
+
+def negotiate(setting: Optional[str] = None, accepted=None) -> Optional[Codec]:
+  """Codec for a compression setting: none, auto (best installed one), or a codec name.
+
+  accepted restricts auto to the encodings a reader can decode.
+  """
+  setting = (setting or CONFIG.compression).lower()
+  if setting == 'none':
+    return None
+  if setting != 'auto':
+    return get_codec(setting)
+  for cls in CODECS:
+    if (accepted is None or cls.encoding in accepted) and cls.available():
+      return cls()
+  return None
+
+def _windows(data):
+  chunks = [memoryview(c).cast('B') for c in (data if isinstance(data, (list, tuple)) else [data])]
+  total = sum(len(c) for c in chunks)
+  if total <= SAMPLE_WINDOW * SAMPLE_WINDOWS:
+    return chunks
+  offsets = [i * (total - SAMPLE_WINDOW) // (SAMPLE_WINDOWS - 1) for i in range(SAMPLE_WINDOWS)]
+  windows = []
+  for offset in offsets:
+    pos = 0
+    for c in chunks:
+      if pos + len(c) > offset:
+        windows.append(c[offset - pos:offset - pos + SAMPLE_WINDOW])
+        break
+      pos += len(c)
+  return windows
+
+def choose_level(codec: Codec, data) -> Optional[int]:
+  """Compression level from the ratio achieved on sampled windows, None if not worth compressing"""
+  raw = 0
+  compressed = 0
+  for window in _windows(data):
+    raw += len(window)
+    compressed += len(codec.compress(window, codec.fast_level))
+  if not raw:
+    return None
+  ratio = compressed / raw
+  logger.debug(f"Sampled {codec.encoding} compression ratio: {ratio:.2f}")
+  if ratio > INCOMPRESSIBLE_RATIO:
+    return None
+  return codec.fast_level if ratio < COMPRESSIBLE_RATIO else codec.strong_level
+
+def _compressed_chunks(codec, level, chunks):
+  c = codec.compressobj(level)
+  for chunk in chunks:
+    out = c.compress(chunk)
+    if out:
+      yield out
+  yield c.flush()
+
+def _read_chunks(f, size=2 ** 20):
+  while True:
+    chunk = f.read(size)
+    if not chunk:
+      return
+    yield chunk
+
+def compress_payload(source, setting: Optional[str] = None):
+  """(payload, encoding) for upload; payload is compressed lazily, chunk by chunk.
+
+  Bytes-like values and chunk lists are sampled to pick a level or skip compression,
+  streams are compressed at the codec's fast level.
+  """
+  codec = negotiate(setting)
+  if codec is None:
+    return source, None
+  if isinstance(source, (bytes, bytearray, memoryview, list, tuple)):
+    level = choose_level(codec, source)
+    if level is None:
+      return source, None
+    chunks = source if isinstance(source, (list, tuple)) else [source]
+  else:
+    level = codec.fast_level
+    chunks = _read_chunks(source) if hasattr(source, 'read') else source
+  return _compressed_chunks(codec, level, chunks), codec.encoding
+
+def decompress_chunks(chunks, encoding: Optional[str]):
+  """Decompressed chunks, decoded as they arrive"""
+  if not encoding or encoding == 'identity':
+    yield from chunks
+    return
+  d = get_codec(encoding).decompressobj()
+  for chunk in chunks:
+    out = d.decompress(chunk)
+    if out:
+      yield out
+  out = d.flush()
+  if out:
+    yield out
+
+def decompress_payload(data: bytes, encoding: Optional[str]) -> bytes:
+  if not encoding or encoding == 'identity':
+    return data
+  return get_codec(encoding).decompress(data)
@@ -1,5 +1,6 @@
 import os
-import requests
+import time
+import threading
 
 from logging import getLogger
 from pathlib import Path
@@ -42,6 +43,12 @@ class Config:
     self._instance: Optional[str] = None
     self._instance_protocol: Optional[str] = None
 
+    # stack.json fetches are serialized; a caller that waited on the lock skips its fetch
+    # if the generation moved on meanwhile
+    self._stack_lock = threading.Lock()
+    self._stack_generation = 0
+    self._stack_refreshing = threading.Lock()
+
   def _get(self, key: str) -> Optional[str]:
     # Environment variable first, then config
     env_key = "THOUSANDWORDS_" + key.upper()
@@ -60,24 +67,87 @@ class Config:
       return None
 
   def _get_or_stack(self, key: str) -> str:
+    env_key = "THOUSANDWORDS_" + key.upper()
     val = self._get(key)
     if val is None:
-      self._update_from_stack(self._fetch_stack())
+      self._refresh_stack(self._stack_generation)
       val = self._get(key)
+    elif env_key not in os.environ and self._stack_is_stale():
+      # values overridden by the environment don't depend on stack.json
+      self._refresh_stack_in_background()
     if val is None:
       raise KeyError
     return val
 
+  def _stack_is_stale(self) -> bool:
+    fetched_at = self._get("stack_fetched_at")
+    try:
+      return time.time() - float(fetched_at) > self.stack_ttl
+    except (TypeError, ValueError):
+      return True
+
+  def _refresh_stack(self, generation: int, conditional: bool = False) -> None:
+    with self._stack_lock:
+      if generation != self._stack_generation or (conditional and not self._stack_is_stale()):
+        # fetched by another thread while we waited
+        return
+      stack = self._fetch_stack(conditional=conditional)
+      if stack is not None:
+        self._update_from_stack(stack)
+      else:
+        self.save(update_default_instance=False)
+      self._stack_generation += 1
+
+  def _refresh_stack_in_background(self) -> None:
+    """Revalidate stale stack values without blocking, they stay in use meanwhile"""
+    if not self._stack_refreshing.acquire(blocking=False):
+      return
+    generation = self._stack_generation
+    def refresh():
+      try:
+        self._refresh_stack(generation, conditional=True)
+      except Exception as e:
+        logger.debug(f"Background stack config refresh failed: {e}")
+      finally:
+        self._stack_refreshing.release()
+    threading.Thread(target=refresh, daemon=True).start()
+
   def _set(self, key: str, val: str) -> None:
     if self.instance not in self._config:
       self._config.add_section(self.instance)
     self._config[self.instance][key] = val
 
-  def _fetch_stack(self) -> Dict[str, str]:
+  def _fetch_stack(self, conditional: bool = False) -> Optional[Dict[str, str]]:
+    """stack.json content; None if conditional and unchanged since the last fetch"""
     stack_config_url = urljoin(self.instance_url, "stack.json")
     logger.info(f"Fetching stack config from {stack_config_url}")
-    response = requests.get(stack_config_url)
-    response.raise_for_status()
+    # imported here, both modules read their settings from CONFIG
+    from .sessions import get_session
+    from .policy import get_policy
+    policy = get_policy("config.stack")
+    headers = {}
+    if conditional:
+      etag = self._get("stack_etag")
+      last_modified = self._get("stack_last_modified")
+      if etag:
+        headers["If-None-Match"] = etag
+      if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    def fetch():
+      response = get_session().get(stack_config_url, headers=headers, timeout=policy.timeout)
+      response.raise_for_status()
+      return response
+    response = policy.call(fetch)
+    self._set("stack_fetched_at", str(int(time.time())))
+    if response.status_code == 304:
+      logger.info("Stack config not modified")
+      return None
+    for header, key in (("ETag", "stack_etag"), ("Last-Modified", "stack_last_modified")):
+      if response.headers.get(header):
+        # escaped for ConfigParser interpolation
+        self._set(key, response.headers[header].replace("%", "%%"))
+      elif key in self._config[self.instance]:
+        del self._config[self.instance][key]
     try:
       resp_json: Dict[str, str] = response.json()
       return resp_json
@@ -86,6 +156,8 @@ class Config:
 
   def _update_from_stack(self, stack: Dict[str, str]) -> None:
     self._set("storage_bucket", stack["aws_user_files_s3_bucket"])
+    if "aws_user_files_s3_bucket_region" in stack:
+      self._set("storage_region", stack["aws_user_files_s3_bucket_region"])
     self._set("user_pool_client_id", stack["aws_user_pools_client_id"])
     self._set("user_pool_id", stack["aws_user_pools_id"])
     cognito_region = stack["aws_cognito_region"]
@@ -139,6 +211,22 @@ class Config:
   def guest_id_path(self) -> Optional[str]:
     return self._get("guest_id_path") or os.path.join(_CONFIG_PATH, ".guest-id")
 
+  @property
+  def credentials_path(self) -> Optional[str]:
+    return self._get("credentials_path") or os.path.join(_CONFIG_PATH, ".credentials")
+
+  @property
+  def upload_index_path(self) -> Optional[str]:
+    return self._get("upload_index_path") or os.path.join(_CONFIG_PATH, ".upload-index")
+
+  @property
+  def upload_index_ttl(self) -> int:
+    return int(self._get("upload_index_ttl") or 7 * 24 * 3600)
+
+  @property
+  def upload_index_size(self) -> int:
+    return int(self._get("upload_index_size") or 1000)
+
   @property
   def user_pool_id(self) -> str:
     return self._get_or_stack("user_pool_id")
@@ -175,12 +263,100 @@ class Config:
   def api_region(self) -> str:
     return self._get_or_stack("api_region")
 
+  @property
+  def stack_ttl(self) -> int:
+    return int(self._get("stack_ttl") or 24 * 3600)
+
+  @property
+  def storage_region(self) -> str:
+    # stack.json files predating the bucket region setting share the Cognito region
+    return self._get("storage_region") or self.cognito_region
+
+  @property
+  def aws_backend(self) -> str:
+    # "boto3", or "lite" for the minimal signed-HTTP clients in thousandwords.lite
+    return self._get("aws_backend") or "boto3"
+
+  @property
+  def s3_endpoint_url(self) -> Optional[str]:
+    return self._get("s3_endpoint_url")
+
+  @property
+  def cognito_endpoint_url(self) -> Optional[str]:
+    return self._get("cognito_endpoint_url")
+
+  @property
+  def upload_concurrency(self) -> int:
+    return int(self._get("upload_concurrency") or 8)
+
+  @property
+  def multipart_part_size(self) -> int:
+    return int(self._get("multipart_part_size") or 8 * 2 ** 20)
+
+  @property
+  def multipart_concurrency(self) -> int:
+    return int(self._get("multipart_concurrency") or 4)
+
+  @property
+  def serialization_cache_size(self) -> int:
+    # memory kept for copies of serialized dependencies, 0 disables the cache
+    return int(self._get("serialization_cache_size") or 512 * 2 ** 20)
+
+  @property
+  def lint_cache_size(self) -> int:
+    # cells whose parsed source and undefined names are kept
+    return int(self._get("lint_cache_size") or 128)
+
+  @property
+  def capture_spill_size(self) -> int:
+    # characters of captured text kept in memory, longer text goes to a temporary file
+    return int(self._get("capture_spill_size") or 2 ** 20)
+
+  @property
+  def inline_output_size(self) -> int:
+    # bytes of an HTML, JSON or SVG output sent in createCell, larger ones are uploaded
+    return int(self._get("inline_output_size") or 64 * 2 ** 10)
+
+  @property
+  def compression(self) -> str:
+    # of `storage upload` objects; publish uploads are never compressed, their readers don't decode them
+    return self._get("compression") or "none"
+
+  @property
+  def http_pool_size(self) -> int:
+    return int(self._get("http_pool_size") or 10)
+
+  @property
+  def http_retries(self) -> int:
+    return int(self._get("http_retries") or 3)
+
+  @property
+  def http_backoff(self) -> float:
+    return float(self._get("http_backoff") or 0.5)
+
+  @property
+  def callback_timeout(self) -> int:
+    # unconfirmed private publications expire after 10 minutes
+    return int(self._get("callback_timeout") or 10 * 60)
+
+  @property
+  def callback_transport(self) -> str:
+    return self._get("callback_transport") or "auto"
+
+  @property
+  def run_transport(self) -> str:
+    # "auto" streams remote run outputs when the API supports it, "blocking" never does
+    return self._get("run_transport") or "auto"
+
   def save(self, update_default_instance: bool = True) -> None:
     logger.info(f"Saving config to '{self._fname}'")
     if update_default_instance:
       self._config["DEFAULT"]["instance"] = self.instance
     os.makedirs(os.path.dirname(self._fname), exist_ok=True)
-    with open(self._fname, "w") as f:
+    # replaced atomically, other processes may be reading it
+    tmp = f"{self._fname}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
       self._config.write(f)
+    os.replace(tmp, self._fname)
 
 CONFIG = Config()
@@ -1,52 +1,184 @@
-import boto3
+import json
+import time
+import base64
+import threading
+from datetime import datetime, timezone
+from typing import Optional
 from logging import getLogger
 from configparser import ConfigParser
 import os
 from thousandwords.config import CONFIG
 from thousandwords.auth import CognitoAuth
+from thousandwords.locking import file_lock
+from thousandwords.policy import get_policy
 
 logger = getLogger("thousandwords.credentials")
 
+# credentials closer than this to expiry are renewed before use
+REFRESH_SKEW = 5 * 60
+# credentials closer than this to expiry are still used, but renewed in the background
+REFRESH_AHEAD = 15 * 60
+
 class GuestNotFoundException(Exception):
   def __str__(self) -> str:
     return "No IdentityId for guest found"
 
+def _expires_in(credentials) -> float:
+  return credentials['Credentials']['Expiration'].timestamp() - time.time()
+
+def _jwt_subject(token: str) -> str:
+  try:
+    payload = token.split('.')[1]
+    claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    return claims['sub']
+  except Exception:
+    return 'unknown'
+
 class CognitoCredentials:
   def __init__(self):
-    self._cognito = boto3.Session(region_name=CONFIG.cognito_region).client('cognito-identity')
+    self._cognito = None
     self._credentials = None
-  
+    self._refreshing = threading.Lock()
+
   @property
-  def credentials(self):
-    if self._credentials is None:
-      auth = CognitoAuth()
-      if auth.is_authd():
-        jwt_token = auth.get_or_refresh_token()
-        logins = {
-          f"cognito-idp.{CONFIG.cognito_region}.amazonaws.com/{CONFIG.user_pool_id}": jwt_token
-        }
-        resp = self._cognito.get_id(
-          IdentityPoolId=CONFIG.identity_pool_id,
-          Logins=logins
-        )
-        identityId = resp['IdentityId']
-        resp = self._cognito.get_credentials_for_identity(
-          IdentityId=identityId,
-          Logins=logins
-        )
-        self._credentials = resp
+  def cognito(self):
+    if self._cognito is None:
+      if CONFIG.aws_backend == 'lite':
+        from .lite import LiteCognitoIdentity
+        self._cognito = LiteCognitoIdentity(CONFIG.cognito_region, CONFIG.cognito_endpoint_url)
       else:
-        identityId = self.guest_identity_id
-        resp = self._cognito.get_credentials_for_identity(IdentityId=identityId)
-        self._credentials = resp
+        import boto3
+        self._cognito = boto3.Session(region_name=CONFIG.cognito_region).client(
+          'cognito-identity', endpoint_url=CONFIG.cognito_endpoint_url,
+          config=get_policy('cognito').botocore_config(),
+        )
+    return self._cognito
+
+  @property
+  def credentials(self):
+    if self._credentials is None or _expires_in(self._credentials) < REFRESH_SKEW:
+      self._credentials = self._load_or_fetch(REFRESH_SKEW)
+    elif _expires_in(self._credentials) < REFRESH_AHEAD:
+      self._refresh_in_background()
     return self._credentials
-  
+
+  def _refresh_in_background(self) -> None:
+    if not self._refreshing.acquire(blocking=False):
+      return
+    def refresh():
+      try:
+        self._credentials = self._load_or_fetch(REFRESH_AHEAD)
+      except Exception as e:
+        logger.debug(f"Background credentials refresh failed: {e}")
+      finally:
+        self._refreshing.release()
+    threading.Thread(target=refresh, daemon=True).start()
+
+  def renew(self) -> None:
+    """Replace credentials that were rejected, e.g. by a 401.
+
+    The cache file holds the same rejected keys unless another process already
+    renewed them, so only newer cached keys are reused.
+    """
+    current = self._credentials
+    rejected = current['Credentials']['AccessKeyId'] if current else None
+    self._credentials = None
+    self._credentials = self._load_or_fetch(REFRESH_SKEW, rejected)
+
+  def _load_or_fetch(self, min_ttl: float, rejected: Optional[str] = None):
+    """Credentials valid for at least min_ttl seconds, from the cache file if possible.
+
+    Fetching happens under a file lock and re-checks the cache first, so concurrent
+    processes renew once. Cached credentials with access key id rejected are skipped.
+    """
+    jwt_token = self._jwt_token()
+    principal = f"user:{_jwt_subject(jwt_token)}" if jwt_token else "guest"
+    usable = lambda creds: (
+      creds is not None and _expires_in(creds) >= min_ttl
+      and creds['Credentials']['AccessKeyId'] != rejected
+    )
+    creds = self._load_credentials(principal)
+    if usable(creds):
+      return creds
+    with file_lock(CONFIG.credentials_path + '.lock'):
+      creds = self._load_credentials(principal)
+      if usable(creds):
+        return creds
+      creds = self._fetch_credentials(jwt_token)
+      self._save_credentials(principal, creds)
+      return creds
+
+  def _jwt_token(self):
+    try:
+      return CognitoAuth().get_or_refresh_token()
+    except Exception:
+      return None
+
+  def _fetch_credentials(self, jwt_token):
+    if jwt_token:
+      logins = {
+        f"cognito-idp.{CONFIG.cognito_region}.amazonaws.com/{CONFIG.user_pool_id}": jwt_token
+      }
+      resp = self.cognito.get_id(
+        IdentityPoolId=CONFIG.identity_pool_id,
+        Logins=logins
+      )
+      identityId = resp['IdentityId']
+      return self.cognito.get_credentials_for_identity(
+        IdentityId=identityId,
+        Logins=logins
+      )
+    else:
+      identityId = self.guest_identity_id
+      return self.cognito.get_credentials_for_identity(IdentityId=identityId)
+
+  def _load_credentials(self, principal: str):
+    fname = CONFIG.credentials_path
+    logger.info(f"Loading credentials from {fname}")
+    credfile = ConfigParser()
+    credfile.read(fname)
+    try:
+      creds = dict(credfile[CONFIG.instance])
+      if creds['principal'] != principal:
+        return None
+      return {
+        'IdentityId': creds['identityid'],
+        'Credentials': {
+          'AccessKeyId': creds['accesskeyid'],
+          'SecretKey': creds['secretkey'],
+          'SessionToken': creds['sessiontoken'],
+          'Expiration': datetime.fromtimestamp(int(creds['expiration']), timezone.utc),
+        },
+      }
+    except Exception:
+      return None
+
+  def _save_credentials(self, principal: str, credentials) -> None:
+    fname = CONFIG.credentials_path
+    logger.info(f"Saving credentials to {fname}")
+    creds = credentials['Credentials']
+    credfile = ConfigParser()
+    credfile.read(fname)
+    credfile[CONFIG.instance] = {
+      'principal': principal,
+      'identityid': credentials['IdentityId'],
+      'accesskeyid': creds['AccessKeyId'],
+      'secretkey': creds['SecretKey'],
+      'sessiontoken': creds['SessionToken'],
+      'expiration': str(int(creds['Expiration'].timestamp())),
+    }
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with (
+      open(os.open(fname, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600), "w")
+    ) as f:
+      credfile.write(f)
+
   @property
   def guest_identity_id(self) -> str:
     try:
       id = self._load_guest_identity_id()
     except GuestNotFoundException:
-      resp = self._cognito.get_id(IdentityPoolId=CONFIG.identity_pool_id)
+      resp = self.cognito.get_id(IdentityPoolId=CONFIG.identity_pool_id)
       id = resp['IdentityId']
       self._save_guest_identity_id(id)
     return id
@@ -60,7 +192,7 @@ class CognitoCredentials:
       id = dict(idfile[CONFIG.instance])
       return id['identityid']
     except Exception as e:
-      logger
+      logger.debug(f"No guest identity id for {CONFIG.instance} in {fname}: {e!r}")
       raise GuestNotFoundException
 
   def _save_guest_identity_id(self, id: str) -> None:
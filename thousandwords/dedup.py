@@ -0,0 +1,115 @@
+import os
+import time
+import secrets
+import hashlib
+import threading
+from logging import getLogger
+from configparser import ConfigParser
+from typing import Optional
+from .config import CONFIG
+
+logger = getLogger("thousandwords.dedup")
+
+# option holding the per-install digest key, next to the digest entries of an instance
+SALT_OPTION = "salt"
+
+class UploadIndex:
+  """Local record of content digest -> uploaded key, so unchanged payloads aren't uploaded again.
+
+  Entries older than ttl seconds are dropped, and only the max_entries most recently
+  used are kept. Digests are keyed with a random per-install salt so object keys
+  can't be derived from the content by anyone else.
+  """
+
+  def __init__(self, fname: Optional[str] = None, ttl: Optional[int] = None, max_entries: Optional[int] = None):
+    self._fname = fname or CONFIG.upload_index_path
+    self._ttl = CONFIG.upload_index_ttl if ttl is None else ttl
+    self._max_entries = CONFIG.upload_index_size if max_entries is None else max_entries
+    self._lock = threading.Lock()
+    self._salt = None
+    self._entries = None
+
+  def digest(self, data) -> Optional[str]:
+    """Keyed digest of a bytes-like value or a list of bytes-like chunks, None for one-shot streams"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+      chunks = [data]
+    elif isinstance(data, (list, tuple)):
+      chunks = data
+    else:
+      return None
+    self._load()
+    h = hashlib.blake2b(key=self._salt, digest_size=32)
+    for chunk in chunks:
+      h.update(chunk)
+    return h.hexdigest()
+
+  def lookup(self, digest: str) -> Optional[str]:
+    self._load()
+    now = int(time.time())
+    with self._lock:
+      entry = self._entries.get(digest)
+      if entry is None:
+        return None
+      key, uploaded_at, _ = entry
+      if now - uploaded_at > self._ttl:
+        del self._entries[digest]
+        return None
+      self._entries[digest] = (key, uploaded_at, now)
+      return key
+
+  def record(self, digest: str, key: str) -> None:
+    self._load()
+    now = int(time.time())
+    with self._lock:
+      self._entries[digest] = (key, now, now)
+
+  def discard(self, digest: str) -> None:
+    self._load()
+    with self._lock:
+      self._entries.pop(digest, None)
+
+  def save(self) -> None:
+    if self._entries is None:
+      return
+    now = int(time.time())
+    with self._lock:
+      entries = [
+        (digest, entry) for digest, entry in self._entries.items()
+        if now - entry[1] <= self._ttl
+      ]
+      entries = sorted(entries, key=lambda e: e[1][2], reverse=True)[:self._max_entries]
+      self._entries = dict(entries)
+    logger.info(f"Saving upload index to {self._fname}")
+    idxfile = ConfigParser()
+    idxfile.read(self._fname)
+    section = {SALT_OPTION: self._salt.hex()}
+    for digest, (key, uploaded_at, used_at) in entries:
+      section[digest] = f"{key} {uploaded_at} {used_at}"
+    idxfile[CONFIG.instance] = section
+    os.makedirs(os.path.dirname(self._fname), exist_ok=True)
+    with (
+      open(os.open(self._fname, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600), "w")
+    ) as f:
+      idxfile.write(f)
+
+  def _load(self) -> None:
+    with self._lock:
+      if self._entries is not None:
+        return
+      logger.info(f"Loading upload index from {self._fname}")
+      idxfile = ConfigParser()
+      idxfile.read(self._fname)
+      entries = {}
+      salt = None
+      if CONFIG.instance in idxfile:
+        for digest, val in idxfile[CONFIG.instance].items():
+          if digest == SALT_OPTION:
+            salt = bytes.fromhex(val)
+            continue
+          try:
+            key, uploaded_at, used_at = val.split(' ')
+            entries[digest] = (key, int(uploaded_at), int(used_at))
+          except ValueError:
+            logger.debug(f"Ignoring malformed upload index entry '{digest}'")
+      self._salt = salt or secrets.token_bytes(32)
+      self._entries = entries
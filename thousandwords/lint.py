@@ -1,7 +1,15 @@
-from pyflakes.api import check
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from pyflakes.checker import Checker
 from pyflakes.reporter import Reporter as PyfReporter
 from pyflakes.messages import UndefinedName
 from io import StringIO
+from .config import CONFIG
+
+FILENAME = "<cell>"
 
 class Reporter(PyfReporter):
   def __init__(self):
@@ -21,7 +29,79 @@ class Reporter(PyfReporter):
     if (isinstance(message, UndefinedName)):
       self.undefined.append(message)
 
-def resolveUndefined(code):
-  reporter = Reporter()
-  check(code, "<cell>", reporter)
-  return reporter.undefined
+class LintCache:
+  """Parsed trees and undefined names of recently linted cells, keyed by a hash of their source.
+
+  Publishing a cell again skips parsing and checking it. Only the max_entries most
+  recently used cells are kept.
+  """
+
+  def __init__(self, max_entries: Optional[int] = None):
+    self._max_entries = max_entries
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  @property
+  def max_entries(self) -> int:
+    return CONFIG.lint_cache_size if self._max_entries is None else self._max_entries
+
+  @staticmethod
+  def digest(code: str) -> str:
+    return hashlib.blake2b(code.encode(), digest_size=16).hexdigest()
+
+  def get(self, digest: str) -> Optional[list]:
+    """[tree, undefined names or None until checked] of a cached cell"""
+    with self._lock:
+      entry = self._entries.get(digest)
+      if entry is not None:
+        self._entries.move_to_end(digest)
+      return entry
+
+  def put(self, digest: str, tree, undefined=None) -> list:
+    entry = [tree, undefined]
+    if self.max_entries <= 0:
+      return entry
+    with self._lock:
+      self._entries[digest] = entry
+      self._entries.move_to_end(digest)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+    return entry
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._entries.clear()
+
+LINT_CACHE = LintCache()
+
+def _parse(code: str):
+  try:
+    return ast.parse(code, filename=FILENAME)
+  except SyntaxError as e:
+    Reporter().syntaxError(FILENAME, e.args[0], e.lineno, e.offset, e.text)
+  except Exception:
+    Reporter().unexpectedError(FILENAME, 'problem decoding source')
+
+def parse(code: str) -> ast.Module:
+  """code's AST, from the cache when code was parsed recently. Raises on syntax errors"""
+  digest = LINT_CACHE.digest(code)
+  entry = LINT_CACHE.get(digest)
+  if entry is not None:
+    return entry[0]
+  return LINT_CACHE.put(digest, _parse(code))[0]
+
+def resolveUndefined(code: str, tree: Optional[ast.Module] = None) -> List[UndefinedName]:
+  """pyflakes' undefined names in code. tree, code's AST, saves parsing it again"""
+  digest = LINT_CACHE.digest(code)
+  entry = LINT_CACHE.get(digest)
+  if entry is None:
+    entry = LINT_CACHE.put(digest, tree if tree is not None else _parse(code))
+  if entry[1] is None:
+    checker = Checker(entry[0], filename=FILENAME)
+    entry[1] = sorted(
+      [m for m in checker.messages if isinstance(m, UndefinedName)], key=lambda m: m.lineno,
+    )
+  return list(entry[1])
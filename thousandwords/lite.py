@@ -0,0 +1,273 @@
+""" Minimal Cognito Identity and S3 clients over the shared HTTP session.
+
+They implement the few boto3 calls thousandwords makes, with the same arguments and
+response shapes, and are selected with the aws_backend setting ("lite"). Without
+boto3 and botocore to import, short-lived CLI runs and kernels start faster and use
+less memory.
+"""
+import json
+import threading
+from datetime import datetime, timezone
+from logging import getLogger
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import quote
+from xml.etree import ElementTree
+from .sessions import get_session
+from .policy import get_policy
+
+logger = getLogger("thousandwords.lite")
+
+class ClientError(Exception):
+  """An AWS error response, shaped like botocore's ClientError so policies can classify it"""
+
+  def __init__(self, status: int, code: str, message: str, operation: str):
+    self.response = {
+      "Error": {"Code": code, "Message": message},
+      "ResponseMetadata": {"HTTPStatusCode": status},
+    }
+    self.operation = operation
+
+  def __str__(self) -> str:
+    error = self.response["Error"]
+    return f"An error occurred ({error['Code']}) when calling the {self.operation} operation: {error['Message']}"
+
+class LiteCognitoIdentity:
+  """GetId and GetCredentialsForIdentity; both are unsigned JSON calls"""
+
+  def __init__(self, region: str, endpoint_url: Optional[str] = None):
+    self._url = endpoint_url or f"https://cognito-identity.{region}.amazonaws.com/"
+    self._policy = get_policy("cognito")
+
+  def get_id(self, IdentityPoolId: str, Logins: Optional[dict] = None) -> dict:
+    body = {"IdentityPoolId": IdentityPoolId}
+    if Logins:
+      body["Logins"] = Logins
+    return self._call("GetId", body)
+
+  def get_credentials_for_identity(self, IdentityId: str, Logins: Optional[dict] = None) -> dict:
+    body = {"IdentityId": IdentityId}
+    if Logins:
+      body["Logins"] = Logins
+    resp = self._call("GetCredentialsForIdentity", body)
+    creds = resp["Credentials"]
+    creds["Expiration"] = datetime.fromtimestamp(float(creds["Expiration"]), timezone.utc)
+    return resp
+
+  def _call(self, operation: str, body: dict) -> dict:
+    def post():
+      resp = get_session().post(
+        self._url,
+        data=json.dumps(body),
+        headers={
+          "Content-Type": "application/x-amz-json-1.1",
+          "X-Amz-Target": f"AWSCognitoIdentityService.{operation}",
+        },
+        timeout=self._policy.timeout,
+      )
+      if resp.status_code >= 300:
+        try:
+          error = resp.json()
+        except ValueError:
+          error = {}
+        raise ClientError(
+          resp.status_code,
+          error.get("__type", str(resp.status_code)).split("#")[-1],
+          error.get("message", error.get("Message", resp.reason)),
+          operation,
+        )
+      return resp.json()
+    return self._policy.call(post)
+
+class TransferConfig:
+  """The subset of boto3.s3.transfer.TransferConfig LiteS3.upload_fileobj uses"""
+
+  def __init__(self, multipart_threshold=8 * 2 ** 20, multipart_chunksize=8 * 2 ** 20, max_concurrency=4, use_threads=True):
+    self.multipart_threshold = multipart_threshold
+    self.multipart_chunksize = multipart_chunksize
+    self.max_concurrency = max_concurrency if use_threads else 1
+
+class StreamingBody:
+  """Response body read from the connection as it is consumed, like botocore's"""
+
+  def __init__(self, response):
+    self._response = response
+
+  def read(self, amt: Optional[int] = None) -> bytes:
+    # content-encoding is the object's, decoded by the caller
+    return self._response.raw.read(amt, decode_content=False)
+
+  def iter_chunks(self, chunk_size: int = 1024):
+    while True:
+      chunk = self.read(chunk_size)
+      if not chunk:
+        return
+      yield chunk
+
+  def close(self) -> None:
+    self._response.close()
+
+_HEADERS = {
+  "ContentEncoding": "Content-Encoding",
+  "ContentType": "Content-Type",
+  "ContentLength": "Content-Length",
+  "ETag": "ETag",
+  "LastModified": "Last-Modified",
+}
+
+def _object_metadata(resp) -> dict:
+  meta = {key: resp.headers[header] for key, header in _HEADERS.items() if header in resp.headers}
+  if "ContentLength" in meta:
+    meta["ContentLength"] = int(meta["ContentLength"])
+  meta["ResponseMetadata"] = {"HTTPStatusCode": resp.status_code}
+  return meta
+
+class LiteS3:
+  """put_object, get_object, head_object and multipart upload_fileobj, signed with SigV4.
+
+  credentials is called for each request and returns a dict with AccessKeyId,
+  SecretKey and SessionToken, so renewed credentials are picked up.
+  """
+
+  def __init__(self, credentials, region: str, endpoint_url: Optional[str] = None):
+    self._credentials = credentials
+    self._region = region
+    self._endpoint_url = endpoint_url.rstrip("/") if endpoint_url else None
+    self._policy = get_policy("s3")
+    self._signer_lock = threading.Lock()
+    self._signer = None
+
+  def _url(self, bucket: str, key: str) -> str:
+    path = quote(key, safe="/~")
+    if self._endpoint_url:
+      return f"{self._endpoint_url}/{bucket}/{path}"
+    return f"https://{bucket}.s3.{self._region}.amazonaws.com/{path}"
+
+  def _auth(self):
+    creds = self._credentials()
+    signer_key = (creds["AccessKeyId"], creds["SessionToken"])
+    with self._signer_lock:
+      if self._signer is None or self._signer[0] != signer_key:
+        from requests_aws4auth import AWS4Auth
+        self._signer = (signer_key, AWS4Auth(
+          creds["AccessKeyId"], creds["SecretKey"], self._region, "s3",
+          session_token=creds["SessionToken"],
+        ))
+      return self._signer[1]
+
+  def _request(self, operation: str, method: str, bucket: str, key: str, params=None, data=None, headers=None, stream=False):
+    url = self._url(bucket, key)
+    if data is not None and not isinstance(data, (bytes, memoryview)):
+      data = memoryview(data)
+    if isinstance(data, memoryview):
+      # sent and hashed for the signature in place, multipart parts are never copied
+      data = data.cast('B')
+    # HEAD responses carry the object's Content-Length but no body, don't try reading it
+    stream = stream or method == "HEAD"
+    def send():
+      resp = get_session().request(
+        method, url, params=params, data=data, headers=headers, auth=self._auth(),
+        timeout=self._policy.timeout, stream=stream,
+      )
+      if resp.status_code >= 300:
+        code, message = str(resp.status_code), resp.reason
+        if method != "HEAD" and resp.content:
+          try:
+            error = ElementTree.fromstring(resp.content)
+            code = error.findtext("Code") or code
+            message = error.findtext("Message") or message
+          except ElementTree.ParseError:
+            pass
+        raise ClientError(resp.status_code, code, message, operation)
+      return resp
+    return self._policy.call(send)
+
+  def put_object(self, Bucket: str, Key: str, Body=b"", ContentEncoding: Optional[str] = None) -> dict:
+    headers = {"Content-Encoding": ContentEncoding} if ContentEncoding else None
+    resp = self._request("PutObject", "PUT", Bucket, Key, data=Body, headers=headers)
+    return _object_metadata(resp)
+
+  def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None, IfMatch: Optional[str] = None) -> dict:
+    headers = {}
+    if Range:
+      headers["Range"] = Range
+    if IfMatch:
+      headers["If-Match"] = IfMatch
+    resp = self._request("GetObject", "GET", Bucket, Key, headers=headers, stream=True)
+    meta = _object_metadata(resp)
+    meta["Body"] = StreamingBody(resp)
+    return meta
+
+  def head_object(self, Bucket: str, Key: str) -> dict:
+    resp = self._request("HeadObject", "HEAD", Bucket, Key)
+    resp.close()
+    return _object_metadata(resp)
+
+  def create_multipart_upload(self, Bucket: str, Key: str, ContentEncoding: Optional[str] = None) -> dict:
+    headers = {"Content-Encoding": ContentEncoding} if ContentEncoding else None
+    resp = self._request("CreateMultipartUpload", "POST", Bucket, Key, params={"uploads": ""}, headers=headers)
+    return {"UploadId": ElementTree.fromstring(resp.content).findtext("{*}UploadId")}
+
+  def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body) -> dict:
+    resp = self._request(
+      "UploadPart", "PUT", Bucket, Key,
+      params={"partNumber": str(PartNumber), "uploadId": UploadId}, data=Body,
+    )
+    return {"ETag": resp.headers["ETag"]}
+
+  def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict) -> dict:
+    parts = "".join(
+      f"<Part><PartNumber>{p['PartNumber']}</PartNumber><ETag>{p['ETag']}</ETag></Part>"
+      for p in MultipartUpload["Parts"]
+    )
+    resp = self._request(
+      "CompleteMultipartUpload", "POST", Bucket, Key, params={"uploadId": UploadId},
+      data=f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode(),
+    )
+    # errors can come back with a 200 once the upload started completing
+    root = ElementTree.fromstring(resp.content)
+    if root.tag.endswith("Error"):
+      raise ClientError(resp.status_code, root.findtext("Code"), root.findtext("Message"), "CompleteMultipartUpload")
+    return {"ETag": root.findtext("{*}ETag")}
+
+  def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str) -> dict:
+    self._request("AbortMultipartUpload", "DELETE", Bucket, Key, params={"uploadId": UploadId})
+    return {}
+
+  def upload_fileobj(self, Fileobj, Bucket: str, Key: str, ExtraArgs: Optional[dict] = None, Config: Optional[TransferConfig] = None) -> None:
+    """Single PUT below the multipart threshold, otherwise parts uploaded in parallel.
+
+    Parts are read one at a time and at most max_concurrency of them are in memory.
+    """
+    config = Config or TransferConfig()
+    extra_args = ExtraArgs or {}
+    first = Fileobj.read(config.multipart_chunksize)
+    if len(first) < config.multipart_threshold:
+      self.put_object(Bucket=Bucket, Key=Key, Body=first, **extra_args)
+      return
+    upload_id = self.create_multipart_upload(Bucket=Bucket, Key=Key, **extra_args)["UploadId"]
+    slots = threading.Semaphore(config.max_concurrency)
+    def upload(number, body):
+      try:
+        etag = self.upload_part(Bucket=Bucket, Key=Key, UploadId=upload_id, PartNumber=number, Body=body)["ETag"]
+        return {"PartNumber": number, "ETag": etag}
+      finally:
+        slots.release()
+    try:
+      with ThreadPoolExecutor(max_workers=config.max_concurrency) as pool:
+        futures = []
+        part, number = first, 1
+        while part:
+          slots.acquire()
+          futures.append(pool.submit(upload, number, part))
+          if any(f.done() and f.exception() for f in futures):
+            break
+          part, number = Fileobj.read(config.multipart_chunksize), number + 1
+        parts = [f.result() for f in futures]
+      self.complete_multipart_upload(Bucket=Bucket, Key=Key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+    except BaseException:
+      try:
+        self.abort_multipart_upload(Bucket=Bucket, Key=Key, UploadId=upload_id)
+      except Exception as err:
+        logger.debug(f"Aborting multipart upload {upload_id} failed: {err}")
+      raise
@@ -0,0 +1,22 @@
+import os
+from contextlib import contextmanager
+
+try:
+  import fcntl
+except ImportError:
+  # no advisory locks on Windows, refreshes may then run concurrently
+  fcntl = None
+
+@contextmanager
+def file_lock(fname):
+  """Exclusive lock on fname, held across processes (and threads) until exit"""
+  os.makedirs(os.path.dirname(fname), exist_ok=True)
+  fd = os.open(fname, os.O_CREAT | os.O_RDWR, 0o600)
+  try:
+    if fcntl:
+      fcntl.flock(fd, fcntl.LOCK_EX)
+    yield
+  finally:
+    if fcntl:
+      fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
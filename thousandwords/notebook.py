@@ -0,0 +1,107 @@
+""" Code cells of .ipynb files and cell selections, for publishing several cells at once.
+
+Notebooks are read as plain nbformat 4 JSON, and their saved outputs converted to
+what a local capture of the cell would have produced.
+"""
+import json
+import sys
+from typing import List, Optional, Set, Tuple
+
+# (stdout, stderr, [(data, metadata)]) of a cell run locally
+Outputs = Tuple[str, str, List[Tuple[dict, dict]]]
+
+def parse_cells(spec: Optional[str]) -> Optional[Set[int]]:
+  """Cell numbers selected by a spec like 1,3-5, None (all cells) for an empty spec"""
+  if not spec:
+    return None
+  selected = set()
+  for part in spec.split(','):
+    part = part.strip()
+    try:
+      if '-' in part:
+        first, last = part.split('-', 1)
+        selected.update(range(int(first), int(last) + 1))
+      elif part:
+        selected.add(int(part))
+    except ValueError:
+      raise Exception(f"Invalid cell selection {spec!r}, expected e.g. 1,3-5") from None
+  return selected
+
+def _text(value) -> str:
+  return ''.join(value) if isinstance(value, list) else value
+
+def saved_outputs(outputs: List[dict]) -> Outputs:
+  """A code cell's nbformat outputs as stdout, stderr and rich outputs"""
+  stdout, stderr, rich = [], [], []
+  for output in outputs:
+    kind = output.get('output_type')
+    if kind == 'stream':
+      (stderr if output.get('name') == 'stderr' else stdout).append(_text(output.get('text', '')))
+    elif kind in ('display_data', 'execute_result'):
+      data = {
+        # text mimes are stored as lists of lines, application/json as an object
+        mime: _text(value) if isinstance(value, list) else value
+        for mime, value in output.get('data', {}).items()
+      }
+      rich.append((data, output.get('metadata', {})))
+    elif kind == 'error':
+      stderr.append('\n'.join(output.get('traceback', [])) + '\n')
+  return ''.join(stdout), ''.join(stderr), rich
+
+def read_notebook(fname: str) -> List[Tuple[str, Outputs]]:
+  """(source, saved outputs) of each code cell of a notebook, in order"""
+  with open(fname) as f:
+    nb = json.load(f)
+  if nb.get('nbformat', 4) < 4:
+    raise Exception(
+      f"{fname}: nbformat {nb['nbformat']} is not supported, "
+      "convert it with `jupyter nbconvert --to notebook`"
+    )
+  return [
+    (_text(cell.get('source', '')), saved_outputs(cell.get('outputs', [])))
+    for cell in nb.get('cells', [])
+    if cell.get('cell_type') == 'code'
+  ]
+
+def publish_notebook(
+  fname: str,
+  cells: Optional[str] = None,
+  public: bool = False,
+  not_runnable: bool = False,
+  no_variables: bool = False,
+  with_variables: bool = False,
+) -> None:
+  """Publish the (selected) code cells of a notebook at once.
+
+  The whole notebook is first run in a fresh IPython shell, then the cells are
+  published runnable, with the variables they depend on, as %publish_all would. Cells
+  using IPython syntax (magics, shell escapes) only get their outputs published.
+  With not_runnable, the outputs saved in the notebook are published and nothing runs.
+  """
+  from IPython.core.interactiveshell import InteractiveShell
+  from IPython.utils.capture import capture_output
+  shell = InteractiveShell.instance()
+  # the magics module registers itself with the running shell when imported
+  from .publish import PublishMagic
+  magic = PublishMagic(shell)
+
+  selected = parse_cells(cells)
+  chosen, outputs = [], []
+  for n, (source, saved) in enumerate(read_notebook(fname), 1):
+    if not not_runnable:
+      with capture_output() as io:
+        result = shell.run_cell(source, store_history=True)
+      if not result.success:
+        print(f"Cell {n} failed:\n{io.stderr or io.stdout}", file=sys.stderr)
+      saved = (io.stdout, io.stderr, [(o.data, o.metadata) for o in io.outputs])
+    if not source.strip() or (selected is not None and n not in selected):
+      continue
+    chosen.append((f"cell {n}", source))
+    outputs.append(saved)
+  if not chosen:
+    print(f"No code cell to publish in {fname}", file=sys.stderr)
+    return
+  magic.publish_all(
+    chosen, public=public, no_variables=no_variables, with_variables=with_variables,
+    not_runnable=not_runnable, outputs=outputs,
+  )
@@ -0,0 +1,136 @@
+""" Rich outputs of local runs as createCell representations.
+
+Images are decoded and measured on a worker pool and referenced by key once stored
+in the bucket, like large HTML, JSON and SVG outputs, so createCell payloads stay small.
+Representations keep the order of the outputs they come from.
+"""
+import re
+import json
+import struct
+from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import Callable, List, Optional, Tuple
+from .config import CONFIG
+
+logger = getLogger("thousandwords.outputs")
+
+EXTENSIONS = {
+  'image/png': '.png',
+  'image/jpeg': '.jpg',
+  'image/gif': '.gif',
+  'image/svg+xml': '.svg',
+  'text/html': '.html',
+  'application/json': '.json',
+}
+# base64 encoded in outputs, always stored by key
+BINARY_IMAGES = ('image/png', 'image/jpeg', 'image/gif')
+# text stored by key above the inline_output_size setting
+OFFLOADED_TEXT = ('image/svg+xml', 'text/html', 'application/json')
+
+# start of frame markers, the ones holding the image size
+_JPEG_SOF = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+
+def size_for_png(data):
+  check = struct.unpack('>i', data[4:8])[0]
+  if check != 0x0d0a1a0a:
+    return
+  return struct.unpack('>ii', data[16:24])
+
+def size_for_jpeg(data):
+  if data[:2] != b'\xff\xd8':
+    return
+  i = 2
+  while i + 9 <= len(data):
+    if data[i] != 0xff:
+      return
+    marker = data[i + 1]
+    if marker == 0xff:
+      # fill byte
+      i += 1
+      continue
+    if marker in _JPEG_SOF:
+      h, w = struct.unpack('>HH', data[i + 5:i + 9])
+      return w, h
+    i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+
+def size_for_gif(data):
+  if data[:6] not in (b'GIF87a', b'GIF89a'):
+    return
+  return struct.unpack('<HH', data[6:10])
+
+def _svg_length(value: Optional[str]) -> Optional[int]:
+  match = re.fullmatch(r'\s*([0-9.]+)\s*(px)?\s*', value or '')
+  return round(float(match.group(1))) if match else None
+
+def size_for_svg(text: str):
+  match = re.search(r'<svg\b[^>]*>', text)
+  if match is None:
+    return
+  attrs = dict(re.findall(r'([\w:-]+)\s*=\s*["\']([^"\']*)["\']', match.group(0)))
+  w, h = _svg_length(attrs.get('width')), _svg_length(attrs.get('height'))
+  if (w is None or h is None) and 'viewBox' in attrs:
+    box = re.split(r'[\s,]+', attrs['viewBox'].strip())
+    if len(box) == 4:
+      w, h = round(float(box[2])), round(float(box[3]))
+  if w is not None and h is not None:
+    return w, h
+
+_SIZES = {
+  'image/png': size_for_png,
+  'image/jpeg': size_for_jpeg,
+  'image/gif': size_for_gif,
+  'image/svg+xml': size_for_svg,
+}
+
+def image_size(mime: str, data) -> Tuple[Optional[int], Optional[int]]:
+  """Width and height from an image's header, Nones when it can't be read"""
+  try:
+    return _SIZES[mime](data) or (None, None)
+  except (struct.error, ValueError, IndexError) as err:
+    logger.debug(f"Could not read the size of a {mime} output: {err}")
+    return None, None
+
+def _representation(mime: str, data, make_key: Callable[[str], str]):
+  """(representation, upload or None) of one mime bundle entry"""
+  if mime in BINARY_IMAGES:
+    payload = b64decode(data)
+    w, h = image_size(mime, payload)
+    key = make_key(EXTENSIONS[mime])
+    return {"mime": mime, "key": key, "width": w, "height": h}, (mime, key, payload)
+  if mime in OFFLOADED_TEXT:
+    if mime == 'application/json' and not isinstance(data, str):
+      data = json.dumps(data)
+    payload = data.encode()
+    if len(payload) > CONFIG.inline_output_size:
+      key = make_key(EXTENSIONS[mime])
+      rep = {"mime": mime, "key": key}
+      if mime == 'image/svg+xml':
+        rep["width"], rep["height"] = image_size(mime, data)
+      return rep, (mime, key, payload)
+  if mime == 'image/svg+xml':
+    w, h = image_size(mime, data)
+    return {"mime": mime, "data": data, "width": w, "height": h}, None
+  return {"mime": mime, "data": data}, None
+
+def prepare_outputs(outputs, make_key: Callable[[str], str], max_workers: Optional[int] = None) -> Tuple[List[dict], List[tuple]]:
+  """createCell outputs for (data, metadata) pairs, and the (mime, key, bytes) to upload.
+
+  make_key(extension) names a stored representation.
+  """
+  outputs = list(outputs)
+  entries = [(i, mime, data) for i, (bundle, _) in enumerate(outputs) for mime, data in bundle.items()]
+  convert = lambda entry: _representation(entry[1], entry[2], make_key)
+  if any(mime in BINARY_IMAGES or mime in OFFLOADED_TEXT for _, mime, _ in entries):
+    workers = min(max_workers or CONFIG.upload_concurrency, len(entries))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thousandwords-outputs") as pool:
+      results = list(pool.map(convert, entries))
+  else:
+    results = [convert(entry) for entry in entries]
+  rich = [{"metadata": json.dumps(metadata), "representations": []} for _, metadata in outputs]
+  uploads = []
+  for (i, _, _), (rep, upload) in zip(entries, results):
+    rich[i]["representations"].append(rep)
+    if upload is not None:
+      uploads.append(upload)
+  return rich, uploads
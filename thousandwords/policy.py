@@ -0,0 +1,111 @@
+import sys
+import time
+from logging import getLogger
+from typing import Optional, Tuple
+from .polling import backoff
+
+logger = getLogger("thousandwords.policy")
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+THROTTLING_CODES = (
+  "Throttling", "ThrottlingException", "ThrottledException", "TooManyRequestsException",
+  "RequestLimitExceeded", "SlowDown", "RequestThrottled",
+)
+
+def _status_and_code(err) -> Tuple[Optional[int], Optional[str]]:
+  response = getattr(err, "response", None)
+  if response is None:
+    return None, None
+  if isinstance(response, dict):
+    # botocore ClientError
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return status, response.get("Error", {}).get("Code")
+  return getattr(response, "status_code", None), None
+
+def _is_transient(err) -> bool:
+  """Throttling, server errors, timeouts and dropped connections"""
+  status, code = _status_and_code(err)
+  if code in THROTTLING_CODES or status in RETRYABLE_STATUSES:
+    return True
+  requests = sys.modules.get("requests")
+  if requests is not None and isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+    return True
+  botocore = sys.modules.get("botocore.exceptions")
+  return botocore is not None and isinstance(
+    err, (botocore.ConnectionError, botocore.ReadTimeoutError)
+  )
+
+class Policy:
+  """Timeouts and retries for one kind of network operation.
+
+  timeout is a (connect, read) pair of seconds for each attempt, deadline bounds all
+  attempts together. Operations that aren't idempotent are only retried when they were
+  throttled; connection failures are retried below, by the shared session's adapter.
+  """
+
+  def __init__(
+    self,
+    timeout: Tuple[float, float] = (5, 30),
+    retries: int = 3,
+    backoff: float = 0.5,
+    max_backoff: float = 8,
+    deadline: Optional[float] = None,
+    idempotent: bool = True,
+  ):
+    self.timeout = timeout
+    self.retries = retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.deadline = deadline
+    self.idempotent = idempotent
+
+  def is_retryable(self, err) -> bool:
+    if self.idempotent:
+      return _is_transient(err)
+    status, code = _status_and_code(err)
+    return status == 429 or code in THROTTLING_CODES
+
+  def call(self, fn, *args, **kwargs):
+    """fn(*args, **kwargs), retried with exponential backoff and jitter"""
+    deadline = time.monotonic() + self.deadline if self.deadline else None
+    delays = backoff(initial=self.backoff, maximum=self.max_backoff, factor=2)
+    attempt = 0
+    while True:
+      try:
+        return fn(*args, **kwargs)
+      except Exception as err:
+        if attempt >= self.retries or not self.is_retryable(err):
+          raise
+        delay = next(delays)
+        if deadline is not None and time.monotonic() + delay > deadline:
+          raise
+        attempt += 1
+        logger.info(f"Retrying in {delay:.1f}s ({attempt}/{self.retries}) after: {err}")
+        time.sleep(delay)
+
+  def botocore_config(self):
+    """Equivalent settings for boto3 clients, which retry on their own"""
+    from botocore.config import Config
+    return Config(
+      connect_timeout=self.timeout[0],
+      read_timeout=self.timeout[1],
+      retries={"max_attempts": self.retries + 1, "mode": "standard"},
+    )
+
+POLICIES = {
+  # getCallback and other reads
+  "graphql.query": Policy(timeout=(5, 30), retries=3, deadline=60),
+  # createCell, createInvite
+  "graphql.mutation": Policy(timeout=(5, 60), retries=3, deadline=120, idempotent=False),
+  # remote execution can legitimately take minutes
+  "run_cell": Policy(timeout=(5, 900), retries=2, idempotent=False),
+  # refresh grants can be repeated, authorization codes can't
+  "auth.refresh": Policy(timeout=(5, 30), retries=3, deadline=60),
+  "auth.code": Policy(timeout=(5, 30), retries=2, idempotent=False),
+  "config.stack": Policy(timeout=(5, 15), retries=3, deadline=45),
+  "cognito": Policy(timeout=(5, 30), retries=4),
+  "s3": Policy(timeout=(10, 120), retries=4),
+}
+
+def get_policy(operation: str) -> Policy:
+  return POLICIES[operation]
@@ -1,8 +1,47 @@
+import time
+import random
 from time import sleep
 
+class PollTimeout(Exception):
+  def __str__(self) -> str:
+    return "Timed out while waiting"
+
+class PollCancelled(Exception):
+  def __str__(self) -> str:
+    return "Cancelled while waiting"
+
 def poll(step, target):
   while True:
     val = target()
     if bool(val):
       return val
     sleep(step)
+
+def backoff(initial=1.0, maximum=15.0, factor=1.5, jitter=0.25):
+  """Exponentially growing delays, capped at maximum, each randomized by +/- jitter"""
+  delay = initial
+  while True:
+    yield delay * random.uniform(1 - jitter, 1 + jitter)
+    delay = min(delay * factor, maximum)
+
+def poll_until(target, deadline=None, cancel=None, delays=None):
+  """Call target until it returns a truthy value, waiting delays in between.
+
+  deadline is a time.monotonic() value, cancel a threading.Event.
+  """
+  delays = delays or backoff()
+  while True:
+    val = target()
+    if bool(val):
+      return val
+    delay = next(delays)
+    if deadline is not None:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        raise PollTimeout
+      delay = min(delay, remaining)
+    if cancel is not None:
+      if cancel.wait(delay):
+        raise PollCancelled
+    else:
+      sleep(delay)
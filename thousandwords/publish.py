@@ -1,38 +1,41 @@
-from cProfile import run
-import json
-import uuid
 import sys
+import asyncio
+import itertools
+import threading
 from posixpath import join as urljoin
 from urllib.parse import quote
-import webbrowser
-from time import time
-from base64 import b64decode
-import struct
+from time import time, monotonic
 from types import ModuleType
 import secrets
-import click
+from logging import getLogger
 from IPython import get_ipython
 from IPython.display import display
 from IPython.core.magic import (
   Magics,
   cell_magic,
+  line_magic,
   magics_class,
 )
 from IPython.core import magic_arguments
 from IPython.core.error import StdinNotImplementedError
 from IPython.utils.capture import capture_output
-from nanoid import generate
 from thousandwords.auth import CognitoAuth
 from thousandwords.cli import login
-from thousandwords_core.serializer import Serializer
-from .status import Status
+from .status import Status, Progress
 from .lint import resolveUndefined
-from .client import Client
-from .capture import CapturedIO
+from .aio import AsyncClient, run_sync, to_own_thread
+from .transfer import Uploader, UploadError
+from .dedup import UploadIndex
+from .cache import SERIALIZATION_CACHE
+from .capture import StreamingCapturedIO
+from .outputs import prepare_outputs
 from .config import CONFIG
-from .polling import poll
+from .notebook import parse_cells
+from .polling import PollTimeout
 from . import __version__
 
+logger = getLogger("thousandwords.publish")
+
 def add_dependency_injection_comment(vnames, lines):
   if len(vnames) > 0:
     lines = [
@@ -46,12 +49,6 @@ def get_version():
   major, minor, *_ = sys.version_info
   return f"{major}.{minor}"
 
-def size_for_png(data):
-  check = struct.unpack('>i', data[4:8])[0]
-  if check != 0x0d0a1a0a:
-    return
-  return struct.unpack('>ii', data[16:24])
-
 def get_title(lines):
   for l in lines:
     if len(l) > 0:
@@ -60,6 +57,128 @@ def get_title(lines):
       return l.strip()
   return 'New snippet'
 
+def has_browser():
+  import webbrowser
+  try:
+    webbrowser.get()
+    return True
+  except Exception:
+    return False
+
+def join_url(invite_id, callback=None):
+  url = urljoin(CONFIG.instance_url, f'join/{invite_id}')
+  if callback is not None:
+    url = f'{url}?callback={quote(callback)}&share=1'
+  return url
+
+def set_local_reply(pub, stdout, stderr, outputs):
+  """Outputs of a local run, (data, metadata) pairs, as the publication's reply.
+
+  Images and large text outputs are set aside to be uploaded, and referenced by key.
+  """
+  from nanoid import generate
+  rich, uploads = prepare_outputs(outputs, lambda ext: f'public/{generate(size=11)}{ext}')
+  pub.output_uploads.extend(uploads)
+  pub.run_reply = {"stdout": stdout, "stderr": stderr, "outputs": rich}
+
+class Publication:
+  """A cell ready to be sent: what _prepare gathered for _run.
+
+  Returned by `%%publish --background` as a handle on the job in flight.
+  """
+  _ids = itertools.count(1)
+
+  def __init__(self, client, lines, public, background=False):
+    self.id = next(self._ids)
+    self.client = client
+    self.lines = lines
+    self.title = get_title(lines)
+    self.public = public
+    self.background = background
+    # render the remote run's output as it is produced
+    self.stream = False
+    self.uploader = None
+    self.run_request = None
+    # set upfront when the cell was run locally
+    self.run_reply = None
+    self.output_uploads = []
+    self.cell_id = None
+    self.invite_id = None
+    self.state = 'pending'
+    self.url = None
+    self.join_url = None
+    self.error = None
+    self.cancelled = threading.Event()
+    self._thread = None
+
+  @property
+  def done(self) -> bool:
+    return self.state in ('done', 'failed')
+
+  @property
+  def progress(self) -> str:
+    if self.state == 'uploading' and self.uploader is not None and self.uploader.total:
+      return f"uploading {self.uploader.done}/{self.uploader.total}"
+    return self.state
+
+  def step(self, state, text):
+    self.state = state
+    return Status(text, quiet=self.background)
+
+  def info(self, msg):
+    if not self.background:
+      print(msg)
+
+  def fail(self, msg):
+    self.state = 'failed'
+    self.error = str(msg)
+    if not self.background:
+      print(msg, file=sys.stderr)
+
+  def start(self, coro):
+    """Run coro, the publication pipeline, on a worker thread"""
+    if self.uploader is not None:
+      self.uploader.snapshot()
+    self._thread = threading.Thread(
+      target=self._main, args=(coro,), name=f"thousandwords-publish-{self.id}", daemon=True,
+    )
+    self._thread.start()
+
+  def _main(self, coro):
+    try:
+      asyncio.run(coro)
+    except BaseException as err:
+      # nobody is there to see the traceback, keep it on the publication
+      logger.debug(f"Background publication {self.id} failed", exc_info=True)
+      self.fail(f"{type(err).__name__}: {err}")
+
+  def cancel(self):
+    """Stop waiting for the confirmation"""
+    self.cancelled.set()
+
+  def wait(self, timeout=None):
+    """Block until the publication is done, returns the share URL.
+
+    Raises TimeoutError when it is still in progress after timeout seconds.
+    """
+    if self._thread is not None:
+      self._thread.join(timeout)
+      if self._thread.is_alive():
+        raise TimeoutError(f"Publication {self.id} is still {self.progress}")
+    if self.error is not None:
+      raise Exception(self.error)
+    return self.url
+
+  def __str__(self):
+    status = self.error if self.state == 'failed' else (self.url or self.join_url or '')
+    return f"[{self.id}] {self.title!r} {self.progress} {status}".strip()
+
+  def _repr_pretty_(self, p, cycle):
+    p.text(f"Publishing in the background, run %publish_status to follow up\n{self}")
+
+# publications started with --background, in this kernel
+JOBS = []
+
 class CellLink:
   def __init__(self, id):
     self.url = urljoin(CONFIG.instance_url, f'c/{id}')
@@ -86,12 +205,121 @@ class PublishMagic(Magics):
     
     If set, the cell is run locally and only the code and outputs are captured"""
   )
+  @magic_arguments.argument("--background", action="store_true", 
+    help="""Return right away with a handle on the publication and send it in the background.
+
+    Use %%publish_status to list publications in flight"""
+  )
+  @magic_arguments.argument("--stream", action="store_true",
+    help="""Show the output of the remote run as it is produced.
+
+    Ignored with --background"""
+  )
   @cell_magic("publish")
   def cmagic(self, line="", cell=""):
     args = magic_arguments.parse_argstring(self.cmagic, line)
-    self.publish(cell, **vars(args))
+    return self.publish(cell, **vars(args))
   
-  def publish(self, cell, public=False, no_variables=False, with_variables=False, not_runnable=False):
+  @line_magic("publish_status")
+  def publish_status(self, line=""):
+    """List publications started with %%publish --background"""
+    if not JOBS:
+      print("No background publication.")
+    for pub in JOBS:
+      print(pub)
+
+  @magic_arguments.magic_arguments()
+  @magic_arguments.argument('cells', nargs='?',
+    help="Execution counts of the cells to publish, e.g. 1,3-5. Defaults to every cell run so far."
+  )
+  @magic_arguments.argument('--public', action='store_true',
+    help="Publish publicly to unlisted URLs. Anyone with the links can view."
+  )
+  @magic_arguments.argument("--no-variables", action="store_true",
+    help="""Don't include the variables required for execution in the publications"""
+  )
+  @magic_arguments.argument("--with-variables", action="store_true",
+    help="""Include the variables required for execution in the publications"""
+  )
+  @magic_arguments.argument("--not-runnable", action="store_true",
+    help="""Don't make the publications runnable.
+
+    If set, the cells are run again locally and only the code and outputs are captured"""
+  )
+  @line_magic("publish_all")
+  def publish_all_magic(self, line=""):
+    """Publish cells of this session at once.
+
+    Variables several cells depend on are uploaded once, and a single prompt asks
+    whether to include them. Cells using IPython syntax (magics, shell escapes) are
+    skipped, like cells left without their variables unless --not-runnable is set.
+    """
+    args = magic_arguments.parse_argstring(self.publish_all_magic, line)
+    try:
+      selected = parse_cells(args.cells)
+    except Exception as e:
+      print(e, file=sys.stderr)
+      return
+    history = self.shell.history_manager.input_hist_raw
+    cells = []
+    # the cell running this magic is the last one of the history
+    for n in range(1, min(len(history), self.shell.execution_count)):
+      source = history[n]
+      if selected is not None and n not in selected:
+        continue
+      if source.strip() and self.is_plain_python(source):
+        cells.append((f"In [{n}]", source))
+    if not cells:
+      print("No cell to publish.", file=sys.stderr)
+      return
+    self.publish_all(
+      cells, public=args.public, no_variables=args.no_variables,
+      with_variables=args.with_variables, not_runnable=args.not_runnable,
+    )
+
+  def publish(self, cell, public=False, no_variables=False, with_variables=False, not_runnable=False, background=False, stream=False):
+    pub = self._prepare(cell, public, no_variables, with_variables, not_runnable, background, stream)
+    if pub is None:
+      return
+    if background:
+      JOBS.append(pub)
+      pub.start(self._run(pub))
+      return pub
+    try:
+      run_sync(self._run(pub))
+    except KeyboardInterrupt:
+      pub.cancel()
+      raise
+
+  async def publish_async(self, cell, public=False, no_variables=False, with_variables=False, not_runnable=False, stream=False):
+    """Same as publish, awaitable from a running event loop.
+
+    Linting, serialization and local runs still happen synchronously, before the first await.
+    """
+    pub = self._prepare(cell, public, no_variables, with_variables, not_runnable, stream=stream)
+    if pub is not None:
+      await self._run(pub)
+
+  def publish_all(self, cells, public=False, no_variables=False, with_variables=False, not_runnable=False, outputs=None):
+    """Publish (label, source) cells at once.
+
+    outputs, (stdout, stderr, [(data, metadata)]) for each cell, are published for
+    cells that aren't run remotely. Without them, those cells are run again locally
+    with not_runnable, and skipped otherwise.
+    """
+    prepared = self._prepare_many(cells, public, no_variables, with_variables, not_runnable, outputs)
+    if prepared is None:
+      return
+    pubs, uploader = prepared
+    try:
+      run_sync(self._run_many(pubs, uploader))
+    except KeyboardInterrupt:
+      for pub in pubs:
+        pub.cancel()
+      raise
+
+  def _prepare(self, cell, public, no_variables, with_variables, not_runnable, background=False, stream=False):
+    """Everything that needs the user namespace or the user: lint, serialize, prompt, local run"""
     lines = cell.split('\n')
     try:
       undefs = resolveUndefined(cell)
@@ -104,16 +332,11 @@ class PublishMagic(Magics):
       print("--not-runnable and --with-variables are mutually exclusive. Pick at most one.")
       return
 
-    client = Client()
-    puts3_tasks = []
-    def puts3(key, name, data):
-      with Status(f"Uploading dependency '{name}'"):
-        client.upload(key, data)
-    def schedule_puts3(name, data):
-      key = f'uploads/{str(uuid.uuid4())}'
-      puts3_tasks.append(lambda: puts3(key, name, data))
-      return key
-    srz = Serializer(schedule_puts3)
+    # the serializer pulls in cloudpickle, only load it once something gets published
+    from .serializer import Serializer
+    client = AsyncClient()
+    uploader = Uploader(client.client, index=UploadIndex())
+    srz = Serializer(uploader.schedule)
     prompt_variables = []
     should_run_remote = True
     if not_runnable:
@@ -132,7 +355,7 @@ class PublishMagic(Magics):
           elif not with_variables:
             prompt_variables.append(vname)
         try:
-          srz.add(vname, obj)
+          SERIALIZATION_CACHE.add(srz, vname, obj)
         except Exception as err:
           print(f"Could not serialize {vname}: {err}", file=sys.stderr)
           return
@@ -145,91 +368,284 @@ class PublishMagic(Magics):
         should_run_remote = self.shell.ask_yes_no(question, default='n')
       except StdinNotImplementedError:
         should_run_remote = False
-      
+
+    pub = Publication(client, lines, public, background)
+    pub.stream = stream and not background
     if should_run_remote:
-      for task in puts3_tasks:
-        task()
-      run_request = {
+      pub.uploader = uploader
+      pub.run_request = {
         "lines": add_dependency_injection_comment(vnames, lines), 
         "userNS": srz.ns, 
         "version": get_version(),
         "clientVersion": f'py-{__version__}'
       }
+    else:
+      pub.run_request = {"lines": lines, "version": 'local'}
+      set_local_reply(pub, *self._run_locally(cell))
+    return pub
+
+  def _run_locally(self, cell):
+    with capture_output() as io:
+      self.shell.run_cell(cell)
+    return io.stdout, io.stderr, [(o.data, o.metadata) for o in io.outputs]
+
+  def _prepare_many(self, cells, public, no_variables, with_variables, not_runnable, outputs=None):
+    """_prepare for several cells, serializing each variable they depend on once"""
+    if not_runnable and with_variables:
+      print("--not-runnable and --with-variables are mutually exclusive. Pick at most one.")
+      return
+    # None for cells that can only be published with their outputs
+    deps = []
+    for label, cell in cells:
+      if not self.is_plain_python(cell):
+        deps.append(None)
+        continue
+      try:
+        undefs = resolveUndefined(cell)
+      except Exception as e:
+        print(f"{label}: {e}", file=sys.stderr)
+        return
+      deps.append(sorted(set([u.message_args[0] for u in undefs])))
+
+    remote = [vnames is not None and not not_runnable for vnames in deps]
+    objs = {}
+    for i, vnames in enumerate(deps):
+      if not remote[i]:
+        continue
+      for vname in vnames:
+        if vname not in objs:
+          try:
+            objs[vname] = self.shell.user_ns[vname]
+          except KeyError:
+            print(f"{cells[i][0]}: Dependency '{vname}' is not defined", file=sys.stderr)
+            return
+      if no_variables and any(not isinstance(objs[v], ModuleType) for v in vnames):
+        remote[i] = False
+
+    prompt_variables = sorted(set([
+      v for i, vnames in enumerate(deps) if remote[i]
+      for v in vnames if not isinstance(objs[v], ModuleType)
+    ]))
+    if prompt_variables and not with_variables:
+      varstr = ', '.join([f"'{v}'" for v in prompt_variables])
+      plur = 's' if len(prompt_variables) > 1 else ''
+      question = f"Do you want to include variable{plur} {varstr} in your publications and make them runnable ? (y/[N])"
+      try:
+        include = self.shell.ask_yes_no(question, default='n')
+      except StdinNotImplementedError:
+        include = False
+      if not include:
+        remote = [r and not set(deps[i]) & set(prompt_variables) for i, r in enumerate(remote)]
+
+    if outputs is None and not not_runnable:
+      # running cells again could repeat their side effects, only --not-runnable asks for it
+      skipped = [label for (label, _), r in zip(cells, remote) if not r]
+      if skipped:
+        print(
+          f"Skipping {', '.join(skipped)}: not runnable without {'their' if len(skipped) > 1 else 'its'} variables. "
+          "Use --not-runnable to run the cells again locally and publish their outputs.",
+          file=sys.stderr,
+        )
+      keep = [i for i, r in enumerate(remote) if r]
+      cells, deps, remote = [cells[i] for i in keep], [deps[i] for i in keep], [True] * len(keep)
+      if not cells:
+        return
+
+    from .serializer import Serializer
+    client = AsyncClient()
+    uploader = Uploader(client.client, index=UploadIndex())
+    srz = Serializer(uploader.schedule)
+    # each variable once, whatever the number of cells depending on it
+    for vname in sorted(set([v for i, vnames in enumerate(deps) if remote[i] for v in vnames])):
       try:
-        with Status("Executing cell remotely"):
-          run_reply = client.run_cell(run_request)
+        SERIALIZATION_CACHE.add(srz, vname, objs[vname])
       except Exception as err:
-        print(err, file=sys.stderr)
+        print(f"Could not serialize {vname}: {err}", file=sys.stderr)
+        return
+
+    pubs = []
+    for i, (label, cell) in enumerate(cells):
+      lines = cell.split('\n')
+      # quiet: the cells go through the pipeline together, _run_many reports on them
+      pub = Publication(client, lines, public, background=True)
+      if remote[i]:
+        pub.uploader = uploader
+        pub.run_request = {
+          "lines": add_dependency_injection_comment(deps[i], lines),
+          "userNS": [v for v in srz.ns if v['name'] in deps[i]],
+          "version": get_version(),
+          "clientVersion": f'py-{__version__}'
+        }
+      else:
+        pub.run_request = {"lines": lines, "version": 'local'}
+        set_local_reply(pub, *(outputs[i] if outputs is not None else self._run_locally(cell)))
+      pubs.append(pub)
+    return pubs, uploader
+
+  def is_plain_python(self, cell) -> bool:
+    """Whether cell runs outside of IPython: no magics, shell escapes or help syntax"""
+    return self.shell.transform_cell(cell).strip() == cell.strip()
+
+  async def _run(self, pub):
+    """upload -> runCell -> createCell -> createInvite -> callback"""
+    if pub.run_reply is None:
+      pub.state = 'uploading'
+      try:
+        await to_own_thread(pub.uploader.run, quiet=pub.background)
+      except UploadError as err:
+        pub.fail(err)
         return
-      if len(run_reply['userNS']) > 0:
-        vnames = [v['name'] for v in run_reply['userNS']]
-        print(f"Variable{'s' if len(vnames) > 1 else ''} captured: {', '.join(vnames)}")
+    if not await self._create(pub):
+      return
+
+    cell_url = urljoin(CONFIG.instance_url, f'c/{pub.cell_id}')
+    if pub.public:
+      pub.join_url = join_url(pub.invite_id)
+      pub.info('\nPrivate — do not share — Use this URL to update or delete your publication:\n'
+        + pub.join_url)
     else:
-      with capture_output() as io:
-        self.shell.run_cell(cell)
-      run_request = {"lines": lines, "version": 'local'}
-      outputs = []
-      for o in io.outputs:
-        reprs = []
-        for mime, data in o.data.items():
-          if mime == 'image/png':
-            data = b64decode(data)
-            w, h = size_for_png(data)
-            with Status(f"Uploading {mime} output"):
-              key = f'public/{generate(size=11)}.png'
-              client.upload(key, data)
-            reprs.append({"mime": mime, "key": key, "width": w, "height": h})
-          else:
-            reprs.append({"mime": mime, "data": data})
-        outputs.append({"metadata": json.dumps(o.metadata), "representations": reprs})
-      run_reply = {"stdout": io.stdout, "stderr": io.stderr, "outputs": outputs}
+      from nanoid import generate
+      callback = generate()
+      pub.join_url = join_url(pub.invite_id, callback)
+      if has_browser():
+        import click
+        click.launch(pub.join_url)
+      else:
+        pub.info('\nGo to this URL to finalize your publication:\n' + pub.join_url)
+      
+      pub.state = 'waiting for confirmation'
+      try:
+        await pub.client.wait_for_callback(callback, cancel=pub.cancelled)
+      except PollTimeout:
+        pub.fail(f'Publication was not confirmed in time, go to {pub.join_url} to finalize it')
+        return
+      except Exception as err:
+        pub.fail(err)
+        return
+    pub.url = cell_url
+    pub.state = 'done'
+    pub.info('\nUse this URL to share:\n' + cell_url)
 
+  async def _create(self, pub) -> bool:
+    """runCell, or the uploads of a local run's outputs, then createCell and createInvite"""
+    client = pub.client
+    if pub.run_reply is None:
+      try:
+        if pub.stream:
+          pub.state = 'executing'
+          pub.info("Executing cell remotely:")
+          io = StreamingCapturedIO()
+          pub.run_reply = await client.run_cell_streaming(
+            pub.run_request, lambda chunk: io.feed_reply(chunk, client.client.get), cancel=pub.cancelled,
+          )
+        else:
+          with pub.step('executing', "Executing cell remotely"):
+            pub.run_reply = await client.run_cell(pub.run_request)
+      except Exception as err:
+        pub.fail(err)
+        return False
+      if len(pub.run_reply['userNS']) > 0:
+        vnames = [v['name'] for v in pub.run_reply['userNS']]
+        pub.info(f"Variable{'s' if len(vnames) > 1 else ''} captured: {', '.join(vnames)}")
+    elif pub.output_uploads:
+      n = len(pub.output_uploads)
+      try:
+        with pub.step('uploading', f"Uploading {n} output{'s' if n > 1 else ''}"):
+          await asyncio.gather(*[client.upload(key, data) for _, key, data in pub.output_uploads])
+      except Exception as err:
+        pub.fail(err)
+        return False
+
+    from nanoid import generate
+    pub.state = 'creating'
     token = str(secrets.randbits(64))
     try:
-      idc = client.create_cell({
+      pub.cell_id = await client.create_cell({
         "id": generate(size=11),
-        "isPublic": public,
-        "title": get_title(lines),
-        "executeRequest": run_request,
-        "executeReply": run_reply,
+        "isPublic": pub.public,
+        "title": pub.title,
+        "executeRequest": pub.run_request,
+        "executeReply": pub.run_reply,
         "token": token,
-        "ttl": None if public else int(time()) + 10 * 60
+        "ttl": None if pub.public else int(time()) + 10 * 60
       })
     except Exception as err:
-      print(f'Create cell failed: {err}', file=sys.stderr)
-      return
+      pub.fail(f'Create cell failed: {err}')
+      return False
     try:
-      idi = client.create_invite({
+      pub.invite_id = await client.create_invite({
         "token": token,
-        "cellId": idc,
+        "cellId": pub.cell_id,
         "mode": "owner",
         "counter": 1,
       })
     except Exception as err:
-      print(f'Create invite failed: {err}', file=sys.stderr)
-      return
-    
-    cell_url = urljoin(CONFIG.instance_url, f'c/{idc}')
-    if public:
-      join_url = urljoin(CONFIG.instance_url, f'join/{idi}')
-      print('\nPrivate — do not share — Use this URL to update or delete your publication:\n'
-        + join_url)
-      print('\nUse this URL to share:\n' + cell_url)
-    else:
+      pub.fail(f'Create invite failed: {err}')
+      return False
+    return True
+
+  async def _run_many(self, pubs, uploader):
+    """_run for several cells: one upload of their dependencies, their runCell and
+    createCell calls in flight together, then one wait for all the confirmations"""
+    if any(pub.run_reply is None for pub in pubs):
       try:
-        webbrowser.get()
-        has_browser = True
-      except:
-        has_browser = False
-      callback = generate()
-      join_url = urljoin(CONFIG.instance_url, f'join/{idi}?callback={quote(callback)}&share=1')
-      if has_browser:
-        click.launch(join_url)
+        await to_own_thread(uploader.run)
+      except UploadError as err:
+        for pub in pubs:
+          if pub.run_reply is None:
+            pub.fail(err)
+    pending = [pub for pub in pubs if not pub.done]
+    created = []
+    if pending:
+      with Progress(f"Publishing {len(pending)} cell{'s' if len(pending) > 1 else ''}", len(pending)) as progress:
+        async def create(pub):
+          ok = await self._create(pub)
+          progress.advance()
+          return ok
+        results = await asyncio.gather(*[create(pub) for pub in pending])
+      created = [pub for pub, ok in zip(pending, results) if ok]
+
+    if created and created[0].public:
+      print('\nPrivate — do not share — Use these URLs to update or delete your publications:')
+      for pub in created:
+        pub.join_url = join_url(pub.invite_id)
+        pub.url = urljoin(CONFIG.instance_url, f'c/{pub.cell_id}')
+        pub.state = 'done'
+        print(pub.join_url)
+    elif created:
+      from nanoid import generate
+      callbacks = [generate() for _ in created]
+      for pub, callback in zip(created, callbacks):
+        pub.join_url = join_url(pub.invite_id, callback)
+        pub.state = 'waiting for confirmation'
+      # invites are per cell: open the first one, the others are listed
+      if has_browser():
+        import click
+        click.launch(created[0].join_url)
+      print('\nGo to these URLs to finalize your publications:')
+      for pub in created:
+        print(pub.join_url)
+      deadline = monotonic() + CONFIG.callback_timeout
+      for pub, callback in zip(created, callbacks):
+        try:
+          # later cells are usually confirmed while waiting for the first ones
+          await pub.client.wait_for_callback(callback, timeout=max(deadline - monotonic(), 1), cancel=pub.cancelled)
+        except PollTimeout:
+          pub.fail(f'Publication was not confirmed in time, go to {pub.join_url} to finalize it')
+          continue
+        except Exception as err:
+          pub.fail(err)
+          continue
+        pub.url = urljoin(CONFIG.instance_url, f'c/{pub.cell_id}')
+        pub.state = 'done'
+
+    if any(pub.url for pub in pubs):
+      print('\nUse these URLs to share:')
+    for pub in pubs:
+      if pub.url:
+        print(f"{pub.url} {pub.title!r}")
       else:
-        print('\nGo to this URL to finalize your publication:\n' + join_url)
-      
-      poll(4, lambda: client.get_callback(callback) == callback)
-      print('\nUse this URL to share:\n' + cell_url)
+        print(f"{pub.title!r}: {pub.error}", file=sys.stderr)
 
 
 get_ipython().register_magics(PublishMagic)
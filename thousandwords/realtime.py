@@ -0,0 +1,139 @@
+import json
+import time
+import uuid
+import base64
+from logging import getLogger
+from typing import Optional
+from urllib.parse import urlparse
+
+logger = getLogger("thousandwords.realtime")
+
+class SubscriptionUnavailable(Exception):
+  pass
+
+def available() -> bool:
+  try:
+    import websocket
+    return True
+  except ImportError:
+    return False
+
+def realtime_url(endpoint: str) -> str:
+  """wss URL of the AppSync real-time endpoint paired with a GraphQL endpoint"""
+  host = urlparse(endpoint).netloc
+  if '.appsync-api.' not in host:
+    raise SubscriptionUnavailable(f"No real-time endpoint known for {host}")
+  return f"wss://{host.replace('.appsync-api.', '.appsync-realtime-api.')}/graphql"
+
+def _signed_headers(auth, url: str, body: str) -> dict:
+  """Headers AppSync expects in real-time messages: those of a signed POST of body to url"""
+  import requests
+  req = requests.Request('POST', url, data=body, headers={
+    'accept': 'application/json, text/javascript',
+    'content-encoding': 'amz-1.0',
+    'content-type': 'application/json; charset=UTF-8',
+  }).prepare()
+  req = auth(req)
+  headers = {k: v for k, v in req.headers.items() if k.lower() != 'content-length'}
+  headers['host'] = urlparse(url).netloc
+  return headers
+
+class Subscription:
+  """One GraphQL subscription over the AppSync real-time websocket protocol.
+
+    with Subscription(endpoint, auth, query, variables) as sub:
+      data = sub.next(timeout=5)
+
+  auth is a requests auth (SigV4 signer or JWT) used to sign the handshake and the start message.
+  """
+
+  def __init__(self, endpoint: str, auth, query: str, variables: Optional[dict] = None):
+    self._endpoint = endpoint
+    self._auth = auth
+    self._query = query
+    self._variables = variables or {}
+    self._id = str(uuid.uuid4())
+    self._ws = None
+
+  def __enter__(self):
+    try:
+      import websocket
+    except ImportError:
+      raise SubscriptionUnavailable("websocket-client is not installed")
+    url = realtime_url(self._endpoint)
+    header = _signed_headers(self._auth, self._endpoint.rstrip('/') + '/connect', '{}')
+    query = (
+      f"header={base64.b64encode(json.dumps(header).encode()).decode()}"
+      f"&payload={base64.b64encode(b'{}').decode()}"
+    )
+    logger.debug(f"Connecting to {url}")
+    try:
+      self._ws = websocket.create_connection(f"{url}?{query}", subprotocols=['graphql-ws'], timeout=10)
+      self._send({'type': 'connection_init'})
+      self._expect('connection_ack')
+      data = json.dumps({'query': self._query, 'variables': self._variables})
+      self._send({
+        'id': self._id,
+        'type': 'start',
+        'payload': {
+          'data': data,
+          'extensions': {'authorization': _signed_headers(self._auth, self._endpoint, data)},
+        },
+      })
+      self._expect('start_ack')
+    except SubscriptionUnavailable:
+      self.close()
+      raise
+    except Exception as e:
+      self.close()
+      raise SubscriptionUnavailable(f"Subscription failed: {e}") from e
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+    return False
+
+  def next(self, timeout: float) -> Optional[dict]:
+    """Next data payload, None if nothing came within timeout seconds.
+
+    Raises SubscriptionUnavailable once the connection is lost.
+    """
+    import websocket
+    deadline = time.monotonic() + timeout
+    while True:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        return None
+      try:
+        self._ws.settimeout(remaining)
+        msg = json.loads(self._ws.recv())
+      except websocket.WebSocketTimeoutException:
+        return None
+      except (websocket.WebSocketException, OSError) as e:
+        raise SubscriptionUnavailable(f"Subscription connection lost: {e}") from e
+      if msg.get('type') == 'data' and msg.get('id') == self._id:
+        return msg['payload']['data']
+      if msg.get('type') in ('error', 'connection_error', 'complete'):
+        raise SubscriptionUnavailable(f"Subscription ended: {msg}")
+      # 'ka' keep-alives and messages for other ids
+
+  def close(self) -> None:
+    if self._ws is None:
+      return
+    try:
+      self._send({'type': 'stop', 'id': self._id})
+      self._ws.close()
+    except Exception:
+      pass
+    self._ws = None
+
+  def _send(self, msg: dict) -> None:
+    self._ws.send(json.dumps(msg))
+
+  def _expect(self, type: str) -> dict:
+    while True:
+      msg = json.loads(self._ws.recv())
+      if msg.get('type') == type:
+        return msg
+      if msg.get('type') != 'ka':
+        raise SubscriptionUnavailable(f"Expected {type}, received {msg}")
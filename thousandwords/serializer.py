@@ -0,0 +1,47 @@
+import pickle
+from base64 import b64encode
+from thousandwords_core.serializer import Serializer as CoreSerializer
+from thousandwords_core.serialize import dump
+
+class ChunkWriter:
+  """Binary file object keeping written chunks as they come instead of joining them.
+
+  With pickle protocol 5, the contiguous buffers of ndarrays, pandas blocks and Arrow
+  columns reach write() as PickleBuffers; they are kept as views on the object's memory,
+  so the payload is never copied before upload.
+  """
+
+  def __init__(self):
+    self.chunks = []
+    self.nbytes = 0
+
+  def write(self, data):
+    if isinstance(data, pickle.PickleBuffer):
+      chunk = data.raw()
+    elif isinstance(data, bytes):
+      chunk = data
+    else:
+      chunk = memoryview(data).cast('B')
+    self.chunks.append(chunk)
+    self.nbytes += len(chunk)
+    return len(chunk)
+
+  def getvalue(self) -> bytes:
+    return b''.join(self.chunks)
+
+class Serializer(CoreSerializer):
+  """Serializer handing the put handler a list of chunks rather than one bytes value.
+
+  The stream is a regular in-band pickle, readers load it unchanged. The objects must
+  not be mutated before the chunks are uploaded.
+  """
+
+  def add_default(self, name, obj):
+    value = ChunkWriter(); dump(obj, value, 'cloudpickle')
+    is_small = value.nbytes < (2 ** 10) * 0.66
+    if is_small:
+      value = b64encode(value.getvalue()).decode()
+      self.appendNs(name, 'b64.cloudpickle', value=value)
+    else:
+      key = self.put(name, value.chunks)
+      self.appendNs(name, 'cloudpickle', key=key)
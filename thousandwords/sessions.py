@@ -0,0 +1,47 @@
+from __future__ import annotations
+import threading
+from logging import getLogger
+from typing import TYPE_CHECKING
+from .config import CONFIG
+
+if TYPE_CHECKING:
+  import requests
+
+logger = getLogger("thousandwords.sessions")
+
+_lock = threading.Lock()
+_session = None
+
+def get_session() -> requests.Session:
+  """Process-wide keep-alive session, shared by every Client and thread"""
+  global _session
+  with _lock:
+    if _session is None:
+      _session = _new_session()
+    return _session
+
+def _new_session() -> requests.Session:
+  import requests
+  from requests.adapters import HTTPAdapter
+  from urllib3.util.retry import Retry
+  logger.debug(f"Creating HTTP session (pool size {CONFIG.http_pool_size}, {CONFIG.http_retries} connect retries)")
+  # only failures to connect, the request was never sent so even POSTs are safe to resend;
+  # statuses and timeouts are left to the per-operation policies
+  retry = Retry(
+    total=None,
+    connect=CONFIG.http_retries,
+    read=0,
+    status=0,
+    other=0,
+    backoff_factor=CONFIG.http_backoff,
+    raise_on_status=False,
+  )
+  adapter = HTTPAdapter(
+    pool_connections=CONFIG.http_pool_size,
+    pool_maxsize=CONFIG.http_pool_size,
+    max_retries=retry,
+  )
+  session = requests.Session()
+  session.mount("https://", adapter)
+  session.mount("http://", adapter)
+  return session
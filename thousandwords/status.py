@@ -44,19 +44,36 @@ class RepeatedTimer(object):
     self.is_running = False
 
 class Status:
-  def __init__(self, text):
+  def __init__(self, text, quiet=False):
     self.text = text
+    self.quiet = quiet
     self.writer = Writer()
 
   def __enter__(self):
+    if self.quiet:
+      return self
     self._timer = RepeatedTimer(1, self.writer.write, '.')
     self.writer.write(f'{self.text} ')
     return self
 
   def __exit__(self, exc_type, exc_value, traceback):
+    if self.quiet:
+      return False
     self._timer.stop()
     if exc_value is not None:
       self.writer.write('[Failure]', finish=True)
     else:
       self.writer.write('[Success]', finish=True)
     return False
+
+class Progress(Status):
+  """One spinner for a batch of concurrent tasks, ticking a counter as each completes"""
+  def __init__(self, text, total, quiet=False):
+    super().__init__(text, quiet=quiet)
+    self.total = total
+    self.done = 0
+
+  def advance(self):
+    self.done = self.done + 1
+    if not self.quiet:
+      self.writer.write(f' {self.done}/{self.total} ')
@@ -0,0 +1,234 @@
+import io
+import uuid
+from collections import deque
+from logging import getLogger
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Tuple
+from .config import CONFIG
+from .status import Progress
+
+logger = getLogger("thousandwords.transfer")
+
+# S3 rejects multipart parts smaller than this, except for the last one
+MIN_PART_SIZE = 5 * 2 ** 20
+
+class BufferReader(io.RawIOBase):
+  """Seekable file object over a bytes-like value, reading without copying it whole"""
+
+  def __init__(self, buf):
+    self._buf = memoryview(buf).cast('B')
+    self._pos = 0
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def tell(self):
+    return self._pos
+
+  def seek(self, offset, whence=io.SEEK_SET):
+    if whence == io.SEEK_CUR:
+      offset = self._pos + offset
+    elif whence == io.SEEK_END:
+      offset = len(self._buf) + offset
+    self._pos = max(0, offset)
+    return self._pos
+
+  def readinto(self, b):
+    chunk = self._buf[self._pos:self._pos + len(b)]
+    n = len(chunk)
+    b[:n] = chunk
+    self._pos += n
+    return n
+
+class IterReader(io.RawIOBase):
+  """File object over an iterable of bytes-like chunks, e.g. a generator"""
+
+  def __init__(self, chunks):
+    self._chunks = iter(chunks)
+    self._current = memoryview(b'')
+
+  def readable(self):
+    return True
+
+  def readinto(self, b):
+    while not len(self._current):
+      try:
+        self._current = memoryview(next(self._chunks)).cast('B')
+      except StopIteration:
+        return 0
+    n = min(len(b), len(self._current))
+    b[:n] = self._current[:n]
+    self._current = self._current[n:]
+    return n
+
+def as_readable(source):
+  """Wrap bytes-like values, file objects and chunk iterables into a binary file object"""
+  if isinstance(source, (bytes, bytearray, memoryview)):
+    return BufferReader(source)
+  if hasattr(source, 'read'):
+    return source
+  if isinstance(source, str):
+    raise TypeError("upload source must be binary, not str")
+  # BufferedReader keeps reading until a whole part is filled, short parts are rejected by S3
+  return io.BufferedReader(IterReader(source), buffer_size=MIN_PART_SIZE)
+
+def upload_stream(s3, bucket, key, source, part_size=None, max_concurrency=None, extra_args=None):
+  """Upload source to s3 in parts of part_size, max_concurrency parts at a time.
+
+  Sources smaller than one part are sent with a single PUT. extra_args are object
+  parameters such as ContentEncoding.
+  """
+  from .lite import LiteS3
+  if isinstance(s3, LiteS3):
+    from .lite import TransferConfig
+  else:
+    from boto3.s3.transfer import TransferConfig
+  part_size = max(int(part_size or CONFIG.multipart_part_size), MIN_PART_SIZE)
+  max_concurrency = int(max_concurrency or CONFIG.multipart_concurrency)
+  config = TransferConfig(
+    multipart_threshold=part_size,
+    multipart_chunksize=part_size,
+    max_concurrency=max_concurrency,
+    use_threads=max_concurrency > 1,
+  )
+  logger.debug(f"Streaming upload to {key} (part size {part_size}, concurrency {max_concurrency})")
+  s3.upload_fileobj(as_readable(source), bucket, key, ExtraArgs=extra_args, Config=config)
+
+def parse_range(spec: str, size: int) -> Tuple[int, int]:
+  """(first, last) byte offsets, inclusive, of an HTTP-style range: START-END, START- or -SUFFIX"""
+  try:
+    start, _, end = spec.strip().partition('-')
+    if not start:
+      first, last = max(size - int(end), 0), size - 1
+    else:
+      first, last = int(start), min(int(end), size - 1) if end else size - 1
+  except ValueError:
+    raise ValueError(f"Invalid range '{spec}', expected START-END, START- or -SUFFIX")
+  if first > last and size:
+    raise ValueError(f"Range '{spec}' is outside of the {size} bytes object")
+  return first, last
+
+def download_chunks(s3, bucket, key, first, last, etag=None, part_size=None, max_concurrency=None, chunk_size=2 ** 20):
+  """Bytes first to last (inclusive) of an object, in order, as a generator of chunks.
+
+  Ranges of two parts or more are fetched as ranged GETs of part_size, max_concurrency
+  of them in flight; memory stays around (max_concurrency + 1) * part_size whatever the
+  object size. With etag, a GET fails rather than return bytes from another version.
+  """
+  if last < first:
+    return
+  part_size = max(int(part_size or CONFIG.multipart_part_size), MIN_PART_SIZE)
+  max_concurrency = int(max_concurrency or CONFIG.multipart_concurrency)
+  args = {'IfMatch': etag} if etag else {}
+  if max_concurrency < 2 or last - first + 1 < 2 * part_size:
+    body = s3.get_object(Bucket=bucket, Key=key, Range=f'bytes={first}-{last}', **args)['Body']
+    yield from iter(lambda: body.read(chunk_size), b'')
+    return
+  ranges = deque((start, min(start + part_size, last + 1) - 1) for start in range(first, last + 1, part_size))
+  def fetch(start, end):
+    return s3.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end}', **args)['Body'].read()
+  logger.debug(f"Downloading {key} in {len(ranges)} ranges (part size {part_size}, concurrency {max_concurrency})")
+  with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+    pending = deque()
+    try:
+      while ranges or pending:
+        while ranges and len(pending) < max_concurrency:
+          pending.append(pool.submit(fetch, *ranges.popleft()))
+        yield pending.popleft().result()
+    finally:
+      # the consumer stopped early or a range failed
+      for future in pending:
+        future.cancel()
+
+class UploadError(Exception):
+  def __init__(self, failures):
+    self.failures = failures
+
+  def __str__(self) -> str:
+    lines = [f"Failed to upload {len(self.failures)} dependenc{'ies' if len(self.failures) > 1 else 'y'}:"]
+    for name, key, err in self.failures:
+      lines.append(f"  '{name}' ({key}): {err}")
+    return '\n'.join(lines)
+
+class Uploader:
+  """Collects uploads scheduled by the Serializer and runs them on a bounded thread pool.
+
+  With an UploadIndex, payloads get content-addressed keys and the ones already
+  present in the bucket are not uploaded again.
+  """
+
+  def __init__(self, client, max_workers=None, index=None):
+    self._client = client
+    self._max_workers = max_workers or CONFIG.upload_concurrency
+    self._index = index
+    self._tasks = []
+    self.done = 0
+    self.total = 0
+
+  def __len__(self):
+    return len(self._tasks)
+
+  def schedule(self, name, data):
+    digest = self._index.digest(data) if self._index is not None else None
+    if digest:
+      key = f'uploads/{digest}'
+      if any(k == key for _, k, _, _ in self._tasks):
+        return key
+    else:
+      key = f'uploads/{str(uuid.uuid4())}'
+    self._tasks.append((name, key, data, digest))
+    return key
+
+  def _transfer(self, key, data, digest):
+    if digest:
+      if self._index.lookup(digest) == key and self._client.exists(key):
+        logger.info(f"Skipping upload of unchanged {key}")
+        return
+      self._index.discard(digest)
+    self._client.upload_stream(key, data)
+    if digest:
+      self._index.record(digest, key)
+
+  def snapshot(self):
+    """Copy chunked payloads, which may be views on live objects, before a deferred run"""
+    self._tasks = [
+      (name, key, b''.join(data) if isinstance(data, list) else data, digest)
+      for name, key, data, digest in self._tasks
+    ]
+
+  def run(self, quiet=False):
+    if not self._tasks:
+      return
+    names = sorted(set([name for name, _, _, _ in self._tasks]))
+    namestr = ', '.join([f"'{n}'" for n in names])
+    text = f"Uploading dependenc{'ies' if len(names) > 1 else 'y'} {namestr}"
+    # create the shared s3 client before fanning out, boto3 session setup isn't thread-safe
+    self._client.s3
+    self.done, self.total = 0, len(self._tasks)
+    failures = []
+    try:
+      with Progress(text, len(self._tasks), quiet=quiet) as progress:
+        workers = min(self._max_workers, len(self._tasks))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+          futures = {
+            pool.submit(self._transfer, key, data, digest): (name, key)
+            for name, key, data, digest in self._tasks
+          }
+          for future in as_completed(futures):
+            name, key = futures[future]
+            try:
+              future.result()
+            except Exception as err:
+              logger.debug(f"Upload of '{name}' to {key} failed: {err}")
+              failures.append((name, key, err))
+            progress.advance()
+            self.done = progress.done
+        if failures:
+          raise UploadError(failures)
+    finally:
+      if self._index is not None:
+        self._index.save()
+    self._tasks = []